@@ -0,0 +1,82 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark conversion of isodate fields of queried documents.
+
+Compares the compiled per-collection encoder against a dotted path
+lookup per field per document. Does not require MongoDB::
+
+    python benchmarks/conversion.py --documents 100000
+
+"""
+import argparse
+import copy
+import time
+
+from bson import ObjectId
+
+from cdcagg_docstore.conversion import (
+    datetime_to_datestamp,
+    document_encoder
+)
+from cdcagg_docstore.mdb import studies_collection
+from studies import study_documents
+
+
+def _convert_path(document, path, func):
+    *parents, leaf = path.split('.')
+    for key in parents:
+        document = document.get(key)
+        if not isinstance(document, dict):
+            return
+    value = document.get(leaf)
+    if value is not None:
+        document[leaf] = func(value)
+
+
+def _per_path_encode(collection, documents):
+    for document in documents:
+        for path in collection.isodate_fields:
+            _convert_path(document, path, datetime_to_datestamp)
+
+
+def _compiled_encode(collection, documents):
+    for document in documents:
+        document_encoder(collection).convert(document)
+
+
+def _timed(func, collection, documents):
+    start = time.monotonic()
+    func(collection, documents)
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=3)
+    settings = parser.parse_args()
+    collection = studies_collection()
+    print('Generating %s documents ...' % (settings.documents,))
+    documents = list(study_documents(settings.documents, sizes=('small',)))
+    for document in documents:
+        document['_id'] = ObjectId()
+    print('%16s %12s %14s' % ('method', 'seconds', 'documents/s'))
+    for _ in range(settings.rounds):
+        for name, func in (('per-path encode', _per_path_encode),
+                           ('compiled encode', _compiled_encode)):
+            seconds = _timed(func, collection, copy.deepcopy(documents))
+            print('%16s %12.3f %14.0f' % (name, seconds, settings.documents / seconds))
+
+
+if __name__ == '__main__':
+    main()
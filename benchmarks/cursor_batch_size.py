@@ -0,0 +1,145 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark documents per second of streamed select queries
+against cursor batch size.
+
+Requires a running MongoDB. Inserts generated Study documents into
+a scratch database, which is dropped afterwards. Documents are
+streamed with back-pressure to a client reading from a local socket,
+so that adaptive batch sizing reacts to the duration of real
+flushes. `--client-delay` simulates a slow client::
+
+    python benchmarks/cursor_batch_size.py --mongodb-uri mongodb://localhost:27017 --documents 20000
+
+"""
+import argparse
+import asyncio
+import socket
+import time
+
+from bson import json_util
+from motor.motor_tornado import MotorClient
+from tornado.ioloop import IOLoop
+from tornado.iostream import (
+    IOStream,
+    StreamClosedError
+)
+
+from cdcagg_docstore.streaming import (
+    AdaptiveBatchSize,
+    BackPressureWriter,
+    DEFAULT_HIGH_WATER_MARK,
+    adaptive_batches
+)
+from studies import study_documents
+
+
+class _SocketHandler:
+    """Request handler stand-in writing to a local socket."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._chunks = []
+
+    def write(self, chunk):
+        self._chunks.append(chunk)
+
+    def flush(self):
+        chunk = b''.join(self._chunks)
+        self._chunks = []
+        return self._stream.write(chunk)
+
+
+async def _read(stream, delay):
+    try:
+        while True:
+            await stream.read_bytes(64 * 1024, partial=True)
+            if delay:
+                await asyncio.sleep(delay)
+    except StreamClosedError:
+        pass
+
+
+async def _populate(collection, count):
+    await collection.drop()
+    batch = []
+    for document in study_documents(count):
+        batch.append(document)
+        if len(batch) == 1000:
+            await collection.insert_many(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch)
+
+
+async def _stream(documents, settings, batch_sizer=None):
+    server_socket, client_socket = socket.socketpair()
+    server, client = IOStream(server_socket), IOStream(client_socket)
+    reader = asyncio.ensure_future(_read(client, settings.client_delay))
+    writer = BackPressureWriter(_SocketHandler(server), high_water_mark=settings.high_water_mark,
+                                batch_sizer=batch_sizer)
+    count = 0
+    start = time.monotonic()
+    try:
+        async for document in documents:
+            await writer.write(json_util.dumps(document))
+            count += 1
+        await writer.drain()
+        return count, time.monotonic() - start
+    finally:
+        server.close()
+        await reader
+        client.close()
+
+
+async def run(settings):
+    client = MotorClient(settings.mongodb_uri)
+    collection = client[settings.database_name]['studies']
+    try:
+        print('Inserting %s documents ...' % (settings.documents,))
+        await _populate(collection, settings.documents)
+        print('%12s %12s %12s %14s' % ('batch_size', 'documents', 'seconds', 'documents/s'))
+        for batch_size in settings.batch_sizes:
+            kwargs = {'batch_size': batch_size} if batch_size else {}
+            for _ in range(settings.rounds):
+                documents, seconds = await _stream(collection.find({}, **kwargs), settings)
+                print('%12s %12s %12.3f %14.0f' % (batch_size or 'default', documents, seconds,
+                                                    documents / seconds))
+        for _ in range(settings.rounds):
+            sizer = AdaptiveBatchSize(min(settings.batch_sizes) or 100, max(settings.batch_sizes))
+            cursor = collection.aggregate([{'$match': {}}], batchSize=sizer.size)
+            documents, seconds = await _stream(adaptive_batches(cursor, sizer), settings, batch_sizer=sizer)
+            print('%12s %12s %12.3f %14.0f' % ('adaptive:%s' % (sizer.size,), documents, seconds,
+                                                documents / seconds))
+    finally:
+        await client.drop_database(settings.database_name)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017')
+    parser.add_argument('--database-name', default='cdcagg_benchmark')
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[0, 100, 500, 1000, 5000])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--high-water-mark', type=int, default=DEFAULT_HIGH_WATER_MARK,
+                        help='Bytes to buffer before flushing to the client')
+    parser.add_argument('--client-delay', type=float, default=0,
+                        help='Seconds the client sleeps after each read')
+    settings = parser.parse_args()
+    IOLoop.current().run_sync(lambda: run(settings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Load test of the DocStore HTTP API.
+
+Serves the DocStore application on a local port and drives a
+mixed workload of REST API reads and writes, Query API queries,
+multi-get requests and bulk upserts against it. A bulk upsert
+re-harvests a batch of stored studies one upsert at a time, half of
+them with changed content. Its latency is the time to upsert the
+whole batch.
+
+Reports throughput and latency percentiles per workload and the
+maximum resident set size of the process. Peak traced memory is
+measured in a separate pass with tracemalloc, since tracing slows
+down allocations and would distort the latencies.
+
+Requires a running MongoDB. Inserts generated Study documents into
+a scratch database, which is dropped afterwards::
+
+    python benchmarks/load_test.py --mongodb-uri mongodb://localhost:27017 --documents 10000 --requests 5000
+
+Alternatively use mongomock-motor as an in-memory stand-in for
+MongoDB. Note that the stand-in does not reflect the performance of
+MongoDB, but it does measure the overhead of DocStore itself::
+
+    python benchmarks/load_test.py --mongomock
+
+"""
+import argparse
+import json
+import math
+import random
+import resource
+import time
+import tracemalloc
+
+from bson import json_util
+from tornado import gen
+from tornado.httpclient import (
+    AsyncHTTPClient,
+    HTTPClientError
+)
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+from cdcagg_docstore import (
+    collection_registry,
+    controller
+)
+from cdcagg_docstore.http_api import get_app
+from studies import (
+    study_document,
+    study_documents
+)
+
+
+#: Workloads and their default weights in the mix.
+WORKLOADS = {
+    'rest_get': 40,
+    'rest_post': 5,
+    'query_select': 20,
+    'query_count': 10,
+    'multiget': 25,
+    'bulk_upsert': 1,
+}
+
+
+def _patch_mongomock():
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit('--mongomock requires mongomock-motor: pip install mongomock-motor')
+    from kuha_document_store import database
+    controller.MotorClient = AsyncMongoMockClient
+    database.MotorClient = AsyncMongoMockClient
+
+
+async def _populate(db, collection_name, count):
+    collection = db.editor_collection(collection_name)
+    await collection.drop()
+    definition = collection_registry().get(collection_name)
+    for index in definition.indexes_unique:
+        await collection.create_index(index, unique=True)
+    for index in definition.indexes:
+        await collection.create_index(index)
+    for index in definition.partial_indexes:
+        await collection.create_index(index.keys, name=index.name,
+                                      partialFilterExpression=index.partial_filter_expression)
+    ids, agg_ids, batch = [], [], []
+    for document in study_documents(count):
+        batch.append(document)
+        if len(batch) == 1000:
+            result = await collection.insert_many(batch)
+            ids.extend(str(_id) for _id in result.inserted_ids)
+            agg_ids.extend(doc['_aggregator_identifier'] for doc in batch)
+            batch = []
+    if batch:
+        result = await collection.insert_many(batch)
+        ids.extend(str(_id) for _id in result.inserted_ids)
+        agg_ids.extend(doc['_aggregator_identifier'] for doc in batch)
+    return ids, agg_ids
+
+
+class Workload:
+    """Builds requests of the workload mix.
+
+    :param str base_url: Base URL of the served application.
+    :param list ids: ObjectIds of stored studies.
+    :param list agg_ids: Aggregator identifiers of stored studies.
+    :param int new_index: Running number of the first study created
+                          by the REST API writes.
+    :param int bulk_size: Number of upserts in a bulk upsert.
+    """
+
+    def __init__(self, base_url, ids, agg_ids, new_index, bulk_size=50):
+        self.base_url = base_url
+        self.ids = ids
+        self.agg_ids = agg_ids
+        self._new_index = new_index
+        self._bulk_size = bulk_size
+        self._rnd = random.Random(0)
+
+    def _post(self, path, body):
+        return self.base_url + path, {'method': 'POST', 'body': json.dumps(body),
+                                      'headers': {'Content-Type': 'application/json'}}
+
+    def rest_get(self):
+        return self.base_url + '/v0/studies/' + self._rnd.choice(self.ids), {}
+
+    def rest_post(self):
+        document = study_document(self._new_index)
+        self._new_index += 1
+        document.pop('_metadata')
+        return self.base_url + '/v0/studies', {'method': 'POST', 'body': json_util.dumps(document),
+                                               'headers': {'Content-Type': 'application/json'}}
+
+    def query_select(self):
+        return self._post('/v0/query/studies', {'_filter': {'_metadata.status': 'created'},
+                                                'sort_by': '_metadata.updated', 'sort_order': -1,
+                                                'skip': self._rnd.randint(0, 100), 'limit': 50})
+
+    def query_count(self):
+        return self._post('/v0/query/studies?query_type=count',
+                          {'_filter': {'_direct_base_url': self._rnd.choice(
+                              ['https://oai.example-%s.org/v0/oai' % (index,) for index in range(12)])}})
+
+    def multiget(self):
+        return self._post('/v0/query/studies/multiget', {'ids': self._rnd.sample(self.agg_ids, 100)})
+
+    def bulk_upsert(self):
+        requests = []
+        for index in self._rnd.sample(range(len(self.agg_ids)), min(self._bulk_size, len(self.agg_ids))):
+            document = next(study_documents(1, start=index))
+            document.pop('_metadata')
+            if self._rnd.random() < 0.5:
+                document['persistent_identifiers'].append('doi:10.1234/%s.v%s' % (
+                    index, self._rnd.randint(2, 1000000)))
+            requests.append((self.base_url + '/v0/upsert/studies', {
+                'method': 'PUT', 'body': json_util.dumps(document),
+                'headers': {'Content-Type': 'application/json'}}))
+        return requests
+
+    def next_request(self, names, weights):
+        """Pick next request from the mix.
+
+        :returns: Tuple of workload name and list of URL and request
+                  keyword argument pairs. The requests are sent one
+                  after another.
+        """
+        name = self._rnd.choices(names, weights)[0]
+        requests = getattr(self, name)()
+        return name, requests if isinstance(requests, list) else [requests]
+
+
+def percentile(values, pct):
+    """Get percentile of sorted values using nearest rank.
+
+    :param list values: Sorted values.
+    :param float pct: Percentile between 0 and 100.
+    """
+    if not values:
+        return float('nan')
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+async def _drive(client, workload, settings, requests, latencies, errors):
+    names = list(WORKLOADS)
+    weights = [getattr(settings, 'weight_' + name) for name in names]
+    remaining = [requests]
+
+    async def _worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            name, batch = workload.next_request(names, weights)
+            start = time.monotonic()
+            try:
+                for url, kwargs in batch:
+                    await client.fetch(url, request_timeout=settings.request_timeout, **kwargs)
+            except HTTPClientError as exc:
+                errors[name] = errors.get(name, 0) + 1
+                if exc.code == 599:
+                    continue
+            except OSError:
+                # Connection refused or reset before a response.
+                errors[name] = errors.get(name, 0) + 1
+                continue
+            latencies.setdefault(name, []).append(time.monotonic() - start)
+
+    start = time.monotonic()
+    await gen.multi([_worker() for _ in range(settings.concurrency)])
+    return time.monotonic() - start
+
+
+def _report(latencies, errors, seconds):
+    print('%14s %9s %7s %10s %10s %10s %10s' % ('workload', 'requests', 'errors', 'req/s',
+                                                 'p50 ms', 'p95 ms', 'p99 ms'))
+    everything = []
+    for name in WORKLOADS:
+        values = sorted(latencies.get(name, []))
+        everything.extend(values)
+        print('%14s %9s %7s %10.1f %10.2f %10.2f %10.2f' % (
+            name, len(values), errors.get(name, 0), len(values) / seconds,
+            percentile(values, 50) * 1000, percentile(values, 95) * 1000, percentile(values, 99) * 1000))
+    everything.sort()
+    print('%14s %9s %7s %10.1f %10.2f %10.2f %10.2f' % (
+        'total', len(everything), sum(errors.values()), len(everything) / seconds,
+        percentile(everything, 50) * 1000, percentile(everything, 95) * 1000,
+        percentile(everything, 99) * 1000))
+    print('Max RSS: %.1f MiB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,))
+
+
+async def run(settings):
+    db = controller.CDCAggDatabase(collections=list(collection_registry()), name=settings.database_name,
+                                   reader_uri=settings.mongodb_uri, editor_uri=settings.mongodb_uri,
+                                   query_max_time_ms=60000)
+    sockets = bind_sockets(0, '127.0.0.1')
+    server = HTTPServer(get_app('v0', ['studies'], db=db, multiget_max_ids=1000))
+    server.add_sockets(sockets)
+    client = AsyncHTTPClient(max_clients=settings.concurrency)
+    try:
+        print('Inserting %s documents ...' % (settings.documents,))
+        ids, agg_ids = await _populate(db, 'studies', settings.documents)
+        workload = Workload('http://127.0.0.1:%s' % (sockets[0].getsockname()[1],),
+                            ids, agg_ids, settings.documents, bulk_size=settings.bulk_size)
+        print('Running %s requests with concurrency %s ...' % (settings.requests, settings.concurrency))
+        latencies, errors = {}, {}
+        seconds = await _drive(client, workload, settings, settings.requests, latencies, errors)
+        _report(latencies, errors, seconds)
+        if settings.memory_requests > 0:
+            print('Running %s requests with memory tracing ...' % (settings.memory_requests,))
+            tracemalloc.start()
+            await _drive(client, workload, settings, settings.memory_requests, {}, {})
+            _, peak_traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('Peak traced memory: %.1f MiB' % (peak_traced / 1024 / 1024,))
+    finally:
+        server.stop()
+        client.close()
+        await db.editor_collection('studies').database.client.drop_database(settings.database_name)
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017')
+    parser.add_argument('--mongomock', action='store_true',
+                        help='Use mongomock-motor in place of MongoDB')
+    parser.add_argument('--database-name', default='cdcagg_benchmark')
+    parser.add_argument('--documents', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--request-timeout', type=float, default=60)
+    parser.add_argument('--bulk-size', type=int, default=50,
+                        help='Number of upserts in a bulk upsert')
+    parser.add_argument('--memory-requests', type=int, default=1000,
+                        help='Requests of the memory tracing pass. 0 skips the pass')
+    for name, weight in WORKLOADS.items():
+        parser.add_argument('--weight-%s' % (name.replace('_', '-'),), type=int, default=weight,
+                            help='Weight of %s in the workload mix' % (name,))
+    settings = parser.parse_args()
+    if settings.mongomock:
+        _patch_mongomock()
+    IOLoop.current().run_sync(lambda: run(settings))
+
+
+if __name__ == '__main__':
+    main()
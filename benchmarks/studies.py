@@ -0,0 +1,92 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Generate realistic Study documents for benchmarks.
+
+Documents mimic harvested studies: localized titles and abstracts,
+tens to hundreds of keywords in several languages, principal
+investigators, publishers and provenance information.
+"""
+import datetime
+import hashlib
+import random
+
+
+LANGUAGES = ('en', 'fi', 'de', 'fr', 'sv', 'nl', 'cs', 'sl')
+BASE_URLS = tuple('https://oai.example-%s.org/v0/oai' % (index,) for index in range(12))
+_WORDS = ('survey', 'election', 'health', 'migration', 'labour', 'youth', 'values', 'climate',
+          'income', 'education', 'housing', 'media', 'religion', 'family', 'trust', 'panel',
+          'wellbeing', 'attitudes', 'employment', 'mobility', 'ageing', 'gender', 'crime')
+
+
+def _text(rnd, words):
+    return ' '.join(rnd.choice(_WORDS) for _ in range(words))
+
+
+def _localized(rnd, key, languages, words):
+    return [{key: _text(rnd, words), 'language': language} for language in languages]
+
+
+def study_document(index, size='medium', seed=None):
+    """Generate a Study document.
+
+    :param int index: Running number of the document. Makes
+                      identifiers unique.
+    :param str size: Document size: 'small', 'medium' or 'large'.
+    :param seed: Optional seed for random generator.
+    :returns: Study document as stored in MongoDB.
+    :rtype: dict
+    """
+    rnd = random.Random(index if seed is None else seed)
+    n_languages, n_keywords, abstract_words = {'small': (1, 5, 40),
+                                               'medium': (3, 40, 200),
+                                               'large': (8, 400, 1000)}[size]
+    languages = rnd.sample(LANGUAGES, n_languages)
+    base_url = rnd.choice(BASE_URLS)
+    identifier = 'oai:example:%s' % (index,)
+    agg_id = hashlib.sha256((base_url + identifier).encode('utf8')).hexdigest()
+    now = datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=index)
+    return {
+        '_aggregator_identifier': agg_id,
+        '_direct_base_url': base_url,
+        'study_number': 'study_%s' % (index,),
+        'study_titles': _localized(rnd, 'study_title', languages, 8),
+        'abstract': _localized(rnd, 'abstract', languages, abstract_words),
+        'keywords': [{'keyword': _text(rnd, 2), 'language': rnd.choice(languages),
+                      'system_name': 'ELSST', 'uri': 'https://elsst.cessda.eu/id/%s' % (rnd.randint(1, 9999),),
+                      'description': _text(rnd, 3)}
+                     for _ in range(n_keywords)],
+        'principal_investigators': [{'principal_investigator': _text(rnd, 2), 'language': language,
+                                     'organization': _text(rnd, 3)} for language in languages],
+        'publishers': _localized(rnd, 'publisher', languages, 3),
+        'publication_years': [{'publication_year': str(rnd.randint(1970, 2024)), 'language': language}
+                              for language in languages],
+        'persistent_identifiers': ['doi:10.1234/%s' % (index,)],
+        '_provenance': [{'base_url': base_url, 'identifier': identifier,
+                         'datestamp': '2024-01-01T00:00:00Z',
+                         'metadata_namespace': 'ddi:codebook:2_5',
+                         'direct': True, 'altered': False}],
+        '_metadata': {'created': now, 'updated': now, 'deleted': None,
+                      'status': 'created', 'cmm_type': 'study', 'schema_version': '1.0'}
+    }
+
+
+def study_documents(count, sizes=('small', 'medium', 'medium', 'large'), start=0):
+    """Generate Study documents of varying size.
+
+    :param int count: Number of documents.
+    :param tuple sizes: Sizes picked in rotation.
+    :param int start: Running number of the first document.
+    :returns: Generator yielding documents.
+    """
+    for index in range(start, start + count):
+        yield study_document(index, size=sizes[index % len(sizes)])
@@ -24,11 +24,26 @@ components use Kuha Common client
 streaming responses. Python programs can use the same approach to
 support streaming responses.
 """
-from cdcagg_common.records import Study
-from .mdb import studies_collection
 
+import functools
 
-_COLLECTIONS = {Study.get_collection(): studies_collection}
+
+@functools.lru_cache(maxsize=None)
+def collection_registry():
+    """Get registry of every defined mdb collection.
+
+    The registry is built once on first call. Record models and
+    collection definitions are imported on first call to keep
+    importing the package and its submodules fast.
+
+    :returns: Collection registry.
+    :rtype: :obj:`cdcagg_docstore.mdb.CollectionRegistry`
+    """
+    from .mdb import (
+        CollectionRegistry,
+        studies_collection
+    )
+    return CollectionRegistry([studies_collection()])
 
 
 def iter_collections():
@@ -39,5 +54,11 @@ def iter_collections():
     :returns: Generator that yields collections.
     :rtype: iterable
     """
-    for coll in _COLLECTIONS.values():
-        yield coll()
+    yield from collection_registry()
+
+
+def __getattr__(name):
+    if name == 'studies_collection':
+        from .mdb import studies_collection
+        return studies_collection
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,285 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Bulk delete of records matching a filter.
+
+Deletes run as background jobs. A job deletes matching records in
+batches and throttles the batches to a maximum rate, so that deleting
+the records of a whole source does not overload the primary. State
+and progress of jobs are stored in the database. Each batch selects
+records that still match, which makes jobs resumable.
+
+A job is run by the process holding its lease. The lease is renewed
+after each batch and released when the job finishes or fails. Jobs
+left running by a stopped process are claimed atomically by one of
+the running processes once their lease has expired.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import time
+import uuid
+from bson import ObjectId
+from tornado import gen
+from tornado.ioloop import (
+    IOLoop,
+    PeriodicCallback
+)
+
+from .query import convert_filter
+from .metrics import REGISTRY
+
+
+_logger = logging.getLogger(__name__)
+
+DELETE_TYPE_SOFT = 'soft'
+DELETE_TYPE_HARD = 'hard'
+DELETE_TYPES = (DELETE_TYPE_SOFT, DELETE_TYPE_HARD)
+
+JOB_STATE_RUNNING = 'running'
+JOB_STATE_COMPLETED = 'completed'
+JOB_STATE_FAILED = 'failed'
+
+#: Collection of bulk delete jobs.
+JOBS_COLLECTION = 'bulk_delete_jobs'
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def parse_write_concern(value):
+    """Parse write concern from configuration.
+
+    :param str value: Number of acknowledging members, a tag set
+                      name such as 'majority' or empty string for
+                      the default write concern.
+    :returns: Write concern or None for the default.
+    :rtype: :obj:`pymongo.write_concern.WriteConcern` or None
+    """
+    if not value:
+        return None
+    # The driver is imported on first use to keep startup fast.
+    from pymongo.write_concern import WriteConcern
+    return WriteConcern(w=int(value) if value.isdigit() else value)
+
+
+class BulkDelete:
+    """Runs bulk delete jobs in the background.
+
+    :param db: Database controller.
+    :type db: :obj:`cdcagg_docstore.controller.CDCAggDatabase`
+    :param int batch_size: Maximum number of records deleted at once.
+    :param float max_rate: Maximum number of records deleted per
+                           second. 0 for no limit.
+    :param write_concern: Write concern of the deletes. None for
+                          the default.
+    :type write_concern: :obj:`pymongo.write_concern.WriteConcern`
+    :param float lease_seconds: Lease of a job in seconds. Jobs of a
+                                stopped process are resumed after
+                                the lease has expired.
+    """
+
+    def __init__(self, db, batch_size=500, max_rate=0, write_concern=None, lease_seconds=60):
+        self._db = db
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.write_concern = write_concern
+        self.lease_seconds = lease_seconds
+        #: Identifies the leases of this instance.
+        self.owner = uuid.uuid4().hex
+        self._tasks = {}
+        self._periodic = None
+        self._deleted = REGISTRY.counter('bulk_delete.deleted', 'Records deleted by bulk delete jobs')
+        self._errors = REGISTRY.counter('bulk_delete.errors', 'Failed bulk delete jobs')
+
+    def _jobs(self):
+        return self._db.editor_collection(JOBS_COLLECTION)
+
+    def _lease_expires(self, now):
+        return now + datetime.timedelta(seconds=self.lease_seconds)
+
+    async def submit(self, collection_name, query_filter, delete_type):
+        """Submit bulk delete job.
+
+        :param str collection_name: Name of the collection.
+        :param dict query_filter: Filter from request body in the
+                                  Query API filter grammar.
+        :param str delete_type: :const:`DELETE_TYPE_SOFT` for logical
+                                or :const:`DELETE_TYPE_HARD` for
+                                physical delete.
+        :returns: The submitted job.
+        :rtype: dict
+        :raises: :exc:`cdcagg_docstore.query.QueryError` if filter
+                 is invalid.
+        """
+        convert_filter(query_filter)
+        now = _utcnow()
+        # Filter is stored as JSON since field names of stored
+        # documents may not start with '$'.
+        job = {'collection': collection_name, 'filter': json.dumps(query_filter),
+               'delete_type': delete_type, 'state': JOB_STATE_RUNNING, 'deleted': 0,
+               'error': None, 'created': now, 'updated': now,
+               'owner': self.owner, 'lease_expires': self._lease_expires(now)}
+        result = await self._jobs().insert_one(job)
+        job['_id'] = result.inserted_id
+        self._start(job)
+        return job
+
+    async def get(self, job_id):
+        """Get job by id.
+
+        :param str job_id: Id of the job.
+        :returns: The job or None if not found.
+        :rtype: dict or None
+        """
+        return await self._jobs().find_one({'_id': ObjectId(job_id)})
+
+    async def resume(self):
+        """Claim and resume running jobs whose lease has expired.
+
+        Each job is claimed with a single atomic update, so that
+        a job is resumed by one process only.
+        """
+        # The driver is imported on first use to keep startup fast.
+        from pymongo import ReturnDocument
+        while True:
+            now = _utcnow()
+            job = await self._jobs().find_one_and_update(
+                {'state': JOB_STATE_RUNNING,
+                 '$or': [{'lease_expires': None}, {'lease_expires': {'$lt': now}}]},
+                {'$set': {'owner': self.owner, 'lease_expires': self._lease_expires(now)}},
+                return_document=ReturnDocument.AFTER)
+            if job is None:
+                return
+            _logger.info('Resuming bulk delete job %s', job['_id'])
+            self._start(job)
+
+    def start(self):
+        """Start resuming jobs periodically.
+
+        The first resume starts immediately.
+        """
+        self._periodic = PeriodicCallback(self.resume, self.lease_seconds * 1000)
+        self._periodic.start()
+        IOLoop.current().add_callback(self.resume)
+
+    def stop(self):
+        """Stop resuming jobs periodically."""
+        if self._periodic is not None:
+            self._periodic.stop()
+            self._periodic = None
+
+    def _start(self, job):
+        job_id = job['_id']
+        if job_id in self._tasks:
+            return
+        task = asyncio.ensure_future(self.run(job))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _throttle(self, deleted, started):
+        if self.max_rate <= 0:
+            return
+        remaining = deleted / self.max_rate - (time.monotonic() - started)
+        if remaining > 0:
+            await gen.sleep(remaining)
+
+    async def _finish(self, job, **fields):
+        await self._jobs().update_one({'_id': job['_id'], 'owner': self.owner},
+                                      {'$set': {**fields, 'updated': _utcnow()},
+                                       '$unset': {'owner': True, 'lease_expires': True}})
+
+    async def run(self, job):
+        """Run job until no matching records are left.
+
+        The lease of the job is renewed after each batch. The run
+        stops if another process has claimed the job.
+
+        :param dict job: The job.
+        :returns: Number of records deleted by this run.
+        :rtype: int
+        """
+        total = 0
+        try:
+            query_filter = convert_filter(json.loads(job['filter']))
+            while True:
+                started = time.monotonic()
+                deleted = await self._db.delete_batch(job['collection'], query_filter, job['delete_type'],
+                                                      self.batch_size, write_concern=self.write_concern)
+                total += deleted
+                self._deleted.inc(deleted)
+                now = _utcnow()
+                result = await self._jobs().update_one(
+                    {'_id': job['_id'], 'owner': self.owner},
+                    {'$inc': {'deleted': deleted},
+                     '$set': {'updated': now, 'lease_expires': self._lease_expires(now)}})
+                if result.matched_count == 0:
+                    _logger.warning('Lost lease of bulk delete job %s', job['_id'])
+                    return total
+                if deleted < self.batch_size:
+                    break
+                await self._throttle(deleted, started)
+        except Exception as exc:
+            self._errors.inc()
+            _logger.exception('Bulk delete job %s failed', job['_id'])
+            await self._finish(job, state=JOB_STATE_FAILED, error=str(exc))
+            return total
+        await self._finish(job, state=JOB_STATE_COMPLETED)
+        _logger.info('Bulk delete job %s deleted %s records', job['_id'], total)
+        return total
+
+
+def bulk_delete_from_settings(db, settings):
+    """Instantiate bulk delete from loaded settings.
+
+    :param db: Database controller.
+    :type db: :obj:`cdcagg_docstore.controller.CDCAggDatabase`
+    :param settings: Loaded settings.
+    :type settings: :obj:`argparse.Namespace`
+    :rtype: :obj:`BulkDelete`
+    """
+    return BulkDelete(db, batch_size=settings.bulk_delete_batch_size,
+                      max_rate=settings.bulk_delete_max_rate,
+                      write_concern=parse_write_concern(settings.bulk_delete_write_concern),
+                      lease_seconds=settings.bulk_delete_lease)
+
+
+def add_cli_args(parser):
+    """Adds bulk delete CLI arguments to argument parser.
+
+    :param parser: Argument parser
+    :type parser: :obj:`configargparse.ArgumentParser`
+    """
+    parser.add('--bulk-delete-batch-size',
+               help='Maximum number of records deleted in a single batch by bulk delete jobs',
+               default=500,
+               env_var='DOCSTORE_BULK_DELETE_BATCH_SIZE',
+               type=int)
+    parser.add('--bulk-delete-max-rate',
+               help='Maximum number of records deleted per second by a bulk delete job. 0 disables the limit',
+               default=1000,
+               env_var='DOCSTORE_BULK_DELETE_MAX_RATE',
+               type=float)
+    parser.add('--bulk-delete-write-concern',
+               help='Write concern of bulk delete jobs: number of acknowledging members or a tag set '
+               'name such as majority. Empty for the default write concern',
+               default='majority',
+               env_var='DOCSTORE_BULK_DELETE_WRITE_CONCERN',
+               type=str)
+    parser.add('--bulk-delete-lease',
+               help='Seconds a process holds a bulk delete job without progress. Jobs of stopped processes '
+               'are resumed by other processes after the lease has expired',
+               default=60,
+               env_var='DOCSTORE_BULK_DELETE_LEASE',
+               type=float)
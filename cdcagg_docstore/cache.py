@@ -0,0 +1,62 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process caching of query results.
+
+Note that each server process keeps its own cache.
+"""
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Cache whose entries expire after a fixed time.
+
+    The oldest entries are evicted once the cache is full.
+
+    :param float ttl: Seconds an entry stays valid.
+    :param int max_entries: Maximum number of entries.
+    """
+
+    def __init__(self, ttl, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Get cached value.
+
+        :param key: Key of the entry.
+        :returns: Cached value or None if not found or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key, value):
+        """Cache value.
+
+        :param key: Key of the entry.
+        :param value: Value to cache.
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -12,6 +12,27 @@
 # limitations under the License.
 """Controller is responsible for handling the backend of Document Store.
 """
+import asyncio
+import contextlib
+import datetime
+import logging
+import time
+from types import MappingProxyType
+from bson import (
+    ObjectId,
+    json_util
+)
+import pymongo
+from motor.motor_tornado import MotorClient
+from pymongo import (
+    ReadPreference,
+    ReturnDocument
+)
+from pymongo.errors import (
+    DuplicateKeyError,
+    OperationFailure
+)
+
 from kuha_common.document_store.records import (
     REC_STATUS_CREATED,
     REC_STATUS_DELETED
@@ -20,12 +41,82 @@ from kuha_document_store.database import (
     DocumentStoreDatabase,
     mongodburi
 )
-from kuha_document_store import validation
 
-from cdcagg_common import record_by_collection_name
-from cdcagg_common.records import Study
+from cdcagg_docstore import collection_registry
+from cdcagg_docstore.conversion import (
+    content_hash,
+    decode_filter,
+    encode_document
+)
+from cdcagg_docstore.query import (
+    QueryError,
+    QUERY_TYPE_SELECT,
+    QUERY_TYPE_COUNT,
+    QUERY_TYPE_DISTINCT,
+    QUERY_TYPE_AGGREGATE,
+    QUERY_TYPE_FACETS,
+    facets_pipeline,
+    select_projection,
+    select_sort,
+    is_full_dump,
+    plan_has_collscan,
+    query_shape,
+    select_pipeline,
+    partial_index_hint
+)
+from cdcagg_docstore.streaming import (
+    AdaptiveBatchSize,
+    adaptive_batches
+)
+from cdcagg_docstore.cache import TTLCache
+from cdcagg_docstore.validation import (
+    DocumentValidator,
+    PrevalidatedSchema,
+    POOL_NONE,
+    POOL_TYPES
+)
+from cdcagg_docstore.replication import (
+    READ_PREFERENCES,
+    ReplicationMonitor
+)
+from cdcagg_docstore.pools import ConnectionCounter
+from cdcagg_docstore.metrics import REGISTRY
+
+
+_logger = logging.getLogger(__name__)
+
+#: Initial batch size of adaptive batch sizing if not configured.
+DEFAULT_INITIAL_BATCH_SIZE = 100
+
+#: Field of record metadata holding the content hash of the record.
+CONTENT_HASH_FIELD = 'content_hash'
+
+#: Field of record metadata holding the harvest session that last
+#: saw the record.
+HARVEST_SESSION_FIELD = 'harvest_session'
+
+#: Collection of harvest sessions.
+HARVEST_SESSIONS_COLLECTION = 'harvest_sessions'
 
-from cdcagg_docstore import iter_collections
+#: Results of upserts.
+UPSERT_RESULT_INSERTED = 'insert_successful'
+UPSERT_RESULT_REPLACED = 'replace_successful'
+UPSERT_RESULT_UNCHANGED = 'unchanged'
+
+
+#: Error code of MongoDB for unauthorized commands.
+UNAUTHORIZED_ERROR_CODE = 13
+
+
+def _session_kwargs(session):
+    return {} if session is None else {'session': session}
+
+
+def _utcnow():
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    # MongoDB stores datetimes in millisecond precision. Truncate to
+    # compare stored timestamps with this one.
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
 
 
 class CDCAggDatabase(DocumentStoreDatabase):
@@ -34,14 +125,937 @@ class CDCAggDatabase(DocumentStoreDatabase):
     Subclass of DocumentStoreDatabase. Overrides methods
     :meth:`_get_record_by_collection_name()` and :meth:`_prepare_validation_schema()`
     to support different records that parent class.
+
+    Adds lookups that need direct access to MongoDB collections. The
+    reader and editor clients are created lazily on first use and are
+    shared with the parent class, so the REST API and the lookups of
+    this class use the same connection pools.
+
+    Query API queries are subject to cost caps: server-side
+    time limit, maximum limit of returned documents and
+    rejection of collection scans over large collections.
+
+    :param list collections: Collections of the database.
+    :param str name: Database name.
+    :param str reader_uri: Connection URI with reader credentials.
+    :param str editor_uri: Connection URI with editor credentials.
+    :param int query_max_time_ms: Time limit for queries in milliseconds.
+                                  Server-side limit for each operation
+                                  of queries executed by this class,
+                                  client-side deadline for queries
+                                  executed within
+                                  :meth:`query_time_limit`. 0 for no
+                                  limit.
+    :param int query_max_limit: Maximum limit of select queries and
+                                of results of aggregate queries.
+                                0 for no limit.
+    :param int query_collscan_threshold: Reject queries requiring a
+                                         collection scan over collections
+                                         larger than this. 0 to allow
+                                         collection scans.
+    :param int select_batch_size: Cursor batch size of select queries
+                                  executed by this class. 0 for driver
+                                  default.
+    :param bool select_adaptive_batch_size: Grow the batch size of select
+                                            queries executed by this
+                                            class while the client
+                                            keeps up.
+    :param int select_max_batch_size: Maximum batch size for adaptive
+                                      batch sizing.
+    :param float query_facets_cache_ttl: Seconds to cache results of
+                                         facets queries. 0 disables
+                                         the cache.
+    :param float query_plan_cache_ttl: Seconds to cache whether a
+                                       query shape requires a
+                                       collection scan. 0 disables
+                                       the cache.
+    :param str validation_pool: Validate large documents of upserts
+                                in a 'thread' or 'process' pool.
+                                'none' validates on the event loop.
+    :param int validation_pool_size: Number of validation workers.
+    :param int validation_offload_threshold: Minimum size in bytes of
+                                             documents validated in
+                                             the pool.
+    :param str read_preference: Read preference mode of reads, one of
+                                :data:`cdcagg_docstore.replication.READ_PREFERENCES`.
+    :param float max_staleness_seconds: Route reads only to
+                                        secondaries whose replication
+                                        lag is at most this many
+                                        seconds. 0 disables tracking
+                                        of replication lag.
+    :param float replication_monitor_interval: Seconds between updates
+                                               of replication lag.
+    :param int pool_warm_up_connections: Connections kept open to every
+                                         replica set member by each of
+                                         the reader and editor clients.
+                                         0 disables warm-up of
+                                         connection pools.
     """
 
+    def __init__(self, collections, name, reader_uri, editor_uri,
+                 query_max_time_ms=0, query_max_limit=0, query_collscan_threshold=0,
+                 select_batch_size=0, select_adaptive_batch_size=False, select_max_batch_size=0,
+                 query_facets_cache_ttl=0, query_plan_cache_ttl=0, validation_pool=POOL_NONE, validation_pool_size=2,
+                 validation_offload_threshold=0, read_preference='primary', max_staleness_seconds=0,
+                 replication_monitor_interval=5, pool_warm_up_connections=0):
+        super().__init__(collections=collections, name=name,
+                         reader_uri=reader_uri, editor_uri=editor_uri)
+        self._select_batch_size = select_batch_size
+        self._select_adaptive_batch_size = select_adaptive_batch_size
+        self._select_max_batch_size = select_max_batch_size
+        self._query_max_time_ms = query_max_time_ms or None
+        self._query_max_limit = query_max_limit
+        self._query_collscan_threshold = query_collscan_threshold
+        self._facets_cache = TTLCache(query_facets_cache_ttl) if query_facets_cache_ttl > 0 else None
+        self._facets_cache_hits = REGISTRY.counter('query.facets.cache_hits', 'Facets queries served from cache')
+        self._facets_cache_misses = REGISTRY.counter('query.facets.cache_misses',
+                                                     'Facets queries executed in the database')
+        self._plan_cache = TTLCache(query_plan_cache_ttl, max_entries=1024) if query_plan_cache_ttl > 0 else None
+        self._upserts_unchanged = REGISTRY.counter('upsert.unchanged',
+                                                   'Upserts skipped because the content was unchanged')
+        self._cdcagg_db_name = name
+        self._cdcagg_collections = MappingProxyType({collection.name: collection for collection in collections})
+        self._cdcagg_uris = {'reader': reader_uri, 'editor': editor_uri}
+        self._cdcagg_clients = {}
+        self._cdcagg_validation_schemas = {}
+        #: Names of existing indexes by collection name, looked up
+        #: once per process.
+        self._index_names = {}
+        self._validator = DocumentValidator(validation_pool, pool_size=validation_pool_size,
+                                            size_threshold=validation_offload_threshold)
+        self._read_preference = READ_PREFERENCES[read_preference]
+        #: Tracks replication lag for routing of reads. None if reads
+        #: go to the primary or lag is not tracked.
+        self.replication_monitor = None
+        if self._read_preference != ReadPreference.PRIMARY and max_staleness_seconds > 0:
+            self.replication_monitor = ReplicationMonitor(self, max_staleness_seconds,
+                                                          interval=replication_monitor_interval,
+                                                          read_preference=self._read_preference)
+        self.pool_warm_up_connections = pool_warm_up_connections
+        self._connection_counters = {role: ConnectionCounter() for role in self._cdcagg_uris}\
+            if pool_warm_up_connections > 0 else None
+        self._pools_warm = pool_warm_up_connections <= 0
+
+    def _client(self, role):
+        if role not in self._cdcagg_clients:
+            kwargs = {}
+            if role == 'reader' and self.replication_monitor is not None:
+                # The driver applies the read preference before the
+                # server selector. Every member is passed on to the
+                # selector, which applies the read preference to the
+                # members within maximum staleness.
+                kwargs.update(read_preference=ReadPreference.NEAREST,
+                              server_selector=self.replication_monitor.select_servers)
+            elif role == 'reader' and self._read_preference != ReadPreference.PRIMARY:
+                kwargs['read_preference'] = self._read_preference
+            if self._connection_counters is not None:
+                kwargs.update(minPoolSize=self.pool_warm_up_connections,
+                              event_listeners=[self._connection_counters[role]])
+            self._cdcagg_clients[role] = MotorClient(self._cdcagg_uris[role], **kwargs)
+        return self._cdcagg_clients[role]
+
+    def _get_reader_client(self):
+        # Parent class gets its clients from here.
+        return self._client('reader')
+
+    def _get_editor_client(self):
+        return self._client('editor')
+
+    def reader_collection(self, collection_name):
+        """Get collection using reader credentials.
+
+        The collection uses the configured read preference of the
+        reader client, which is shared with Kuha Document Store. If
+        replication lag is tracked, reads go only to secondaries
+        within maximum staleness, see
+        :meth:`cdcagg_docstore.replication.ReplicationMonitor.select_servers`.
+
+        :param str collection_name: Name of the collection.
+        :returns: Motor collection.
+        :rtype: :obj:`motor.motor_tornado.MotorCollection`
+        """
+        return self._client('reader')[self._cdcagg_db_name][collection_name]
+
+    def _cold_members(self, role):
+        servers = [server for server in self._client(role).topology_description.server_descriptions().values()
+                   if server.is_readable]
+        if not servers:
+            # Members are not discovered yet.
+            return ['unknown']
+        counter = self._connection_counters[role]
+        return ['%s:%s' % server.address for server in servers
+                if counter.ready(server.address) < self.pool_warm_up_connections]
+
+    def pools_warm(self):
+        """Are connection pools warm.
+
+        Pools are warm when the reader and editor clients hold the
+        warm-up number of connections to every reachable member of the
+        replica set. Once warm, pools are considered warm for the
+        lifetime of the process. Determined without querying the
+        database.
+
+        :returns: True if pools are warm or warm-up is disabled.
+        :rtype: bool
+        """
+        if not self._pools_warm:
+            self._pools_warm = not any(self._cold_members(role) for role in self._cdcagg_uris)
+        return self._pools_warm
+
+    async def warm_up_pools(self, timeout=30, poll_interval=0.1):
+        """Warm up connection pools.
+
+        Pings the database with the reader and editor clients, which
+        discovers the members of the replica set. The driver then
+        opens connections to every member in the background. Waits
+        until pools are warm. The clients are shared with the parent
+        class, so the REST API is served from warm pools too.
+
+        :param float timeout: Seconds to wait for the pools.
+        :param float poll_interval: Seconds between checks of the
+                                    pools.
+        :returns: True if pools are warm.
+        :rtype: bool
+        """
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(
+                self._client(role).admin.command('ping', read_preference=ReadPreference.PRIMARY_PREFERRED)
+                for role in self._cdcagg_uris)), timeout)
+        except Exception:
+            _logger.exception('Failed to connect to the database while warming up connection pools')
+        while not self.pools_warm():
+            if time.monotonic() - start >= timeout:
+                _logger.warning('Connection pools are not warm after %s seconds. Cold members: %s',
+                                timeout, {role: self._cold_members(role) for role in self._cdcagg_uris})
+                return False
+            await asyncio.sleep(poll_interval)
+        _logger.info('Connection pools warm in %.3f seconds', time.monotonic() - start)
+        return True
+
+    @contextlib.asynccontextmanager
+    async def causal_session(self, role, causal_times=None):
+        """Start causally consistent session.
+
+        Use as an asynchronous context manager.
+
+        :param str role: Client role, 'reader' or 'editor'.
+        :param tuple causal_times: Operation time and cluster time to
+                                   advance the session to. See
+                                   :func:`cdcagg_docstore.replication.decode_causal_token`
+        :returns: Motor client session.
+        :rtype: :obj:`motor.motor_tornado.MotorClientSession`
+        """
+        async with await self._client(role).start_session(causal_consistency=True) as session:
+            if causal_times is not None:
+                operation_time, cluster_time = causal_times
+                session.advance_cluster_time(cluster_time)
+                session.advance_operation_time(operation_time)
+            yield session
+
+    def editor_collection(self, collection_name):
+        """Get collection using editor credentials.
+
+        :param str collection_name: Name of the collection.
+        :returns: Motor collection.
+        :rtype: :obj:`motor.motor_tornado.MotorCollection`
+        """
+        return self._client('editor')[self._cdcagg_db_name][collection_name]
+
+    async def replication_status(self):
+        """Get status of the replica set as seen by the reader client.
+
+        Pings the database and reads the members from the topology
+        description kept up to date by server monitoring of the
+        driver. Replication lag of a member is the difference of the
+        last write dates of the primary and the member.
+
+        :returns: Address of the primary, or None if the primary is
+                  not known, and the members with their server type
+                  and replication lag in seconds.
+        :rtype: dict
+        """
+        client = self._client('reader')
+        await client.admin.command('ping', read_preference=ReadPreference.PRIMARY_PREFERRED)
+        servers = list(client.topology_description.server_descriptions().values())
+        primary = next((server for server in servers if server.is_writable), None)
+        members = []
+        for server in servers:
+            lag = None
+            if primary is not None and None not in (primary.last_write_date, server.last_write_date):
+                lag = max(0.0, primary.last_write_date - server.last_write_date)
+            members.append({'address': '%s:%s' % server.address,
+                            'type': server.server_type_name,
+                            'lag_seconds': lag})
+        return {'primary': '%s:%s' % primary.address if primary is not None else None,
+                'members': members}
+
+    async def replica_set_status(self):
+        """Get status of the replica set from command replSetGetStatus.
+
+        Replication lag of a member is the difference of the optimes
+        of the primary and the member. Lag of unhealthy members is not
+        known. The command requires role clusterMonitor. Falls back to
+        :meth:`replication_status` if the reader is not authorized.
+
+        :returns: Address of the primary, or None if the primary is
+                  not known, and the members with their state and
+                  replication lag in seconds.
+        :rtype: dict
+        """
+        try:
+            status = await self._client('reader').admin.command('replSetGetStatus')
+        except OperationFailure as exc:
+            if exc.code != UNAUTHORIZED_ERROR_CODE:
+                raise
+            return await self.replication_status()
+        primary = next((member for member in status['members'] if member.get('stateStr') == 'PRIMARY'), None)
+        members = []
+        for member in status['members']:
+            lag = None
+            if primary is not None and member.get('health') == 1 and 'optimeDate' in member:
+                lag = max(0.0, (primary['optimeDate'] - member['optimeDate']).total_seconds())
+            members.append({'address': member['name'],
+                            'type': member.get('stateStr'),
+                            'lag_seconds': lag})
+        return {'primary': primary['name'] if primary is not None else None,
+                'members': members}
+
+    async def query_resource(self, collection_name, resource_id):
+        """Query a single resource by its ObjectId.
+
+        :param str collection_name: Name of the collection.
+        :param str resource_id: ObjectId of the resource as a string.
+        :returns: Document or None if the resource is not found.
+        :rtype: dict or None
+        """
+        rec_class = self._get_record_by_collection_name(collection_name)
+        return await self.reader_collection(collection_name).find_one({rec_class._id.path: ObjectId(resource_id)})
+
+    async def clear_content_hash(self, collection_name, resource_id):
+        """Remove the content hash of a resource.
+
+        Used after writes that do not maintain the content hash, so
+        that the next upsert of the resource writes it regardless of
+        the hash of its content.
+
+        :param str collection_name: Name of the collection.
+        :param str resource_id: ObjectId of the resource as a string.
+        """
+        rec_class = self._get_record_by_collection_name(collection_name)
+        await self.editor_collection(collection_name).update_one(
+            {rec_class._id.path: ObjectId(resource_id)},
+            {'$unset': {'.'.join((rec_class._metadata.path, CONTENT_HASH_FIELD)): True}})
+
+    async def query_resource_metadata(self, collection_name, resource_id):
+        """Query update timestamp of a single resource.
+
+        Projects only the update timestamp so that conditional
+        requests can be answered without reading the whole document.
+
+        :param str collection_name: Name of the collection.
+        :param str resource_id: ObjectId of the resource as a string.
+        :returns: Document containing `_id` and `_metadata.updated` or
+                  None if the resource is not found.
+        :rtype: dict or None
+        """
+        rec_class = self._get_record_by_collection_name(collection_name)
+        return await self.reader_collection(collection_name).find_one(
+            {rec_class._id.path: ObjectId(resource_id)},
+            projection={rec_class._metadata.attr_updated.path: True})
+
+    async def purge_deleted(self, collection_name, deleted_before, batch_size):
+        """Physically remove a batch of logically deleted resources.
+
+        Removes at most `batch_size` resources that have been
+        logically deleted before `deleted_before`. The resources are
+        found from the partial index of logically deleted resources.
+
+        :param str collection_name: Name of the collection.
+        :param deleted_before: Remove resources deleted before this.
+        :type deleted_before: :obj:`datetime.datetime`
+        :param int batch_size: Maximum number of resources to remove.
+        :returns: Number of removed resources.
+        :rtype: int
+        """
+        rec_class = self._get_record_by_collection_name(collection_name)
+        purge_filter = {rec_class._metadata.attr_status.path: REC_STATUS_DELETED,
+                        rec_class._metadata.attr_deleted.path: {'$lt': deleted_before}}
+        collection = self.editor_collection(collection_name)
+        ids = [doc[rec_class._id.path] async for doc in collection.find(
+            purge_filter, projection={rec_class._id.path: True}, limit=batch_size)]
+        if not ids:
+            return 0
+        result = await collection.delete_many({rec_class._id.path: {'$in': ids}, **purge_filter})
+        return result.deleted_count
+
+    async def _validation_schema(self, rec_class):
+        collection_name = rec_class.get_collection()
+        if collection_name not in self._cdcagg_validation_schemas:
+            self._cdcagg_validation_schemas[collection_name] = await self._prepare_validation_schema(rec_class)
+        return self._cdcagg_validation_schemas[collection_name]
+
+    async def prevalidate(self, collection_name, document, document_size=None, **kwargs):
+        """Validate a large document in the validation pool in advance.
+
+        Used by REST API writes, which Kuha Document Store validates
+        on the event loop. Validate the document and write it within
+        :func:`cdcagg_docstore.validation.prevalidated` to skip the
+        validation on the event loop.
+
+        :param str collection_name: Name of the collection.
+        :param dict document: Document decoded from JSON.
+        :param int document_size: Size of the JSON document in bytes
+                                  if known.
+        :param kwargs: Keyword arguments of the validation schema.
+        :returns: True if the document was validated, False if it is
+                  left to be validated when written.
+        :rtype: bool
+        :raises: :exc:`cdcagg_docstore.validation.DocumentValidationError`
+                 if the document is invalid.
+        """
+        return await self._validator.prevalidate(collection_name, document, document_size=document_size, **kwargs)
+
+    async def upsert_by_aggregator_identifier(self, collection_name, document, harvest_session=None,
+                                              document_size=None, session=None):
+        """Insert or update a resource by its aggregator identifier.
+
+        The document is validated once and written with a single
+        atomic upsert, which replaces the stored resource. Fields
+        missing from the document are removed from the resource.
+        Metadata of the document is set by the server. Creation
+        timestamp of an existing resource is preserved.
+
+        A content hash of the document, excluding `_id` and
+        `_metadata`, is stored in the metadata. If the stored resource
+        is active and has the same content hash, the resource is left
+        as is and `_metadata.updated` is left untouched. The hash is
+        compared within the upsert.
+
+        If `harvest_session` is given, the resource is stamped with
+        it, also when the content is unchanged. See
+        :meth:`close_harvest_session`.
+
+        :param str collection_name: Name of the collection.
+        :param dict document: Document decoded from JSON.
+        :param str harvest_session: Optional harvest session id.
+        :param int document_size: Size of the JSON document in bytes
+                                  if known. Large documents may be
+                                  validated in a worker pool.
+        :param session: Optional client session of the editor.
+        :type session: :obj:`motor.motor_tornado.MotorClientSession`
+        :returns: Tuple of ObjectId of the resource as a string and
+                  the result: :const:`UPSERT_RESULT_INSERTED`,
+                  :const:`UPSERT_RESULT_REPLACED` or
+                  :const:`UPSERT_RESULT_UNCHANGED`.
+        :rtype: tuple
+        :raises: :exc:`cdcagg_docstore.validation.DocumentValidationError`
+                 if the document is invalid.
+        """
+        rec_class = self._get_record_by_collection_name(collection_name)
+        schema = await self._validation_schema(rec_class)
+        await self._validator.validate(schema, collection_name, document, document_size=document_size)
+        document = {key: value for key, value in document.items()
+                    if key not in (rec_class._id.path, rec_class._metadata.path)}
+        fingerprint = content_hash(document)
+        content_hash_path = '.'.join((rec_class._metadata.path, CONTENT_HASH_FIELD))
+        harvest_session_path = '.'.join((rec_class._metadata.path, HARVEST_SESSION_FIELD))
+        now = _utcnow()
+        created_path = rec_class._metadata.attr_created.path
+        updated_path = rec_class._metadata.attr_updated.path
+        metadata = {rec_class._metadata.attr_created.name: {'$ifNull': ['$' + created_path, now]},
+                    rec_class._metadata.attr_updated.name: now,
+                    rec_class._metadata.attr_deleted.name: None,
+                    rec_class._metadata.attr_status.name: REC_STATUS_CREATED,
+                    rec_class._metadata.attr_schema_version.name: rec_class.schema_version,
+                    rec_class._metadata.attr_cmm_type.name: rec_class.cmm_type,
+                    CONTENT_HASH_FIELD: fingerprint,
+                    HARVEST_SESSION_FIELD: '$' + harvest_session_path if harvest_session is None else harvest_session}
+        # The pipeline replaces the document as a whole. $literal keeps
+        # values of the document from being evaluated as expressions.
+        replacement = {'$mergeObjects': [
+            {'$literal': document},
+            {rec_class._id.path: '$' + rec_class._id.path, rec_class._metadata.path: metadata}]}
+        unchanged = '$$ROOT'
+        if harvest_session is not None:
+            # Stamping the session leaves the update timestamp as is.
+            unchanged = {'$mergeObjects': ['$$ROOT', {rec_class._metadata.path: {'$mergeObjects': [
+                '$' + rec_class._metadata.path, {HARVEST_SESSION_FIELD: harvest_session}]}}]}
+        # The content hash is checked by the write itself, so that the
+        # check and the write are atomic and take one round trip.
+        update = [{'$replaceWith': {'$cond': [
+            {'$and': [{'$eq': ['$' + content_hash_path, fingerprint]},
+                      {'$eq': ['$' + rec_class._metadata.attr_status.path, REC_STATUS_CREATED]}]},
+            unchanged, replacement]}}]
+        upsert_filter = {rec_class._aggregator_identifier.path: document[rec_class._aggregator_identifier.path]}
+        collection = self.editor_collection(collection_name)
+        kwargs = {'upsert': True, 'projection': {rec_class._id.path: True, created_path: True, updated_path: True},
+                  'return_document': ReturnDocument.AFTER, **_session_kwargs(session)}
+        try:
+            result = await collection.find_one_and_update(upsert_filter, update, **kwargs)
+        except DuplicateKeyError:
+            # Concurrent upserts of a new resource may race to insert.
+            # The losing one succeeds on retry as an update.
+            result = await collection.find_one_and_update(upsert_filter, update, **kwargs)
+        metadata = result[rec_class._metadata.path]
+        if metadata[rec_class._metadata.attr_created.name] == now:
+            upsert_result = UPSERT_RESULT_INSERTED
+        elif metadata[rec_class._metadata.attr_updated.name] == now:
+            upsert_result = UPSERT_RESULT_REPLACED
+        else:
+            upsert_result = UPSERT_RESULT_UNCHANGED
+            self._upserts_unchanged.inc()
+        return str(result[rec_class._id.path]), upsert_result
+
+    async def open_harvest_session(self, collection_name, direct_base_url):
+        """Open harvest session for a source.
+
+        :param str collection_name: Name of the collection.
+        :param str direct_base_url: Direct base URL of the source.
+        :returns: Id of the opened session.
+        :rtype: str
+        """
+        result = await self.editor_collection(HARVEST_SESSIONS_COLLECTION).insert_one(
+            {'collection': collection_name, 'direct_base_url': direct_base_url,
+             'opened': _utcnow(), 'closed': None})
+        return str(result.inserted_id)
+
+    async def close_harvest_session(self, collection_name, session_id):
+        """Close harvest session and logically delete unseen resources.
+
+        Active resources of the source of the session that were not
+        stamped with the session by
+        :meth:`upsert_by_aggregator_identifier` are logically deleted
+        with a single update, which uses the partial index of active
+        resources by direct base URL.
+
+        :param str collection_name: Name of the collection.
+        :param str session_id: Id of the session.
+        :returns: Number of logically deleted resources or None if
+                  the session is not found or already closed.
+        :rtype: int or None
+        """
+        now = _utcnow()
+        session = await self.editor_collection(HARVEST_SESSIONS_COLLECTION).find_one_and_update(
+            {'_id': ObjectId(session_id), 'collection': collection_name, 'closed': None},
+            {'$set': {'closed': now}})
+        if session is None:
+            return None
+        rec_class = self._get_record_by_collection_name(collection_name)
+        result = await self.editor_collection(collection_name).update_many(
+            {rec_class._metadata.attr_status.path: REC_STATUS_CREATED,
+             rec_class._direct_base_url.path: session['direct_base_url'],
+             '.'.join((rec_class._metadata.path, HARVEST_SESSION_FIELD)): {'$ne': session_id}},
+            {'$set': {rec_class._metadata.attr_status.path: REC_STATUS_DELETED,
+                      rec_class._metadata.attr_deleted.path: now,
+                      rec_class._metadata.attr_updated.path: now}})
+        return result.modified_count
+
+    async def delete_batch(self, collection_name, query_filter, delete_type, batch_size, write_concern=None):
+        """Delete a batch of resources matching a filter.
+
+        Logical delete marks at most `batch_size` active resources
+        deleted. Physical delete removes at most `batch_size`
+        resources.
+
+        Values compared to isodate and object ID fields in the filter
+        are converted, see :meth:`decode_filter`.
+
+        :param str collection_name: Name of the collection.
+        :param dict query_filter: Converted query filter.
+        :param str delete_type: 'soft' for logical or 'hard' for
+                                physical delete.
+        :param int batch_size: Maximum number of resources to delete.
+        :param write_concern: Write concern of the delete. None for
+                              the default.
+        :type write_concern: :obj:`pymongo.write_concern.WriteConcern`
+        :returns: Number of deleted resources.
+        :rtype: int
+        """
+        rec_class = self._get_record_by_collection_name(collection_name)
+        collection = self.editor_collection(collection_name)
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        query_filter = self.decode_filter(collection_name, query_filter)
+        if delete_type == 'soft':
+            query_filter = {'$and': [query_filter, {rec_class._metadata.attr_status.path: REC_STATUS_CREATED}]}
+        ids = [doc[rec_class._id.path] async for doc in collection.find(
+            query_filter, projection={rec_class._id.path: True}, limit=batch_size)]
+        if not ids:
+            return 0
+        batch_filter = {'$and': [{rec_class._id.path: {'$in': ids}}, query_filter]}
+        if delete_type == 'hard':
+            result = await collection.delete_many(batch_filter)
+            return result.deleted_count
+        now = _utcnow()
+        result = await collection.update_many(batch_filter, {'$set': {
+            rec_class._metadata.attr_status.path: REC_STATUS_DELETED,
+            rec_class._metadata.attr_deleted.path: now,
+            rec_class._metadata.attr_updated.path: now}})
+        return result.modified_count
+
+    async def query_by_identifiers(self, collection_name, identifiers, fields=None, session=None):
+        """Query multiple resources by their identifiers.
+
+        Identifiers may be ObjectIds or aggregator identifiers.
+        All resources are fetched in a single query, which uses
+        the unique indexes of `_id` and `_aggregator_identifier`.
+
+        :param str collection_name: Name of the collection.
+        :param list identifiers: Identifiers of the resources.
+        :param list fields: Optional fields to return.
+        :param session: Optional client session of the reader.
+        :type session: :obj:`motor.motor_tornado.MotorClientSession`
+        :returns: Found documents in the order of `identifiers`.
+                  Resources not found are left out.
+        :rtype: list
+        """
+        rec_class = self._get_record_by_collection_name(collection_name)
+        id_path = rec_class._id.path
+        agg_id_path = rec_class._aggregator_identifier.path
+        identifiers = list(dict.fromkeys(identifiers))
+        conditions = [{agg_id_path: {'$in': identifiers}}]
+        object_ids = [ObjectId(identifier) for identifier in identifiers if ObjectId.is_valid(identifier)]
+        if object_ids:
+            conditions.append({id_path: {'$in': object_ids}})
+        projection = None
+        if fields:
+            projection = dict.fromkeys(list(fields) + [agg_id_path], True)
+        documents = {}
+        cursor = self.reader_collection(collection_name).find(
+            conditions[0] if len(conditions) == 1 else {'$or': conditions},
+            projection=projection, batch_size=len(identifiers), **_session_kwargs(session))
+        async for document in cursor:
+            documents[str(document[id_path])] = document
+            documents[document.get(agg_id_path)] = document
+        results = []
+        returned = set()
+        for identifier in identifiers:
+            document = documents.get(identifier)
+            if document is None or id(document) in returned:
+                continue
+            returned.add(id(document))
+            if fields and agg_id_path not in fields:
+                document.pop(agg_id_path, None)
+            results.append(document)
+        return results
+
+    async def index_hint(self, collection_name, query):
+        """Find the partial index to route a query to.
+
+        :param str collection_name: Name of the collection.
+        :param query: Parsed query.
+        :type query: :obj:`cdcagg_docstore.query.Query`
+        :returns: Name of an existing eligible partial index or None.
+        :rtype: str or None
+        """
+        collection = self._cdcagg_collections.get(collection_name)
+        if collection is None:
+            return None
+        hint = partial_index_hint(query, collection.partial_indexes)
+        if hint is None:
+            return None
+        if collection_name not in self._index_names:
+            self._index_names[collection_name] = frozenset([
+                index['name'] async for index in self.reader_collection(collection_name).list_indexes()])
+        if hint not in self._index_names[collection_name]:
+            # Hinting a missing index fails the query. The index is
+            # created by setup_collections.
+            return None
+        return hint
+
+    async def _explain(self, command):
+        return await self._client('reader')[self._cdcagg_db_name].command(
+            'explain', command, verbosity='queryPlanner')
+
+    async def _collscan_size(self, collection_name, query):
+        size = await self.reader_collection(collection_name).estimated_document_count()
+        if size <= self._query_collscan_threshold:
+            return 0
+        if query.query_type == QUERY_TYPE_AGGREGATE:
+            command = {'aggregate': collection_name, 'pipeline': query.pipeline, 'cursor': {}}
+        elif query.query_type == QUERY_TYPE_FACETS:
+            command = {'aggregate': collection_name, 'pipeline': facets_pipeline(query), 'cursor': {}}
+        elif query.query_type == QUERY_TYPE_COUNT:
+            command = {'count': collection_name, 'query': query.query_filter}
+        elif query.query_type == QUERY_TYPE_DISTINCT:
+            command = {'distinct': collection_name, 'key': query.fieldname, 'query': query.query_filter}
+        else:
+            command = {'find': collection_name, 'filter': query.query_filter}
+            sort = select_sort(query)
+            if sort is not None:
+                command['sort'] = dict(sort)
+        hint = await self.index_hint(collection_name, query)
+        if hint is not None and query.query_type in (QUERY_TYPE_SELECT, QUERY_TYPE_COUNT):
+            command['hint'] = hint
+        return size if plan_has_collscan(await self._explain(command)) else 0
+
+    async def check_query_cost(self, collection_name, query):
+        """Check query against cost caps.
+
+        Whether the query requires a collection scan is found out by
+        explaining the query. The result is cached per query shape,
+        see :func:`cdcagg_docstore.query.query_shape`. The shape keeps
+        the values of fields in partial filter expressions, since they
+        decide whether a partial index serves the query.
+
+        :param str collection_name: Name of the collection.
+        :param query: Parsed query.
+        :type query: :obj:`cdcagg_docstore.query.Query`
+        :raises: :exc:`cdcagg_docstore.query.QueryError` if the query
+                 exceeds cost caps.
+        """
+        if is_full_dump(query):
+            return
+        if query.query_type == QUERY_TYPE_SELECT and self._query_max_limit and\
+           not 0 < query.limit <= self._query_max_limit:
+            raise QueryError("Key 'limit' must be between 1 and %s" % (self._query_max_limit,))
+        if not self._query_collscan_threshold:
+            return
+        collection = self._cdcagg_collections.get(collection_name)
+        value_paths = () if collection is None else [path for index in collection.partial_indexes
+                                                     for path in index.partial_filter_expression]
+        cache_key = (collection_name, query_shape(query, value_paths))
+        size = None if self._plan_cache is None else self._plan_cache.get(cache_key)
+        if size is None:
+            size = await self._collscan_size(collection_name, query)
+            if self._plan_cache is not None:
+                self._plan_cache.set(cache_key, size)
+        if size:
+            raise QueryError('Query requires a collection scan over %s documents. '
+                             'Filter or sort by indexed fields.' % (size,))
+
+    def query_time_limit(self):
+        """Get context that limits the time of queries executed within it.
+
+        Applies the time limit to queries that take no time limit as
+        an argument, such as the queries executed by the Query API
+        handler of Kuha Document Store. The limit is a client-side
+        deadline: operations executed within the context, including
+        fetching every batch of a streamed cursor, share the time
+        limit. Exceeding it raises
+        :exc:`pymongo.errors.PyMongoError` whose attribute `timeout`
+        is True.
+
+        :returns: Context manager.
+        """
+        if self._query_max_time_ms is None:
+            return contextlib.nullcontext()
+        return pymongo.timeout(self._query_max_time_ms / 1000)
+
+    def select_batch_sizer(self):
+        """Get batch sizer for a select query.
+
+        :returns: Adaptive batch size or None if adaptive batch sizing
+                  is not in use.
+        :rtype: :obj:`cdcagg_docstore.streaming.AdaptiveBatchSize` or None
+        """
+        if not self._select_adaptive_batch_size:
+            return None
+        return AdaptiveBatchSize(self._select_batch_size or DEFAULT_INITIAL_BATCH_SIZE,
+                                 self._select_max_batch_size)
+
+    async def select(self, collection_name, query, batch_sizer=None, session=None):
+        """Execute select query.
+
+        With a batch sizer the query is executed as an aggregation,
+        since the batch size of an aggregation cursor may change while
+        the cursor is iterated. Queries of active records are routed
+        to partial indexes if eligible and the indexes exist.
+
+        :param str collection_name: Name of the collection.
+        :param query: Parsed select query.
+        :type query: :obj:`cdcagg_docstore.query.Query`
+        :param batch_sizer: Optional adaptive batch size.
+        :type batch_sizer: :obj:`cdcagg_docstore.streaming.AdaptiveBatchSize`
+        :param session: Optional client session of the reader.
+        :type session: :obj:`motor.motor_tornado.MotorClientSession`
+        :returns: Asynchronous generator yielding documents.
+        :raises: :exc:`cdcagg_docstore.query.QueryError` if the query
+                 exceeds cost caps.
+        """
+        await self.check_query_cost(collection_name, query)
+        collection = self.reader_collection(collection_name)
+        hint = await self.index_hint(collection_name, query)
+        if batch_sizer is not None:
+            kwargs = {} if self._query_max_time_ms is None else {'maxTimeMS': self._query_max_time_ms}
+            if hint is not None:
+                kwargs['hint'] = hint
+            cursor = collection.aggregate(select_pipeline(query), batchSize=batch_sizer.size,
+                                          **kwargs, **_session_kwargs(session))
+            async for document in adaptive_batches(cursor, batch_sizer):
+                yield document
+            return
+        kwargs = {'batch_size': self._select_batch_size} if self._select_batch_size else {}
+        if hint is not None:
+            kwargs['hint'] = hint
+        kwargs.update(_session_kwargs(session))
+        cursor = collection.find(
+            query.query_filter,
+            projection=select_projection(query),
+            skip=query.skip, limit=query.limit,
+            sort=select_sort(query),
+            max_time_ms=self._query_max_time_ms, **kwargs)
+        async for document in cursor:
+            yield document
+
+    async def aggregate(self, collection_name, query, batch_sizer=None, session=None):
+        """Execute aggregate query.
+
+        If the maximum limit of returned documents is set, the
+        pipeline is capped with a $limit stage.
+
+        :param str collection_name: Name of the collection.
+        :param query: Parsed aggregate query.
+        :type query: :obj:`cdcagg_docstore.query.Query`
+        :param batch_sizer: Optional adaptive batch size.
+        :type batch_sizer: :obj:`cdcagg_docstore.streaming.AdaptiveBatchSize`
+        :param session: Optional client session of the reader.
+        :type session: :obj:`motor.motor_tornado.MotorClientSession`
+        :returns: Asynchronous generator yielding result documents.
+        :raises: :exc:`cdcagg_docstore.query.QueryError` if the query
+                 exceeds cost caps.
+        """
+        await self.check_query_cost(collection_name, query)
+        kwargs = {} if self._query_max_time_ms is None else {'maxTimeMS': self._query_max_time_ms}
+        batch_size = batch_sizer.size if batch_sizer is not None else self._select_batch_size
+        if batch_size:
+            kwargs['batchSize'] = batch_size
+        pipeline = query.pipeline
+        if self._query_max_limit:
+            pipeline = pipeline + [{'$limit': self._query_max_limit}]
+        cursor = self.reader_collection(collection_name).aggregate(pipeline, **kwargs, **_session_kwargs(session))
+        if batch_sizer is not None:
+            cursor = adaptive_batches(cursor, batch_sizer)
+        async for document in cursor:
+            yield document
+
+    async def facets(self, collection_name, query, session=None):
+        """Execute facets query.
+
+        Results are cached for a short time, if configured. Queries
+        in a session bypass the cache.
+
+        :param str collection_name: Name of the collection.
+        :param query: Parsed facets query.
+        :type query: :obj:`cdcagg_docstore.query.Query`
+        :param session: Optional client session of the reader.
+        :type session: :obj:`motor.motor_tornado.MotorClientSession`
+        :returns: Number of matching documents in key `count` and
+                  value counts of each field in key `facets`.
+        :rtype: dict
+        :raises: :exc:`cdcagg_docstore.query.QueryError` if the query
+                 exceeds cost caps.
+        """
+        pipeline = facets_pipeline(query)
+        cache_key = (collection_name, json_util.dumps(pipeline, sort_keys=True))
+        use_cache = self._facets_cache is not None and session is None
+        if use_cache:
+            result = self._facets_cache.get(cache_key)
+            if result is not None:
+                self._facets_cache_hits.inc()
+                return result
+        self._facets_cache_misses.inc()
+        await self.check_query_cost(collection_name, query)
+        kwargs = {} if self._query_max_time_ms is None else {'maxTimeMS': self._query_max_time_ms}
+        documents = await self.reader_collection(collection_name).aggregate(
+            pipeline, **kwargs, **_session_kwargs(session)).to_list(1)
+        document = documents[0] if documents else {}
+        count = document.get('count')
+        result = {'count': count[0]['count'] if count else 0,
+                  'facets': {field: [{'value': item['_id'], 'count': item['count']}
+                                     for item in document.get(str(index), [])]
+                             for index, field in enumerate(query.fields)}}
+        if use_cache:
+            self._facets_cache.set(cache_key, result)
+        return result
+
+    async def count(self, collection_name, query, session=None):
+        """Execute count query.
+
+        Queries of active records are routed to partial indexes if
+        eligible and the indexes exist.
+
+        :param str collection_name: Name of the collection.
+        :param query: Parsed count query.
+        :type query: :obj:`cdcagg_docstore.query.Query`
+        :param session: Optional client session of the reader.
+        :type session: :obj:`motor.motor_tornado.MotorClientSession`
+        :returns: Number of matching documents.
+        :rtype: int
+        :raises: :exc:`cdcagg_docstore.query.QueryError` if the query
+                 exceeds cost caps.
+        """
+        await self.check_query_cost(collection_name, query)
+        kwargs = {} if self._query_max_time_ms is None else {'maxTimeMS': self._query_max_time_ms}
+        hint = await self.index_hint(collection_name, query)
+        if hint is not None:
+            kwargs['hint'] = hint
+        return await self.reader_collection(collection_name).count_documents(query.query_filter, **kwargs,
+                                                                             **_session_kwargs(session))
+
+    async def distinct(self, collection_name, query, session=None):
+        """Execute distinct query.
+
+        :param str collection_name: Name of the collection.
+        :param query: Parsed distinct query.
+        :type query: :obj:`cdcagg_docstore.query.Query`
+        :param session: Optional client session of the reader.
+        :type session: :obj:`motor.motor_tornado.MotorClientSession`
+        :returns: Distinct values of the queried field.
+        :rtype: list
+        :raises: :exc:`cdcagg_docstore.query.QueryError` if the query
+                 exceeds cost caps.
+        """
+        await self.check_query_cost(collection_name, query)
+        kwargs = {} if self._query_max_time_ms is None else {'maxTimeMS': self._query_max_time_ms}
+        return await self.reader_collection(collection_name).distinct(
+            query.fieldname, query.query_filter, **kwargs, **_session_kwargs(session))
+
+    def decode_filter(self, collection_name, query_filter):
+        """Convert values compared to isodate and object ID fields
+        in a query filter.
+
+        :param str collection_name: Name of the collection.
+        :param dict query_filter: Converted query filter.
+        :returns: Query filter with datetimes and ObjectIds.
+        :rtype: dict
+        """
+        registry = collection_registry()
+        return decode_filter(query_filter, registry.isodate_fields(collection_name),
+                             registry.object_id_fields(collection_name))
+
+    def encode_document(self, collection_name, document):
+        """Encode document queried from the database to JSON.
+
+        :param str collection_name: Name of the collection.
+        :param dict document: Document to encode.
+        :returns: JSON encoded document.
+        :rtype: str
+        """
+        return encode_document(self._cdcagg_collections[collection_name], document)
+
+    def close(self):
+        """Close database connections."""
+        rval = super().close()
+        if self.replication_monitor is not None:
+            self.replication_monitor.stop()
+        for client in self._cdcagg_clients.values():
+            client.close()
+        self._cdcagg_clients.clear()
+        self._validator.close()
+        return rval
+
     @staticmethod
     def _get_record_by_collection_name(name):
+        from cdcagg_common import record_by_collection_name
         return record_by_collection_name(name)
 
     @staticmethod
     async def _prepare_validation_schema(rec_class):
+        # Validation is imported on first use to keep startup fast.
+        from kuha_document_store import validation
+        from cdcagg_common.records import Study
         if rec_class.get_collection() is not Study.get_collection():
             raise ValueError("Unsupported record class '%s'" % (rec_class,))
         metadata_schema_items = {
@@ -51,7 +1065,9 @@ class CDCAggDatabase(DocumentStoreDatabase):
             **validation.str_enum_item(rec_class._metadata.attr_status.name, [REC_STATUS_CREATED,
                                                                               REC_STATUS_DELETED]),
             **validation.str_enum_item(rec_class._metadata.attr_schema_version.name, [rec_class.schema_version]),
-            **validation.str_enum_item(rec_class._metadata.attr_cmm_type.name, [rec_class.cmm_type])
+            **validation.str_enum_item(rec_class._metadata.attr_cmm_type.name, [rec_class.cmm_type]),
+            **validation.default_schema_item(CONTENT_HASH_FIELD, nullable=True),
+            **validation.default_schema_item(HARVEST_SESSION_FIELD, nullable=True)
         }
         provenance_schema_items = {
             **validation.default_schema_item(rec_class._provenance.attr_base_url.name),
@@ -67,13 +1083,13 @@ class CDCAggDatabase(DocumentStoreDatabase):
             **validation.dict_schema_item(rec_class._metadata.path, metadata_schema_items),
             **validation.container_schema_item(rec_class._provenance.path, provenance_schema_items),
             **validation.default_schema_item(rec_class._direct_base_url.path, nullable=False, required=True)}
-        return validation.RecordValidationSchema(
+        return PrevalidatedSchema(validation.RecordValidationSchema(
             rec_class,
             base_schema,
             validation.identifier_schema_item(rec_class.study_number.path),
             validation.uniquelist_schema_item(rec_class.persistent_identifiers.path),
             validation.bool_schema_item(rec_class.universes.attr_included.path)
-        )
+        ))
 
 
 def db_from_settings(settings):
@@ -90,9 +1106,24 @@ def db_from_settings(settings):
     editor_uri = mongodburi(*settings.replica, database=settings.database_name,
                             credentials=(settings.database_user_editor,
                                          settings.database_pass_editor))
-    return CDCAggDatabase(collections=list(iter_collections()),
+    return CDCAggDatabase(collections=list(collection_registry()),
                           name=settings.database_name,
-                          reader_uri=reader_uri, editor_uri=editor_uri)
+                          reader_uri=reader_uri, editor_uri=editor_uri,
+                          query_max_time_ms=settings.query_max_time_ms,
+                          query_max_limit=settings.query_max_limit,
+                          query_collscan_threshold=settings.query_collscan_threshold,
+                          select_batch_size=settings.select_batch_size,
+                          select_adaptive_batch_size=settings.select_adaptive_batch_size,
+                          select_max_batch_size=settings.select_max_batch_size,
+                          query_facets_cache_ttl=settings.query_facets_cache_ttl,
+                          query_plan_cache_ttl=settings.query_plan_cache_ttl,
+                          validation_pool=settings.validation_pool,
+                          validation_pool_size=settings.validation_pool_size,
+                          validation_offload_threshold=settings.validation_offload_threshold,
+                          read_preference=settings.read_preference,
+                          max_staleness_seconds=settings.max_staleness_seconds,
+                          replication_monitor_interval=settings.replication_monitor_interval,
+                          pool_warm_up_connections=settings.pool_warm_up_connections)
 
 
 def add_cli_args(parser):
@@ -137,3 +1168,101 @@ def add_cli_args(parser):
                default='editor',
                env_var='DBPASS_EDITOR',
                type=str)
+    parser.add('--query-max-time-ms',
+               help='Time limit for Query API queries in milliseconds. Queries executed by DocStore '
+               'get a server-side limit on each database operation. Queries delegated to Kuha '
+               'Document Store get a client-side deadline for the whole request, including streaming '
+               'the results, so a limit set here also ends long full collection dumps. '
+               '0 disables the limit',
+               default=0,
+               env_var='DBQUERY_MAX_TIME_MS',
+               type=int)
+    parser.add('--query-max-limit',
+               help='Maximum limit of documents returned by a select query. If set, every select '
+               'query must submit a limit between 1 and this value, except full collection dumps '
+               'which have no filter or sort. Results of aggregate queries are capped to this '
+               'many documents. 0 disables the limit',
+               default=0,
+               env_var='DBQUERY_MAX_LIMIT',
+               type=int)
+    parser.add('--query-collscan-threshold',
+               help='Reject queries that require a collection scan over a collection larger than '
+               'this number of documents. Full collection dumps are always allowed. 0 allows '
+               'collection scans',
+               default=0,
+               env_var='DBQUERY_COLLSCAN_THRESHOLD',
+               type=int)
+    parser.add('--query-facets-cache-ttl',
+               help='Seconds to cache results of facets queries. 0 disables the cache',
+               default=30,
+               env_var='DBQUERY_FACETS_CACHE_TTL',
+               type=float)
+    parser.add('--query-plan-cache-ttl',
+               help='Seconds to cache whether a query shape requires a collection scan. Queries that '
+               'differ only by the values compared in the filter share a shape. 0 disables the cache',
+               default=300,
+               env_var='DBQUERY_PLAN_CACHE_TTL',
+               type=float)
+    parser.add('--select-batch-size',
+               help='Cursor batch size of select and aggregate queries executed by DocStore. Also the '
+               'initial batch size of adaptive batch sizing. Select queries delegated to Kuha Document '
+               'Store are not covered. 0 uses the driver default',
+               default=0,
+               env_var='DBSELECT_BATCH_SIZE',
+               type=int)
+    parser.add('--select-adaptive-batch-size',
+               help='Grow the cursor batch size of select and aggregate queries executed by DocStore '
+               'while the client keeps up with the stream. Select queries delegated to Kuha Document '
+               'Store are not covered',
+               action='store_true',
+               env_var='DBSELECT_ADAPTIVE_BATCH_SIZE')
+    parser.add('--select-max-batch-size',
+               help='Maximum cursor batch size of adaptive batch sizing',
+               default=5000,
+               env_var='DBSELECT_MAX_BATCH_SIZE',
+               type=int)
+    parser.add('--validation-pool',
+               help='Validate large documents of upserts and REST API writes in a thread or process pool to keep '
+               'validation from blocking concurrent requests. none validates in the event loop',
+               default=POOL_NONE,
+               choices=POOL_TYPES,
+               env_var='DBVALIDATION_POOL',
+               type=str)
+    parser.add('--validation-pool-size',
+               help='Number of workers in the validation pool',
+               default=2,
+               env_var='DBVALIDATION_POOL_SIZE',
+               type=int)
+    parser.add('--validation-offload-threshold',
+               help='Documents of at least this many bytes are validated in the validation pool',
+               default=65536,
+               env_var='DBVALIDATION_OFFLOAD_THRESHOLD',
+               type=int)
+    parser.add('--read-preference',
+               help='Read preference of reads, including reads of REST API and queries delegated to '
+               'Kuha Document Store. Reads from secondaries may return stale data',
+               default='primary',
+               choices=list(READ_PREFERENCES),
+               env_var='DBREAD_PREFERENCE',
+               type=str)
+    parser.add('--max-staleness-seconds',
+               help='Route reads only to secondaries whose replication lag is at most this many seconds. '
+               'If no secondary is fresh enough, read preferences secondaryPreferred and nearest fall '
+               'back to the primary, while secondary waits for a fresh secondary and fails after the '
+               'server selection timeout. Requires a read preference other than primary. 0 disables '
+               'tracking of replication lag',
+               default=0,
+               env_var='DBREAD_MAX_STALENESS_SECONDS',
+               type=float)
+    parser.add('--replication-monitor-interval',
+               help='Seconds between updates of replication lag',
+               default=5,
+               env_var='DBREAD_REPLICATION_MONITOR_INTERVAL',
+               type=float)
+    parser.add('--pool-warm-up-connections',
+               help='Connections opened at startup and kept open to every replica set member by each of '
+               'the reader and editor clients. DocStore is ready only after the connection pools are warm. '
+               '0 disables warm-up',
+               default=0,
+               env_var='DBPOOL_WARM_UP_CONNECTIONS',
+               type=int)
@@ -0,0 +1,279 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Conversion of field types between MongoDB documents and JSON.
+
+Isodate fields are stored as dates in MongoDB and represented as
+datestamp strings in JSON. Object ID fields are represented in
+MongoDB Extended JSON format.
+
+Field paths of a collection are compiled into a
+:obj:`PathConverter`, which walks each document once and converts
+values in place. Converters are cached per collection.
+
+Query filters refer to fields by dotted paths. Values compared to
+isodate and object ID fields in query filters are converted by
+:func:`decode_filter`.
+"""
+import datetime
+import functools
+import hashlib
+from bson import (
+    json_util,
+    ObjectId
+)
+from bson.errors import InvalidId
+
+
+DATESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def datetime_to_datestamp(value):
+    """Convert datetime to datestamp string.
+
+    :param value: Datetime to convert.
+    :type value: :obj:`datetime.datetime`
+    :returns: Datestamp
+    :rtype: str
+    """
+    return value.strftime(DATESTAMP_FORMAT)
+
+
+def datestamp_to_datetime(value):
+    """Convert datestamp string to datetime.
+
+    :param str value: Datestamp to convert.
+    :returns: Datetime
+    :rtype: :obj:`datetime.datetime`
+    :raises: :exc:`ValueError` if the datestamp is invalid.
+    """
+    return datetime.datetime.strptime(value, DATESTAMP_FORMAT)
+
+
+def _compile_tree(tree):
+    return tuple((key, None, _compile_tree(node)) if isinstance(node, dict) else (key, node, None)
+                 for key, node in tree.items())
+
+
+def _compile_paths(path_funcs):
+    tree = {}
+    for path, func in path_funcs:
+        *parents, leaf = path.split('.')
+        node = tree
+        for key in parents:
+            node = node.setdefault(key, {})
+            if not isinstance(node, dict):
+                raise ValueError('Field path %s overlaps another path' % (path,))
+        if isinstance(node.get(leaf), dict):
+            raise ValueError('Field path %s overlaps another path' % (path,))
+        node[leaf] = func
+    return _compile_tree(tree)
+
+
+def _walk(document, nodes):
+    for key, func, children in nodes:
+        value = document.get(key)
+        if value is None:
+            continue
+        if func is not None:
+            document[key] = func(value)
+        elif isinstance(value, dict):
+            _walk(value, children)
+
+
+class PathConverter:
+    """Converts values at fixed field paths of documents.
+
+    Dotted field paths are compiled into a tree of path tuples
+    grouped by common prefixes, so that each document is walked once
+    regardless of the number of fields. Missing and None values are
+    left untouched.
+
+    :param path_funcs: Pairs of dotted field path and function used
+                       to convert the value in the path.
+    :type path_funcs: iterable
+    """
+
+    def __init__(self, path_funcs):
+        self._nodes = _compile_paths(path_funcs)
+
+    def convert(self, document):
+        """Convert a document in place.
+
+        :param dict document: Document to convert.
+        :returns: The converted document.
+        :rtype: dict
+        """
+        _walk(document, self._nodes)
+        return document
+
+
+def _encode_isodate(value):
+    return datetime_to_datestamp(value) if isinstance(value, datetime.datetime) else value
+
+
+@functools.lru_cache(maxsize=None)
+def _encoder(isodate_fields):
+    return PathConverter((path, _encode_isodate) for path in isodate_fields)
+
+
+def document_encoder(collection):
+    """Get converter of MongoDB documents to JSON representation.
+
+    Converts isodate fields to datestamps.
+
+    :param collection: Collection of the documents.
+    :type collection: :obj:`cdcagg_docstore.mdb.Collection`
+    :rtype: :obj:`PathConverter`
+    """
+    return _encoder(tuple(collection.isodate_fields))
+
+
+def encode_document(collection, document):
+    """Encode MongoDB document to JSON.
+
+    Converts isodate fields of the collection to datestamps.
+    Modifies the document in place.
+
+    :param collection: Collection of the document.
+    :type collection: :obj:`cdcagg_docstore.mdb.Collection`
+    :param dict document: Document to encode.
+    :returns: JSON encoded document.
+    :rtype: str
+    """
+    return json_util.dumps(document_encoder(collection).convert(document))
+
+
+def _decode_isodate(value):
+    if isinstance(value, str):
+        try:
+            return datestamp_to_datetime(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _decode_object_id(value):
+    if isinstance(value, str):
+        try:
+            return ObjectId(value)
+        except InvalidId:
+            return value
+    return value
+
+
+_DECODED_OPERATORS = frozenset(('$eq', '$ne', '$lt', '$lte', '$gt', '$gte'))
+_DECODED_LIST_OPERATORS = frozenset(('$in', '$nin', '$all'))
+_LOGICAL_OPERATORS = frozenset(('$and', '$or', '$nor'))
+
+
+def _decode_condition(condition, decode):
+    if not isinstance(condition, dict):
+        return decode(condition)
+    if not condition or not all(key.startswith('$') for key in condition):
+        # Equality match against an embedded document.
+        return condition
+    decoded = {}
+    for operator, value in condition.items():
+        if operator in _DECODED_OPERATORS:
+            value = decode(value)
+        elif operator in _DECODED_LIST_OPERATORS and isinstance(value, list):
+            value = [decode(item) for item in value]
+        elif operator == '$not':
+            value = _decode_condition(value, decode)
+        decoded[operator] = value
+    return decoded
+
+
+def decode_filter(query_filter, isodate_fields, object_id_fields):
+    """Convert values compared to isodate and object ID fields in a
+    query filter.
+
+    Datestamps compared to isodate fields are converted to datetimes
+    and strings compared to object ID fields to ObjectIds. Applies to
+    equality matches and operators $eq, $ne, $lt, $lte, $gt, $gte,
+    $in, $nin and $all, also within $not, $and, $or and $nor. Values
+    that cannot be converted are left as is.
+
+    :param dict query_filter: Query filter with special operators
+                              already converted.
+    :param isodate_fields: Paths of isodate fields.
+    :type isodate_fields: frozenset
+    :param object_id_fields: Paths of object ID fields.
+    :type object_id_fields: frozenset
+    :returns: Converted query filter. The given filter is left
+              untouched.
+    :rtype: dict
+    """
+    if not isinstance(query_filter, dict):
+        return query_filter
+    decoded = {}
+    for key, value in query_filter.items():
+        if key in _LOGICAL_OPERATORS and isinstance(value, list):
+            value = [decode_filter(item, isodate_fields, object_id_fields) for item in value]
+        elif key in object_id_fields:
+            value = _decode_condition(value, _decode_object_id)
+        elif key in isodate_fields:
+            value = _decode_condition(value, _decode_isodate)
+        decoded[key] = value
+    return decoded
+
+
+def encode_distinct(fieldname, values):
+    """Encode result of distinct query to JSON.
+
+    :param str fieldname: Queried field.
+    :param list values: Distinct values.
+    :returns: JSON encoded object with fieldname as key and values
+              as value.
+    :rtype: str
+    """
+    return json_util.dumps({fieldname: [datetime_to_datestamp(value) if isinstance(value, datetime.datetime)
+                                        else value for value in values]})
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return datetime_to_datestamp(value)
+    if isinstance(value, dict):
+        return {key: _encode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode_value(item) for item in value]
+    return value
+
+
+def encode_aggregate_result(document):
+    """Encode result document of aggregate query to JSON.
+
+    Result documents do not follow the schema of the collection.
+    Every date found in the document is converted to datestamp.
+
+    :param dict document: Result document.
+    :returns: JSON encoded document.
+    :rtype: str
+    """
+    return json_util.dumps(_encode_value(document))
+
+
+def content_hash(document):
+    """Compute hash of document content.
+
+    The document is serialized to canonical JSON with sorted keys,
+    so that documents with equal content get equal hashes regardless
+    of key order.
+
+    :param dict document: Document to hash.
+    :returns: Hexadecimal SHA-256 digest.
+    :rtype: str
+    """
+    canonical = json_util.dumps(document, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
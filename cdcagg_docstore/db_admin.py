@@ -35,13 +35,10 @@ from argparse import RawDescriptionHelpFormatter
 # PyPI
 from tornado.ioloop import IOLoop
 from tornado.gen import multi
-from motor.motor_tornado import MotorClient
 # Kuha
 from kuha_common import conf
-from kuha_document_store.database import mongodburi
 # CDC Aggregator
 from . import iter_collections
-from .controller import add_cli_args
 
 
 OperationsSetup = namedtuple('OperationsSetup', 'admin_credentials, settings, client, app_db, admin_db')
@@ -80,6 +77,10 @@ class DBOperations:
         :param settings: Loaded settings
         :type settings: :obj:`argparse.Namespace`
         """
+        # The MongoDB driver is imported on first use to keep
+        # importing this module fast.
+        from motor.motor_tornado import MotorClient
+        from kuha_document_store.database import mongodburi
         conn_uri = mongodburi(*settings.replica, database='admin',
                               credentials=(admin_username, admin_password),
                               options=[('replicaSet', settings.replicaset)])
@@ -135,6 +136,8 @@ async def initiate_replicaset(ops_setup):
     :type ops_setup: :obj:`OperationsSetup`
     :returns: Result of 'repsSetInitiate'
     """
+    from motor.motor_tornado import MotorClient
+    from kuha_document_store.database import mongodburi
     replset_members = [{'_id': index, 'host': host} for index, host in enumerate(ops_setup.settings.replica)]
     client = MotorClient(mongodburi(ops_setup.settings.replica[0], database='admin',
                                     credentials=ops_setup.admin_credentials))
@@ -206,7 +209,8 @@ async def drop_database(ops_setup):
 async def setup_collections(ops_setup):
     """CLI operation to setup database collections.
 
-    Creates every collection and sets up it's indexes and validation.
+    Creates every collection and sets up it's indexes, including
+    partial and text indexes, and validation.
 
     :param ops_setup: Setup variables.
     :type ops_setup: :obj:`OperationsSetup`
@@ -223,6 +227,14 @@ async def setup_collections(ops_setup):
             tasks.append(new_coll.create_index(coll_index, unique=True))
         for coll_index in collection.indexes:
             tasks.append(new_coll.create_index(coll_index))
+        for coll_index in collection.partial_indexes:
+            tasks.append(new_coll.create_index(coll_index.keys, name=coll_index.name,
+                                               partialFilterExpression=coll_index.partial_filter_expression))
+        if collection.text_index is not None:
+            text_index = collection.text_index
+            tasks.append(new_coll.create_index(text_index.keys, name=text_index.name, weights=text_index.weights,
+                                               default_language=text_index.default_language,
+                                               language_override=text_index.language_override))
         result.update({collection.name: await multi(tasks)})
     return result
 
@@ -287,13 +299,16 @@ async def list_admin_users(ops_setup):
 async def setup_users(ops_setup):
     """CLI operation to setup application db users.
 
+    The reader user gets role clusterMonitor to track replication lag
+    with command 'replSetGetStatus'.
+
     :param ops_setup: Setup variables.
     :type ops_setup: :obj:`OperationsSetup`
     :returns: Results of commands 'createUser' against the application-database.
     """
     tasks = [ops_setup.app_db.command('createUser', ops_setup.settings.database_user_reader,
                                       pwd=ops_setup.settings.database_pass_reader,
-                                      roles=['read']),
+                                      roles=['read', {'role': 'clusterMonitor', 'db': 'admin'}]),
              ops_setup.app_db.command('createUser', ops_setup.settings.database_user_editor,
                                       pwd=ops_setup.settings.database_pass_editor,
                                       roles=['readWrite'])]
@@ -331,6 +346,9 @@ def configure():
     :returns: Loaded configuration
     :rtype: :obj:`argparse.Namespace`
     """
+    # Controller and the MongoDB driver are imported here to keep
+    # importing this module fast.
+    from .controller import add_cli_args
     conf.load(prog='cdcagg_docstore.db_admin',
               env_var_prefix='CDCAGG_',
               description=__doc__,
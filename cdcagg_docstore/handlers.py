@@ -0,0 +1,636 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Request handlers for DocStore HTTP API.
+
+Extends the handlers of Kuha Document Store with
+CDC Aggregator specific features.
+"""
+import calendar
+import contextlib
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+from bson import ObjectId
+from pymongo.errors import (
+    DuplicateKeyError,
+    PyMongoError
+)
+from tornado.escape import (
+    json_decode,
+    json_encode
+)
+from tornado.web import (
+    HTTPError,
+    RequestHandler
+)
+from kuha_document_store.handlers import (
+    RestApiHandler,
+    QueryHandler
+)
+
+from cdcagg_common import record_by_collection_name
+
+from .limits import (
+    ConcurrencyLimitMixin,
+    ROUTE_CLASS_READS,
+    ROUTE_CLASS_WRITES,
+    ROUTE_CLASS_QUERIES
+)
+from .metrics import REGISTRY
+from .profiling import ProfilingMixin
+from .controller import (
+    CONTENT_HASH_FIELD,
+    UPSERT_RESULT_INSERTED
+)
+from .validation import (
+    DocumentValidationError,
+    prevalidated
+)
+from .http_api import MULTIGET_MAX_IDS
+from .conversion import (
+    datetime_to_datestamp,
+    encode_aggregate_result,
+    encode_distinct
+)
+from .streaming import (
+    BackPressureWriter,
+    DEFAULT_HIGH_WATER_MARK
+)
+from .replication import (
+    CAUSAL_TOKEN_HEADER,
+    CAUSAL_TOKEN_NEW,
+    CausalTokenError,
+    decode_causal_token,
+    encode_causal_token
+)
+from .bulk_delete import (
+    BulkDelete,
+    DELETE_TYPES
+)
+from .query import (
+    QueryError,
+    QUERY_TYPE_SELECT,
+    QUERY_TYPE_COUNT,
+    QUERY_TYPE_DISTINCT,
+    QUERY_TYPE_AGGREGATE,
+    QUERY_TYPE_FACETS,
+    parse_query
+)
+
+
+def resource_etag(resource_id, updated):
+    """Build entity tag for a resource.
+
+    The tag is derived from resource id and update
+    timestamp of the resource.
+
+    :param str resource_id: Resource id.
+    :param updated: Update timestamp of the resource.
+    :type updated: :obj:`datetime.datetime`
+    :returns: Quoted entity tag.
+    :rtype: str
+    """
+    millis = calendar.timegm(updated.utctimetuple()) * 1000 + updated.microsecond // 1000
+    return '"%s-%x"' % (resource_id, millis)
+
+
+def _as_naive_utc(datetime_):
+    if datetime_.tzinfo is None:
+        return datetime_
+    return datetime_.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _is_list_of_str(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def _decode_json_body(request):
+    try:
+        body = json_decode(request.body)
+    except ValueError as exc:
+        raise HTTPError(400, 'Invalid JSON in request body: %s' % (exc,)) from exc
+    if not isinstance(body, dict):
+        raise HTTPError(400, 'Request body must be a JSON object')
+    return body
+
+
+@contextlib.asynccontextmanager
+async def _causal_session(handler, role):
+    """Causally consistent session for a request carrying a causal
+    consistency token. Yields None for other requests.
+    """
+    token = handler.request.headers.get(CAUSAL_TOKEN_HEADER)
+    if token is None:
+        yield None
+        return
+    causal_times = None
+    if token != CAUSAL_TOKEN_NEW:
+        try:
+            causal_times = decode_causal_token(token)
+        except CausalTokenError as exc:
+            raise HTTPError(400, str(exc)) from exc
+    async with handler.settings['db'].causal_session(role, causal_times=causal_times) as session:
+        yield session
+
+
+def _stream_writer(handler, batch_sizer=None):
+    return BackPressureWriter(handler,
+                              high_water_mark=handler.settings.get('stream_high_water_mark',
+                                                                   DEFAULT_HIGH_WATER_MARK),
+                              batch_sizer=batch_sizer)
+
+
+class CDCAggRestApiHandler(ProfilingMixin, ConcurrencyLimitMixin, RestApiHandler):
+    """REST API handler supporting conditional GET requests.
+
+    Responses to GET requests for a single resource carry `Etag` and
+    `Last-Modified` headers derived from the update timestamp of the
+    resource. Conditional GET requests, i.e. requests carrying
+    `If-None-Match` or `If-Modified-Since` headers, get the headers
+    from a projection-only lookup first. Matching requests are
+    answered with 304 Not Modified without reading the whole
+    document from the database. Other GET requests go to the database
+    once. Requests for missing resources are answered by Kuha
+    Document Store.
+
+    POST and PUT requests are executed by Kuha Document Store, which
+    does not maintain the content hash used by
+    :meth:`cdcagg_docstore.controller.CDCAggDatabase.upsert_by_aggregator_identifier`.
+    A content hash submitted by the client is removed from the
+    document, and the stored content hash of a replaced resource is
+    removed after the write. Large documents are validated in the
+    validation pool before Kuha Document Store writes them, see
+    :meth:`cdcagg_docstore.controller.CDCAggDatabase.prevalidate`.
+    """
+
+    def get_route_class(self):
+        """GET requests are reads, other methods are writes.
+
+        :returns: Route class name.
+        :rtype: str
+        """
+        if self.request.method in ('GET', 'HEAD'):
+            return ROUTE_CLASS_READS
+        return ROUTE_CLASS_WRITES
+
+    def _is_conditional(self):
+        return self.request.headers.get('If-None-Match') is not None or\
+            self.request.headers.get('If-Modified-Since') is not None
+
+    def _not_modified(self, updated):
+        if self.request.headers.get('If-None-Match') is not None:
+            # If-None-Match takes precedence over If-Modified-Since.
+            return self.check_etag_header()
+        if_modified_since = self.request.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = _as_naive_utc(parsedate_to_datetime(if_modified_since))
+        except (TypeError, ValueError, IndexError):
+            return False
+        return _as_naive_utc(updated).replace(microsecond=0) <= since
+
+    @staticmethod
+    def _updated(collection, document):
+        if document is None:
+            return None
+        rec_class = record_by_collection_name(collection)
+        return document.get(rec_class._metadata.path, {}).get(rec_class._metadata.attr_updated.name)
+
+    def _set_validators(self, resource_id, updated):
+        self.set_header('Etag', resource_etag(resource_id, updated))
+        self.set_header('Last-Modified', _as_naive_utc(updated))
+
+    async def get(self, collection, resource_id=None):
+        """HTTP GET handler.
+
+        :param str collection: Collection name.
+        :param str resource_id: Optional resource id.
+        """
+        if resource_id is None or not ObjectId.is_valid(resource_id):
+            await super().get(collection, resource_id=resource_id)
+            return
+        db = self.settings['db']
+        if self._is_conditional():
+            updated = self._updated(collection, await db.query_resource_metadata(collection, resource_id))
+            if updated is not None:
+                self._set_validators(resource_id, updated)
+                if self._not_modified(updated):
+                    self.set_status(304)
+                    self.finish()
+                    return
+        document = await db.query_resource(collection, resource_id)
+        if document is None:
+            self.clear_header('Etag')
+            self.clear_header('Last-Modified')
+            await super().get(collection, resource_id=resource_id)
+            return
+        updated = self._updated(collection, document)
+        if updated is not None:
+            self._set_validators(resource_id, updated)
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(db.encode_document(collection, document))
+        self.finish()
+
+    def _decode_write(self, collection):
+        """Decode document of a write and remove its content hash.
+        Returns None if the body is not a JSON object.
+        """
+        try:
+            document = json_decode(self.request.body)
+        except ValueError:
+            # Kuha Document Store responds to invalid JSON.
+            return None
+        if not isinstance(document, dict):
+            return None
+        metadata = document.get(record_by_collection_name(collection)._metadata.path)
+        if isinstance(metadata, dict) and CONTENT_HASH_FIELD in metadata:
+            del metadata[CONTENT_HASH_FIELD]
+            self.request.body = json_encode(document).encode('utf-8')
+        return document
+
+    @contextlib.asynccontextmanager
+    async def _prevalidated(self, collection, document, **kwargs):
+        validated = False
+        if document is not None:
+            try:
+                validated = await self.settings['db'].prevalidate(
+                    collection, document, document_size=len(self.request.body), **kwargs)
+            except DocumentValidationError:
+                # Kuha Document Store validates again and responds with the errors.
+                pass
+        if not validated:
+            yield
+            return
+        with prevalidated(document, **kwargs):
+            yield
+
+    async def post(self, collection, resource_id=None):
+        """HTTP POST handler.
+
+        :param str collection: Collection name.
+        :param str resource_id: Optional resource id.
+        """
+        async with self._prevalidated(collection, self._decode_write(collection)):
+            rval = super().post(collection, resource_id=resource_id)
+            if rval is not None:
+                await rval
+
+    async def put(self, collection, resource_id=None):
+        """HTTP PUT handler.
+
+        :param str collection: Collection name.
+        :param str resource_id: Optional resource id.
+        """
+        # Replacements are validated as updates of the stored resource.
+        async with self._prevalidated(collection, self._decode_write(collection), update=True):
+            rval = super().put(collection, resource_id=resource_id)
+            if rval is not None:
+                await rval
+        if self.get_status() == 200 and resource_id is not None and ObjectId.is_valid(resource_id):
+            await self.settings['db'].clear_content_hash(collection, resource_id)
+
+
+#: Terminates a stream of query results if the query exceeds the time
+#: limit after results have been sent.
+QUERY_TIMEOUT_MARKER = {'_error': {'code': 504, 'message': 'Query exceeded time limit'}}
+
+
+class CDCAggQueryHandler(ProfilingMixin, ConcurrencyLimitMixin, QueryHandler):
+    """Query API handler.
+
+    Select, count and distinct queries are executed by the query
+    handler of Kuha Document Store. Queries using features Kuha
+    Document Store does not support, i.e. text search, aggregate and
+    facets query types, and queries carrying a causal consistency
+    token in header `X-Causal-Token`, are executed through
+    :class:`cdcagg_docstore.controller.CDCAggDatabase`. So are select
+    and count queries that can be routed to a partial index, and
+    queries comparing isodate or object ID fields to strings, which
+    are converted to datetimes and ObjectIds. Streaming
+    of results of queries executed through
+    :class:`cdcagg_docstore.controller.CDCAggDatabase` pauses while a
+    slow client has not read the buffered output. Requests carrying a
+    causal consistency token see the writes that preceded the token.
+
+    Every query is subject to the cost caps and the time limit of
+    :class:`cdcagg_docstore.controller.CDCAggDatabase`. Queries
+    rejected by cost caps get 400 Bad Request. Queries exceeding the
+    time limit get 504 Gateway Timeout. If results have already been
+    sent, the status can no longer change, and the stream is
+    terminated with :data:`QUERY_TIMEOUT_MARKER` instead.
+    """
+
+    route_class = ROUTE_CLASS_QUERIES
+
+    async def _is_extended(self, collection, query):
+        if query.query_type in (QUERY_TYPE_AGGREGATE, QUERY_TYPE_FACETS) or\
+           query.text_search is not None or self.request.headers.get(CAUSAL_TOKEN_HEADER) is not None:
+            return True
+        # Kuha Document Store cannot hint indexes.
+        return query.query_type in (QUERY_TYPE_SELECT, QUERY_TYPE_COUNT) and\
+            await self.settings['db'].index_hint(collection, query) is not None
+
+    async def _run_inherited(self, collection, query):
+        db = self.settings['db']
+        await db.check_query_cost(collection, query)
+        with db.query_time_limit():
+            rval = super().post(collection)
+            if rval is not None:
+                await rval
+
+    async def _run_query(self, collection, query, session=None):
+        db = self.settings['db']
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        if query.query_type == QUERY_TYPE_COUNT:
+            self.write({'count': await db.count(collection, query, session=session)})
+        elif query.query_type == QUERY_TYPE_DISTINCT:
+            self.write(encode_distinct(query.fieldname, await db.distinct(collection, query, session=session)))
+        elif query.query_type == QUERY_TYPE_FACETS:
+            self.write(encode_aggregate_result(await db.facets(collection, query, session=session)))
+        elif query.query_type == QUERY_TYPE_AGGREGATE:
+            batch_sizer = db.select_batch_sizer()
+            writer = _stream_writer(self, batch_sizer=batch_sizer)
+            async for document in db.aggregate(collection, query, batch_sizer=batch_sizer, session=session):
+                await writer.write(encode_aggregate_result(document))
+        else:
+            batch_sizer = db.select_batch_sizer()
+            writer = _stream_writer(self, batch_sizer=batch_sizer)
+            async for document in db.select(collection, query, batch_sizer=batch_sizer, session=session):
+                await writer.write(db.encode_document(collection, document))
+
+    async def post(self, collection):
+        """HTTP POST handler.
+
+        :param str collection: Collection name.
+        """
+        try:
+            query = parse_query(self.get_argument('query_type', QUERY_TYPE_SELECT),
+                                _decode_json_body(self.request))
+            decoded = query._replace(query_filter=self.settings['db'].decode_filter(collection, query.query_filter))
+            # Kuha Document Store compares values of isodate and object ID fields as strings.
+            if decoded == query and not await self._is_extended(collection, query):
+                await self._run_inherited(collection, query)
+            else:
+                async with _causal_session(self, 'reader') as session:
+                    await self._run_query(collection, decoded, session=session)
+        except QueryError as exc:
+            raise HTTPError(400, str(exc)) from exc
+        except PyMongoError as exc:
+            if not exc.timeout:
+                raise
+            if not self._headers_written:
+                raise HTTPError(504, 'Query exceeded time limit') from exc
+            self.write(json_encode(QUERY_TIMEOUT_MARKER))
+        if not self._finished:
+            self.finish()
+
+
+class MultiGetHandler(ProfilingMixin, ConcurrencyLimitMixin, QueryHandler):
+    """Handler for fetching multiple resources in a single request.
+
+    Request body is a JSON object with key `ids` containing a list of
+    ObjectIds or aggregator identifiers and an optional key `fields`
+    to limit the returned fields. Found resources are streamed in the
+    order of the requested identifiers. Requests carrying a causal
+    consistency token in header `X-Causal-Token` see the writes that
+    preceded the token.
+    """
+
+    def _parse_body(self):
+        body = _decode_json_body(self.request)
+        identifiers = body.get('ids')
+        if not identifiers or not _is_list_of_str(identifiers):
+            raise HTTPError(400, "Key 'ids' must be a non-empty list of strings")
+        max_ids = self.settings.get('multiget_max_ids', MULTIGET_MAX_IDS)
+        if len(identifiers) > max_ids:
+            raise HTTPError(400, "Too many ids: %s. Maximum is %s" % (len(identifiers), max_ids))
+        fields = body.get('fields')
+        if fields is not None and not _is_list_of_str(fields):
+            raise HTTPError(400, "Key 'fields' must be a list of strings")
+        return identifiers, fields
+
+    async def post(self, collection):
+        """HTTP POST handler.
+
+        :param str collection: Collection name.
+        """
+        identifiers, fields = self._parse_body()
+        db = self.settings['db']
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        writer = _stream_writer(self)
+        async with _causal_session(self, 'reader') as session:
+            documents = await db.query_by_identifiers(collection, identifiers, fields=fields, session=session)
+        for document in documents:
+            await writer.write(db.encode_document(collection, document))
+        self.finish()
+
+
+class UpsertHandler(ProfilingMixin, ConcurrencyLimitMixin, RestApiHandler):
+    """Handler for inserting or updating a resource by its
+    aggregator identifier in a single request.
+
+    Responds with 201 Created if the resource was inserted and
+    200 OK if an existing resource was updated. Result of a write
+    skipped because the content was unchanged is `unchanged`.
+
+    Query argument `harvest_session` stamps the resource with an open
+    harvest session. See :class:`HarvestSessionHandler`.
+
+    A request carrying header `X-Causal-Token` with value `new` or a
+    previous token is executed in a causally consistent session. The
+    response carries the token of the write in the same header.
+    """
+
+    SUPPORTED_METHODS = ('PUT',)
+    route_class = ROUTE_CLASS_WRITES
+
+    async def put(self, collection):
+        """HTTP PUT handler.
+
+        :param str collection: Collection name.
+        """
+        document = _decode_json_body(self.request)
+        harvest_session = self.get_argument('harvest_session', None)
+        if harvest_session is not None and not ObjectId.is_valid(harvest_session):
+            raise HTTPError(400, "Invalid harvest session '%s'" % (harvest_session,))
+        try:
+            async with _causal_session(self, 'editor') as session:
+                resource_id, result = await self.settings['db'].upsert_by_aggregator_identifier(
+                    collection, document, harvest_session=harvest_session, document_size=len(self.request.body),
+                    session=session)
+                causal_token = None if session is None else encode_causal_token(session)
+        except DocumentValidationError as exc:
+            raise HTTPError(400, str(exc.args)) from exc
+        except DuplicateKeyError as exc:
+            raise HTTPError(409, 'Resource conflicts with an existing resource') from exc
+        if causal_token is not None:
+            self.set_header(CAUSAL_TOKEN_HEADER, causal_token)
+        self.set_status(201 if result == UPSERT_RESULT_INSERTED else 200)
+        self.write({'affected_resource': resource_id,
+                    'error': None,
+                    'result': result})
+        self.finish()
+
+
+class HarvestSessionHandler(ProfilingMixin, ConcurrencyLimitMixin, RestApiHandler):
+    """Handler for harvest sessions of a source.
+
+    A harvest session is opened for a direct base URL. Resources
+    upserted during the harvest are stamped with the session. Closing
+    the session logically deletes active resources of the source that
+    were not stamped, i.e. that disappeared from the source.
+    """
+
+    SUPPORTED_METHODS = ('POST',)
+    route_class = ROUTE_CLASS_WRITES
+
+    async def post(self, collection, session_id=None):
+        """HTTP POST handler.
+
+        Opens a session if `session_id` is not given. Otherwise
+        closes the session.
+
+        :param str collection: Collection name.
+        :param str session_id: Optional id of session to close.
+        """
+        db = self.settings['db']
+        if session_id is None:
+            direct_base_url = _decode_json_body(self.request).get('_direct_base_url')
+            if not direct_base_url or not isinstance(direct_base_url, str):
+                raise HTTPError(400, "Key '_direct_base_url' must be a non-empty string")
+            self.set_status(201)
+            self.write({'session_id': await db.open_harvest_session(collection, direct_base_url),
+                        '_direct_base_url': direct_base_url})
+        else:
+            if not ObjectId.is_valid(session_id):
+                raise HTTPError(404, 'Harvest session not found')
+            deleted = await db.close_harvest_session(collection, session_id)
+            if deleted is None:
+                raise HTTPError(404, 'Harvest session not found or already closed')
+            self.write({'session_id': session_id, 'deleted': deleted})
+        self.finish()
+
+
+def _encode_bulk_delete_job(job):
+    return {'job_id': str(job['_id']),
+            'collection': job['collection'],
+            '_filter': json_decode(job['filter']),
+            'delete_type': job['delete_type'],
+            'state': job['state'],
+            'deleted': job['deleted'],
+            'error': job['error'],
+            'created': datetime_to_datestamp(job['created']),
+            'updated': datetime_to_datestamp(job['updated'])}
+
+
+class BulkDeleteHandler(ProfilingMixin, ConcurrencyLimitMixin, RestApiHandler):
+    """Handler for deleting resources matching a filter.
+
+    POST submits a bulk delete job, which runs in the background,
+    and responds with 202 Accepted. Request body is a JSON object
+    with key `_filter` in the filter grammar of the Query API. Query
+    argument `delete_type` selects logical (`soft`, the default) or
+    physical (`hard`) delete. GET returns state and progress of a job.
+    """
+
+    SUPPORTED_METHODS = ('GET', 'POST')
+
+    def get_route_class(self):
+        """GET requests are reads, POST requests are writes.
+
+        :returns: Route class name.
+        :rtype: str
+        """
+        if self.request.method == 'GET':
+            return ROUTE_CLASS_READS
+        return ROUTE_CLASS_WRITES
+
+    def _bulk_delete(self):
+        bulk_delete = self.settings.get('bulk_delete')
+        if bulk_delete is None:
+            bulk_delete = self.application.settings['bulk_delete'] = BulkDelete(self.settings['db'])
+        return bulk_delete
+
+    async def get(self, collection, job_id=None):
+        """HTTP GET handler.
+
+        :param str collection: Collection name.
+        :param str job_id: Job id.
+        """
+        job = None
+        if job_id is not None and ObjectId.is_valid(job_id):
+            job = await self._bulk_delete().get(job_id)
+        if job is None or job['collection'] != collection:
+            raise HTTPError(404, 'Bulk delete job not found')
+        self.write(_encode_bulk_delete_job(job))
+        self.finish()
+
+    async def post(self, collection, job_id=None):
+        """HTTP POST handler.
+
+        :param str collection: Collection name.
+        :param str job_id: Not supported.
+        """
+        if job_id is not None:
+            raise HTTPError(405)
+        delete_type = self.get_argument('delete_type', DELETE_TYPES[0])
+        if delete_type not in DELETE_TYPES:
+            raise HTTPError(400, "Invalid delete type '%s'. Endpoint supports %s" % (
+                delete_type, ', '.join("'%s'" % (type_,) for type_ in DELETE_TYPES)))
+        query_filter = _decode_json_body(self.request).get('_filter')
+        if not query_filter or not isinstance(query_filter, dict):
+            raise HTTPError(400, "Key '_filter' must be a non-empty object")
+        try:
+            job = await self._bulk_delete().submit(collection, query_filter, delete_type)
+        except QueryError as exc:
+            raise HTTPError(400, str(exc)) from exc
+        self.set_status(202)
+        self.set_header('Location', '%s/%s' % (self.request.path.rstrip('/'), job['_id']))
+        self.write(_encode_bulk_delete_job(job))
+        self.finish()
+
+
+class MetricsHandler(ProfilingMixin, RequestHandler):
+    """Serves in-process metrics as JSON."""
+
+    def get(self):
+        """HTTP GET handler."""
+        self.finish(REGISTRY.snapshot())
+
+
+class HealthHandler(RequestHandler):
+    """Serves liveness of the DocStore process."""
+
+    def get(self):
+        """HTTP GET handler."""
+        self.finish({'status': 'ok'})
+
+
+class ReadyHandler(RequestHandler):
+    """Serves readiness of the DocStore from memory.
+
+    Readiness is checked periodically by the
+    :obj:`cdcagg_docstore.health.HealthMonitor` in application setting
+    `health_monitor`. Responds with 503 Service Unavailable when the
+    DocStore is not ready.
+    """
+
+    def get(self):
+        """HTTP GET handler."""
+        health_monitor = self.settings.get('health_monitor')
+        if health_monitor is None:
+            raise HTTPError(503, 'Readiness is not monitored')
+        if not health_monitor.ready:
+            self.set_status(503)
+        self.finish(health_monitor.readiness)
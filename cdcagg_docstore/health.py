@@ -0,0 +1,176 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Readiness of the DocStore.
+
+Readiness is checked by a periodic job within the DocStore process
+and the result is kept in memory. Health and readiness probes are
+served from memory, so the number of probes does not affect the load
+on the database.
+
+The DocStore is ready when the database is reachable, the primary of
+the replica set is known, the replication lag of every member is
+within bounds and, if warm-up of connection pools is enabled, the
+connection pools are warm.
+"""
+import asyncio
+import datetime
+import logging
+from tornado.ioloop import (
+    IOLoop,
+    PeriodicCallback
+)
+
+from .metrics import REGISTRY
+
+
+_logger = logging.getLogger(__name__)
+
+CHECK_STATUS_PASS = 'pass'
+CHECK_STATUS_FAIL = 'fail'
+
+
+def _check(passed, **details):
+    return dict(status=CHECK_STATUS_PASS if passed else CHECK_STATUS_FAIL, **details)
+
+
+class HealthMonitor:
+    """Periodic readiness check.
+
+    The DocStore is not ready until the first check has passed.
+
+    :param db: Database controller.
+    :type db: :obj:`cdcagg_docstore.controller.CDCAggDatabase`
+    :param float interval: Seconds between checks.
+    :param float max_replication_lag: Maximum replication lag of a
+                                      member in seconds. 0 disables
+                                      the check of replication lag.
+    :param float timeout: Seconds to wait for the database.
+    :param bool check_pools: Check that connection pools are warm.
+    """
+
+    def __init__(self, db, interval=5, max_replication_lag=30, timeout=5, check_pools=False):
+        self._db = db
+        self.interval = interval
+        self.max_replication_lag = max_replication_lag
+        self.timeout = timeout
+        self.check_pools = check_pools
+        self._running = False
+        self._periodic = None
+        self.readiness = {'ready': False, 'checked': None, 'checks': {}}
+        self._ready = REGISTRY.gauge('health.ready', 'Whether the DocStore is ready')
+        self._errors = REGISTRY.counter('health.errors', 'Failed readiness checks')
+
+    @property
+    def ready(self):
+        """Result of the latest readiness check.
+
+        :rtype: bool
+        """
+        return self.readiness['ready']
+
+    async def _checks(self):
+        try:
+            status = await asyncio.wait_for(self._db.replication_status(), self.timeout)
+        except Exception as exc:
+            _logger.warning('Database is not reachable: %r', exc)
+            return {'database': _check(False, error=str(exc) or type(exc).__name__)}
+        lags = [member['lag_seconds'] for member in status['members'] if member['lag_seconds'] is not None]
+        max_lag = max(lags, default=0.0)
+        checks = {'database': _check(True),
+                  'primary': _check(status['primary'] is not None, address=status['primary'])}
+        if self.max_replication_lag > 0:
+            checks['replication_lag'] = _check(max_lag <= self.max_replication_lag, seconds=max_lag)
+        if self.check_pools:
+            checks['connection_pools'] = _check(self._db.pools_warm())
+        return checks
+
+    async def check(self):
+        """Check readiness and store the result.
+
+        Does nothing if a previous check is still in progress.
+
+        :returns: Result of the check.
+        :rtype: dict
+        """
+        if self._running:
+            return self.readiness
+        self._running = True
+        try:
+            checks = await self._checks()
+        finally:
+            self._running = False
+        ready = all(check['status'] == CHECK_STATUS_PASS for check in checks.values())
+        if ready != self.ready:
+            _logger.info('DocStore is %s: %s', 'ready' if ready else 'not ready', checks)
+        if not ready:
+            self._errors.inc()
+        self._ready.set(int(ready))
+        self.readiness = {'ready': ready,
+                          'checked': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                          'checks': checks}
+        return self.readiness
+
+    def start(self):
+        """Start checking periodically.
+
+        The first check starts immediately.
+        """
+        self._periodic = PeriodicCallback(self.check, self.interval * 1000)
+        self._periodic.start()
+        IOLoop.current().add_callback(self.check)
+
+    def stop(self):
+        """Stop checking periodically."""
+        if self._periodic is not None:
+            self._periodic.stop()
+            self._periodic = None
+
+
+def monitor_from_settings(db, settings):
+    """Instantiate health monitor from loaded settings.
+
+    :param db: Database controller.
+    :type db: :obj:`cdcagg_docstore.controller.CDCAggDatabase`
+    :param settings: Loaded settings.
+    :type settings: :obj:`argparse.Namespace`
+    :returns: Health monitor.
+    :rtype: :obj:`HealthMonitor`
+    """
+    return HealthMonitor(db, interval=settings.ready_check_interval,
+                         max_replication_lag=settings.ready_max_replication_lag,
+                         timeout=settings.ready_check_timeout,
+                         check_pools=settings.pool_warm_up_connections > 0)
+
+
+def add_cli_args(parser):
+    """Adds readiness check CLI arguments to argument parser.
+
+    :param parser: Argument parser
+    :type parser: :obj:`configargparse.ArgumentParser`
+    """
+    parser.add('--ready-check-interval',
+               help='Seconds between readiness checks',
+               default=5,
+               env_var='DOCSTORE_READY_CHECK_INTERVAL',
+               type=float)
+    parser.add('--ready-check-timeout',
+               help='Seconds to wait for the database in a readiness check',
+               default=5,
+               env_var='DOCSTORE_READY_CHECK_TIMEOUT',
+               type=float)
+    parser.add('--ready-max-replication-lag',
+               help='DocStore is not ready when the replication lag of a replica set member exceeds '
+               'this many seconds. 0 disables the check',
+               default=30,
+               env_var='DOCSTORE_READY_MAX_REPLICATION_LAG',
+               type=float)
@@ -14,10 +14,14 @@
 """
 
 from kuha_common.server import WebApplication
-from kuha_document_store.handlers import (
-    RestApiHandler,
-    QueryHandler
-)
+
+from .limits import limiters_from_settings
+from .profiling import profiler_from_settings
+from .streaming import DEFAULT_HIGH_WATER_MARK
+
+
+#: Default for the maximum number of identifiers in a multi-get request.
+MULTIGET_MAX_IDS = 1000
 
 
 def get_app(api_version, collections, **kw):
@@ -37,6 +41,19 @@ def get_app(api_version, collections, **kw):
     :returns: WebApplication object.
     :rtype: :obj:`kuha_common.server.WebApplication`
     """
+    # Handlers are imported here to keep startup fast for
+    # code paths that only load configuration.
+    from .handlers import (
+        CDCAggRestApiHandler,
+        CDCAggQueryHandler,
+        MultiGetHandler,
+        UpsertHandler,
+        HarvestSessionHandler,
+        BulkDeleteHandler,
+        MetricsHandler,
+        HealthHandler,
+        ReadyHandler
+    )
     handlers = []
 
     def add_route(route_str, handler, **kw_):
@@ -45,9 +62,110 @@ def get_app(api_version, collections, **kw):
         handlers.append((full_route_str.format(**kw_), handler))
 
     collections = '|'.join(collections)
-    add_route(r"(?P<collection>{collections})/?", RestApiHandler, collections=collections)
-    add_route(r"(?P<collection>{collections})/(?P<resource_id>\w+)", RestApiHandler,
+    add_route(r"(?P<collection>{collections})/?", CDCAggRestApiHandler, collections=collections)
+    add_route(r"(?P<collection>{collections})/(?P<resource_id>\w+)", CDCAggRestApiHandler,
+              collections=collections)
+    add_route(r"upsert/(?P<collection>{collections})/?", UpsertHandler,
+              collections=collections)
+    add_route(r"harvest/(?P<collection>{collections})/?", HarvestSessionHandler,
+              collections=collections)
+    add_route(r"harvest/(?P<collection>{collections})/(?P<session_id>\w+)/close/?", HarvestSessionHandler,
+              collections=collections)
+    add_route(r"delete/(?P<collection>{collections})/?", BulkDeleteHandler,
+              collections=collections)
+    add_route(r"delete/(?P<collection>{collections})/(?P<job_id>\w+)", BulkDeleteHandler,
+              collections=collections)
+    add_route(r"query/(?P<collection>{collections})/?", CDCAggQueryHandler,
               collections=collections)
-    add_route(r"query/(?P<collection>{collections})/?", QueryHandler,
+    add_route(r"query/(?P<collection>{collections})/multiget/?", MultiGetHandler,
               collections=collections)
+    add_route(r"metrics/?", MetricsHandler)
+    # Probes of orchestrators use fixed paths regardless of API version.
+    handlers.append((r'/health/?', HealthHandler))
+    handlers.append((r'/ready/?', ReadyHandler))
     return WebApplication(handlers=handlers, **kw)
+
+
+def add_cli_args(parser):
+    """Adds HTTP API CLI arguments to argument parser.
+
+    :param parser: Argument parser
+    :type parser: :obj:`configargparse.ArgumentParser`
+    """
+    parser.add('--multiget-max-ids',
+               help='Maximum number of ids accepted in a single multi-get request',
+               default=MULTIGET_MAX_IDS,
+               env_var='DOCSTORE_MULTIGET_MAX_IDS',
+               type=int)
+    parser.add('--stream-high-water-mark',
+               help='Bytes of streamed response buffered before waiting for the client to read them. '
+               'Streaming of multi-get results and of Query API results streamed by DocStore pauses '
+               'until the buffer drains. Select queries delegated to Kuha Document Store are not '
+               'covered. 0 waits after every document',
+               default=DEFAULT_HIGH_WATER_MARK,
+               env_var='DOCSTORE_STREAM_HIGH_WATER_MARK',
+               type=int)
+    parser.add('--max-concurrent-reads',
+               help='Maximum number of concurrently handled REST API GET and multi-get requests. '
+               '0 disables the limit',
+               default=0,
+               env_var='DOCSTORE_MAX_CONCURRENT_READS',
+               type=int)
+    parser.add('--max-concurrent-writes',
+               help='Maximum number of concurrently handled REST API POST, PUT and DELETE requests. '
+               '0 disables the limit',
+               default=0,
+               env_var='DOCSTORE_MAX_CONCURRENT_WRITES',
+               type=int)
+    parser.add('--max-concurrent-queries',
+               help='Maximum number of concurrently handled Query API requests. 0 disables the limit',
+               default=0,
+               env_var='DOCSTORE_MAX_CONCURRENT_QUERIES',
+               type=int)
+    parser.add('--max-queued-requests',
+               help='Maximum number of requests waiting for their turn per limited request type. '
+               'Requests exceeding the queue are rejected with 503 Service Unavailable',
+               default=128,
+               env_var='DOCSTORE_MAX_QUEUED_REQUESTS',
+               type=int)
+    parser.add('--queue-timeout',
+               help='Maximum number of seconds a request may wait in the queue. 0 waits indefinitely',
+               default=10,
+               env_var='DOCSTORE_QUEUE_TIMEOUT',
+               type=float)
+    parser.add('--retry-after',
+               help='Seconds in Retry-After header of rejected requests',
+               default=1,
+               env_var='DOCSTORE_RETRY_AFTER',
+               type=int)
+    parser.add('--profiling-token',
+               help='Secret token that authorizes profiling of a request. Requests carrying the token in '
+               'header X-Profile are profiled. Failed attempts lock out profiling for a period doubling with '
+               'consecutive failures. Empty disables profiling',
+               default='',
+               env_var='DOCSTORE_PROFILING_TOKEN',
+               type=str)
+    parser.add('--profiling-dir',
+               help='Directory to store profiles of requests in. Defaults to the temporary directory',
+               default='',
+               env_var='DOCSTORE_PROFILING_DIR',
+               type=str)
+    parser.add('--profiling-min-interval',
+               help='Minimum seconds between profiled requests',
+               default=60,
+               env_var='DOCSTORE_PROFILING_MIN_INTERVAL',
+               type=float)
+
+
+def app_settings(settings):
+    """Get keyword arguments for :func:`get_app` from loaded settings.
+
+    :param settings: Loaded settings.
+    :type settings: :obj:`argparse.Namespace`
+    :returns: Keyword arguments for WebApplication.
+    :rtype: dict
+    """
+    return {'multiget_max_ids': settings.multiget_max_ids,
+            'stream_high_water_mark': settings.stream_high_water_mark,
+            'concurrency_limiters': limiters_from_settings(settings),
+            'request_profiler': profiler_from_settings(settings)}
@@ -0,0 +1,180 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Request concurrency limiting and load shedding.
+
+Requests are divided into route classes: reads, writes and
+queries. Each route class has its own limit for concurrently
+handled requests and a bounded queue for waiting requests.
+Requests that do not fit into the queue, or wait in the queue
+for too long, are rejected.
+"""
+from datetime import timedelta
+from tornado.locks import Semaphore
+from tornado.util import TimeoutError as TornadoTimeoutError
+
+from .metrics import REGISTRY
+
+
+ROUTE_CLASS_READS = 'reads'
+ROUTE_CLASS_WRITES = 'writes'
+ROUTE_CLASS_QUERIES = 'queries'
+ROUTE_CLASSES = (ROUTE_CLASS_READS, ROUTE_CLASS_WRITES, ROUTE_CLASS_QUERIES)
+
+
+class LimiterSaturated(Exception):
+    """Raised when a request cannot be admitted."""
+
+
+class ConcurrencyLimiter:
+    """Limits concurrently handled requests of a route class.
+
+    :param str name: Name of the route class.
+    :param int max_concurrent: Maximum number of concurrently handled
+                               requests.
+    :param int max_queue: Maximum number of requests waiting for their
+                          turn.
+    :param float queue_timeout: Maximum number of seconds a request may
+                                wait in the queue. Zero or None waits
+                                indefinitely.
+    :param int retry_after: Seconds submitted to rejected clients in
+                            Retry-After header.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout=None, retry_after=1):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = timedelta(seconds=queue_timeout) if queue_timeout else None
+        self.retry_after = retry_after
+        self._semaphore = Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self._active_gauge = REGISTRY.gauge('concurrency.%s.active' % (name,),
+                                            'Requests currently handled')
+        self._waiting_gauge = REGISTRY.gauge('concurrency.%s.queue_depth' % (name,),
+                                             'Requests waiting in queue')
+        self._rejected = REGISTRY.counter('concurrency.%s.rejected' % (name,),
+                                          'Requests rejected due to saturation')
+
+    def _update_gauges(self):
+        self._active_gauge.set(self.active)
+        self._waiting_gauge.set(self.waiting)
+
+    async def acquire(self):
+        """Acquire a slot for handling a request.
+
+        :raises: :exc:`LimiterSaturated` if the queue is full or the
+                 wait times out.
+        """
+        if self.active >= self.max_concurrent and self.waiting >= self.max_queue:
+            self._rejected.inc()
+            raise LimiterSaturated(self.name)
+        self.waiting += 1
+        self._update_gauges()
+        try:
+            await self._semaphore.acquire(timeout=self.queue_timeout)
+        except TornadoTimeoutError as exc:
+            self._rejected.inc()
+            raise LimiterSaturated(self.name) from exc
+        finally:
+            self.waiting -= 1
+            self._update_gauges()
+        self.active += 1
+        self._update_gauges()
+
+    def release(self):
+        """Release a slot acquired with :meth:`acquire`."""
+        self.active -= 1
+        self._update_gauges()
+        self._semaphore.release()
+
+
+def limiters_from_settings(settings):
+    """Instantiate limiters from loaded settings.
+
+    Route classes with maximum concurrency of zero are not limited.
+
+    :param settings: Loaded settings.
+    :type settings: :obj:`argparse.Namespace`
+    :returns: Route class names mapped to limiters.
+    :rtype: dict
+    """
+    limiters = {}
+    for route_class in ROUTE_CLASSES:
+        max_concurrent = getattr(settings, 'max_concurrent_%s' % (route_class,))
+        if max_concurrent > 0:
+            limiters[route_class] = ConcurrencyLimiter(route_class, max_concurrent,
+                                                       settings.max_queued_requests,
+                                                       queue_timeout=settings.queue_timeout,
+                                                       retry_after=settings.retry_after)
+    return limiters
+
+
+class ConcurrencyLimitMixin:
+    """Mixin for request handlers to apply concurrency limits.
+
+    Limiters are looked up from application setting
+    `concurrency_limiters` by the route class of the handler.
+    Saturated requests are answered with 503 Service Unavailable
+    and a Retry-After header.
+    """
+
+    #: Route class of the handler.
+    route_class = ROUTE_CLASS_READS
+    _acquired_limiter = None
+
+    def get_route_class(self):
+        """Get route class of the current request.
+
+        :returns: Route class name.
+        :rtype: str
+        """
+        return self.route_class
+
+    def _reject(self, limiter):
+        self.set_status(503)
+        self.set_header('Retry-After', str(limiter.retry_after))
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.finish({'code': 503,
+                     'message': 'HTTP 503: Service Unavailable (Too many concurrent %s requests)' % (
+                         limiter.name,)})
+
+    def _release_limiter(self):
+        # Guards against releasing the slot twice.
+        if self._acquired_limiter is not None:
+            self._acquired_limiter.release()
+            self._acquired_limiter = None
+
+    async def prepare(self):
+        """Acquire concurrency slot before preparing the request."""
+        limiter = (self.settings.get('concurrency_limiters') or {}).get(self.get_route_class())
+        if limiter is not None:
+            try:
+                await limiter.acquire()
+            except LimiterSaturated:
+                self._reject(limiter)
+                return
+            self._acquired_limiter = limiter
+        rval = super().prepare()
+        if rval is not None:
+            await rval
+
+    def on_finish(self):
+        """Release concurrency slot when the request is finished.
+
+        The slot is not released when the client closes the
+        connection, because the handler keeps working until it
+        finishes.
+        """
+        self._release_limiter()
+        super().on_finish()
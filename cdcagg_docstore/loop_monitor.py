@@ -0,0 +1,140 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Monitoring of event loop lag.
+
+A callback scheduled at a fixed interval measures how late the event
+loop runs it. The lag is recorded in a histogram. A watchdog thread
+detects when the event loop has not run the callback for longer than
+a threshold and logs the stack of the event loop thread, which shows
+the code blocking the loop.
+"""
+import logging
+import sys
+import threading
+import time
+import traceback
+from tornado.ioloop import IOLoop
+
+from .metrics import REGISTRY
+
+
+_logger = logging.getLogger(__name__)
+
+#: Buckets of the lag histogram in seconds.
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LoopLagMonitor:
+    """Samples event loop lag and detects blocking callbacks.
+
+    :param float interval: Seconds between lag samples.
+    :param float block_threshold: Log stack of the event loop thread
+                                  when the loop is blocked longer than
+                                  this many seconds. 0 disables
+                                  detection of blocking.
+    """
+
+    def __init__(self, interval=0.5, block_threshold=0.5):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self._io_loop = None
+        self._timeout = None
+        self._loop_thread_id = None
+        self._expected = None
+        self._last_beat = None
+        self._reported = False
+        self._stopped = threading.Event()
+        self._watchdog = None
+        self._lag = REGISTRY.histogram('ioloop.lag_seconds', 'Event loop scheduling lag in seconds',
+                                       buckets=LAG_BUCKETS)
+        self._blocks = REGISTRY.counter('ioloop.blocked', 'Times the event loop was blocked over the threshold')
+
+    def _schedule(self):
+        self._expected = time.monotonic() + self.interval
+        self._timeout = self._io_loop.call_later(self.interval, self._tick)
+
+    def _tick(self):
+        now = time.monotonic()
+        self._lag.observe(max(0.0, now - self._expected))
+        self._last_beat = now
+        self._reported = False
+        self._schedule()
+
+    def _watch(self):
+        while not self._stopped.wait(self.block_threshold / 2):
+            blocked = time.monotonic() - self._last_beat - self.interval
+            if blocked <= self.block_threshold or self._reported:
+                continue
+            self._reported = True
+            self._blocks.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            _logger.warning('Event loop blocked for %.3f seconds. Stack of event loop thread:\n%s',
+                            blocked, stack)
+
+    def start(self):
+        """Start monitoring the current event loop.
+
+        Must be called from the event loop thread.
+        """
+        self._io_loop = IOLoop.current()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._schedule()
+        if self.block_threshold > 0:
+            self._watchdog = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        """Stop monitoring."""
+        self._stopped.set()
+        if self._timeout is not None:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+
+def monitor_from_settings(settings):
+    """Instantiate event loop monitor from loaded settings.
+
+    :param settings: Loaded settings.
+    :type settings: :obj:`argparse.Namespace`
+    :returns: Monitor or None if monitoring is disabled.
+    :rtype: :obj:`LoopLagMonitor` or None
+    """
+    if settings.loop_lag_interval <= 0:
+        return None
+    return LoopLagMonitor(interval=settings.loop_lag_interval,
+                          block_threshold=settings.loop_block_threshold)
+
+
+def add_cli_args(parser):
+    """Adds event loop monitor CLI arguments to argument parser.
+
+    :param parser: Argument parser
+    :type parser: :obj:`configargparse.ArgumentParser`
+    """
+    parser.add('--loop-lag-interval',
+               help='Seconds between samples of event loop lag. 0 disables the event loop monitor',
+               default=0.5,
+               env_var='DOCSTORE_LOOP_LAG_INTERVAL',
+               type=float)
+    parser.add('--loop-block-threshold',
+               help='Log stack trace of the event loop when it is blocked longer than this many '
+               'seconds. 0 disables logging of blocking code',
+               default=0.5,
+               env_var='DOCSTORE_LOOP_BLOCK_THRESHOLD',
+               type=float)
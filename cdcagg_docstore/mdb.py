@@ -13,9 +13,15 @@
 
 """MongoDB properties"""
 from collections import namedtuple
+from types import MappingProxyType
 from pymongo import (
     ASCENDING,
-    DESCENDING
+    DESCENDING,
+    TEXT
+)
+from kuha_common.document_store.records import (
+    REC_STATUS_CREATED,
+    REC_STATUS_DELETED
 )
 from cdcagg_common import (
     records,
@@ -28,6 +34,9 @@ _COMMON_ISODATE_FIELDS = [
     records.RecordBase._metadata.attr_deleted.path,
     records.RecordBase._metadata.attr_created.path
 ]
+# The full index of update timestamps is kept next to its partial
+# variant of active records. Harvesting of changes by update timestamp
+# must see logically deleted records to propagate the deletions.
 _COMMON_INDEXES = [[(records.RecordBase._metadata.attr_updated.path, DESCENDING)]]
 _COMMON_OBJECTID_FIELDS = [records.RecordBase._id.path]
 
@@ -74,24 +83,176 @@ def _collection_validator(collection_name, record_class, required=None):
     }
 
 
+PartialIndex = namedtuple('PartialIndex', 'name, keys, partial_filter_expression')
+"""Index that covers only documents matching a filter.
+
+:param str name: Index name. Used to hint queries to the index.
+:param list keys: Index keys.
+:param dict partial_filter_expression: Documents matching this
+                                       filter are indexed. Supports
+                                       equality conditions.
+"""
+
+
+def _status_index(status, keys):
+    status_path = records.RecordBase._metadata.attr_status.path
+    keys = [(status_path, ASCENDING)] + list(keys)
+    return PartialIndex(name=status + '_' + '_'.join('%s_%s' % (path, direction) for path, direction in keys),
+                        keys=keys, partial_filter_expression={status_path: status})
+
+
+def active_index(keys):
+    """Initiate index of active, not logically deleted, records.
+
+    Logically deleted records are left out of the index, which keeps
+    it smaller than an index of all records. The index key pattern
+    is prefixed by record status to keep it distinct from full
+    indexes with the same keys.
+
+    :param list keys: Index keys.
+    :returns: Partial index.
+    :rtype: :obj:`PartialIndex`
+    """
+    return _status_index(REC_STATUS_CREATED, keys)
+
+
+def deleted_index(keys):
+    """Initiate index of logically deleted records.
+
+    Only logically deleted records are indexed. Used by the
+    retention purge to find records deleted before a point in time
+    without scanning active records.
+
+    :param list keys: Index keys.
+    :returns: Partial index.
+    :rtype: :obj:`PartialIndex`
+    """
+    return _status_index(REC_STATUS_DELETED, keys)
+
+
+_COMMON_PARTIAL_INDEXES = [active_index(index) for index in _COMMON_INDEXES] +\
+    [deleted_index([(records.RecordBase._metadata.attr_deleted.path, ASCENDING)])]
+
+
+TextIndex = namedtuple('TextIndex', 'name, keys, weights, default_language, language_override')
+"""Text index of a collection. A collection may have a single text index.
+
+:param str name: Index name.
+:param list keys: Index keys.
+:param dict weights: Field paths mapped to their weights in
+                     relevance scoring.
+:param str default_language: Language used for stemming and stop
+                             words.
+:param str language_override: Name of the document field that
+                              overrides the default language.
+"""
+
+
+def text_index(weights):
+    """Initiate text index over weighted fields.
+
+    Records are multilingual and may be in languages that MongoDB
+    text search does not support. Indexing a record with an
+    unsupported language override fails the write. Therefore the
+    index uses language 'none', which tokenizes text without
+    language specific stemming or stop words, and a language
+    override field that records do not contain. Text search is case
+    and diacritic insensitive for every language.
+
+    :param dict weights: Field paths mapped to their weights.
+    :returns: Text index.
+    :rtype: :obj:`TextIndex`
+    """
+    return TextIndex(name='text_search', keys=[(path, TEXT) for path in weights], weights=dict(weights),
+                     default_language='none', language_override='_text_language')
+
+
 Collection = namedtuple('Collection',
                         'name, validators, indexes_unique, '
-                        'indexes, isodate_fields, object_id_fields')
+                        'indexes, isodate_fields, object_id_fields, partial_indexes, text_index',
+                        defaults=((), None))
 """Collection object contains properties of a MongoDB collection.
 
 :param str name: Collection name.
 :param dict validators: MongoDB validators for collection.
-:param list indexes_unique: List of unique MongoDB indexes for collection.
-:param list indexes: List of MongoDB indexes for collection.
-:param list isodate_fields: List of isodate fields for collection.
-:param list object_id_fields: List of collection's object ID fields.
+:param tuple indexes_unique: Unique MongoDB indexes for collection.
+:param tuple indexes: MongoDB indexes for collection.
+:param tuple isodate_fields: Isodate fields for collection.
+:param tuple object_id_fields: Collection's object ID fields.
+:param tuple partial_indexes: Partial MongoDB indexes for collection.
+:param text_index: Text index for collection or None.
+:type text_index: :obj:`TextIndex`
 """
 
 
-def _init_collection(name, validators, indexes_unique):
-    return Collection(name=name, validators=validators, indexes_unique=indexes_unique,
-                      indexes=list(_COMMON_INDEXES), isodate_fields=list(_COMMON_ISODATE_FIELDS),
-                      object_id_fields=list(_COMMON_OBJECTID_FIELDS))
+def _init_collection(name, validators, indexes_unique, partial_indexes=None, text_index=None):
+    return Collection(name=name, validators=validators, indexes_unique=tuple(indexes_unique),
+                      indexes=tuple(_COMMON_INDEXES), isodate_fields=tuple(_COMMON_ISODATE_FIELDS),
+                      object_id_fields=tuple(_COMMON_OBJECTID_FIELDS),
+                      partial_indexes=tuple(_COMMON_PARTIAL_INDEXES) + tuple(partial_indexes or ()),
+                      text_index=text_index)
+
+
+class CollectionRegistry:
+    """Read-only registry of collection definitions.
+
+    Collections are built once and looked up by name. Isodate and
+    object ID fields of each collection are kept in sets for
+    constant time lookups by field path.
+
+    :param collections: Collections to register.
+    :type collections: iterable of :obj:`Collection`
+    """
+
+    def __init__(self, collections):
+        collections = tuple(collections)
+        self._by_name = MappingProxyType({coll.name: coll for coll in collections})
+        self._isodate_fields = MappingProxyType({coll.name: frozenset(coll.isodate_fields)
+                                                 for coll in collections})
+        self._object_id_fields = MappingProxyType({coll.name: frozenset(coll.object_id_fields)
+                                                   for coll in collections})
+
+    def __iter__(self):
+        return iter(self._by_name.values())
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def get(self, name):
+        """Get collection by name.
+
+        :param str name: Collection name.
+        :returns: Collection
+        :rtype: :obj:`Collection`
+        :raises: :exc:`KeyError` if collection is not found.
+        """
+        return self._by_name[name]
+
+    def names(self):
+        """Get names of registered collections.
+
+        :rtype: tuple
+        """
+        return tuple(self._by_name)
+
+    def isodate_fields(self, name):
+        """Get isodate fields of a collection.
+
+        :param str name: Collection name.
+        :rtype: frozenset
+        """
+        return self._isodate_fields[name]
+
+    def object_id_fields(self, name):
+        """Get object ID fields of a collection.
+
+        :param str name: Collection name.
+        :rtype: frozenset
+        """
+        return self._object_id_fields[name]
 
 
 def studies_collection():
@@ -105,4 +266,10 @@ def studies_collection():
                                        required=[records.Study.study_number.path])
     indexes_unique = [[(records.Study.study_number.path, ASCENDING)],
                       [(records.Study._aggregator_identifier.path, ASCENDING)]]
-    return _init_collection(records.Study.get_collection(), validators, indexes_unique)
+    weights = {records.Study.study_titles.attr_study_title.path: 10,
+               records.Study.keywords.attr_keyword.path: 5,
+               records.Study.abstract.attr_abstract.path: 1}
+    # Supports sweeping active records of a source at the end of a harvest session.
+    partial_indexes = [active_index([(records.Study._direct_base_url.path, ASCENDING)])]
+    return _init_collection(records.Study.get_collection(), validators, indexes_unique,
+                            partial_indexes=partial_indexes, text_index=text_index(weights))
@@ -0,0 +1,178 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process metrics of DocStore.
+
+Metrics are kept in a process-wide registry and served as JSON
+from the metrics endpoint of the HTTP API. Note that each server
+process keeps its own metrics.
+"""
+import bisect
+
+
+class Counter:
+    """Monotonically increasing counter.
+
+    :param str name: Metric name.
+    :param str description: Metric description.
+    """
+
+    metric_type = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increment counter.
+
+        :param int amount: Amount to increment.
+        """
+        self.value += amount
+
+    def snapshot(self):
+        """Get current value.
+
+        :returns: Current value.
+        """
+        return self.value
+
+
+class Gauge(Counter):
+    """Gauge that may go up and down.
+
+    :param str name: Metric name.
+    :param str description: Metric description.
+    """
+
+    metric_type = 'gauge'
+
+    def dec(self, amount=1):
+        """Decrement gauge.
+
+        :param int amount: Amount to decrement.
+        """
+        self.value -= amount
+
+    def set(self, value):
+        """Set gauge value.
+
+        :param value: New value.
+        """
+        self.value = value
+
+
+class Histogram:
+    """Histogram of observed values in cumulative buckets.
+
+    :param str name: Metric name.
+    :param str description: Metric description.
+    :param tuple buckets: Upper bounds of buckets in ascending order.
+    """
+
+    metric_type = 'histogram'
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, description, buckets=None):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """Observe a value.
+
+        :param value: Observed value.
+        """
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Get current state.
+
+        :returns: Cumulative bucket counts, total count and sum
+                  of observed values.
+        :rtype: dict
+        """
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ('+Inf',), self._counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'count': self.count, 'sum': self.sum}
+
+
+class Registry:
+    """Registry of metrics.
+
+    Metrics are created on first request and
+    returned as is on subsequent requests.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get_or_create(self, metric_class, name, description, **kw):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = metric_class(name, description, **kw)
+        elif not isinstance(metric, metric_class) or metric.metric_type != metric_class.metric_type:
+            raise ValueError("Metric '%s' is already registered as %s" % (name, metric.metric_type))
+        return metric
+
+    def counter(self, name, description):
+        """Get or create counter.
+
+        :param str name: Metric name.
+        :param str description: Metric description.
+        :rtype: :obj:`Counter`
+        """
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name, description):
+        """Get or create gauge.
+
+        :param str name: Metric name.
+        :param str description: Metric description.
+        :rtype: :obj:`Gauge`
+        """
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name, description, buckets=None):
+        """Get or create histogram.
+
+        :param str name: Metric name.
+        :param str description: Metric description.
+        :param tuple buckets: Upper bounds of buckets.
+        :rtype: :obj:`Histogram`
+        """
+        return self._get_or_create(Histogram, name, description, buckets=buckets)
+
+    def snapshot(self):
+        """Get current state of every metric.
+
+        :returns: Metric names mapped to metric type, description
+                  and value.
+        :rtype: dict
+        """
+        return {name: {'type': metric.metric_type,
+                       'description': metric.description,
+                       'value': metric.snapshot()}
+                for name, metric in sorted(self._metrics.items())}
+
+
+#: Process-wide metrics registry.
+REGISTRY = Registry()
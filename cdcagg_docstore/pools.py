@@ -0,0 +1,81 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Warm-up of connection pools.
+
+A client configured with `minPoolSize` opens that many connections to
+every replica set member in the background, including TCP, TLS and
+authentication handshakes. Connections that completed the handshakes
+are counted from connection pool events, which tells when the pools
+are warm.
+"""
+import threading
+from pymongo.monitoring import ConnectionPoolListener
+
+
+class ConnectionCounter(ConnectionPoolListener):
+    """Counts connections ready for use by server address.
+
+    Events are published from threads of the driver.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = {}
+
+    def ready(self, address):
+        """Number of connections ready for use.
+
+        :param tuple address: Server address as (host, port).
+        :rtype: int
+        """
+        with self._lock:
+            return len(self._ready.get(address, ()))
+
+    def connection_ready(self, event):
+        """Count connection that completed handshakes."""
+        with self._lock:
+            self._ready.setdefault(event.address, set()).add(event.connection_id)
+
+    def connection_closed(self, event):
+        """Stop counting closed connection."""
+        with self._lock:
+            self._ready.get(event.address, set()).discard(event.connection_id)
+
+    def pool_closed(self, event):
+        """Stop counting connections of closed pool."""
+        with self._lock:
+            self._ready.pop(event.address, None)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
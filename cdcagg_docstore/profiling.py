@@ -0,0 +1,252 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""On-demand profiling of single requests.
+
+A request carrying the configured profiling token in header
+`X-Profile` is profiled with cProfile and tracemalloc. The token is
+not accepted in the URL, which ends up in access logs. The pstats dump and a text summary of the slowest
+functions and largest allocations are stored in a directory. The
+response carries header `X-Profile-Status` and the id of the stored
+profile in header `X-Profile-Id`.
+
+Profiling is rate limited to a single profiled request at a time and
+a minimum interval between profiled requests. Each failed attempt
+locks out profiling for a period that doubles with consecutive
+failures. Note that the profile
+covers all code run on the event loop while the request is handled,
+including code of concurrent requests.
+"""
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from .metrics import REGISTRY
+
+
+_logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_STATUS_HEADER = 'X-Profile-Status'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+PROFILE_STATUS_STARTED = 'profiling'
+PROFILE_STATUS_UNAUTHORIZED = 'unauthorized'
+PROFILE_STATUS_RATE_LIMITED = 'rate-limited'
+
+
+class _ProfileSession:
+
+    def __init__(self, profiler, profile_id):
+        self._profiler = profiler
+        self.profile_id = profile_id
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(profiler.traceback_frames)
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError:
+            # Another profiler is active in this interpreter.
+            self._stop_tracing()
+            raise
+
+    def _stop_tracing(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def _summary(self, description, snapshot):
+        stream = io.StringIO()
+        stream.write('%s\n\n' % (description,))
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self._profiler.top)
+        stream.write('Top %s allocations by line\n\n' % (self._profiler.top,))
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        for stat in snapshot.statistics('lineno')[:self._profiler.top]:
+            stream.write('%s\n' % (stat,))
+        return stream.getvalue()
+
+    def stop(self, description):
+        """Stop profiling and store the profile.
+
+        :param str description: Description of the profiled request.
+        :returns: Path of the stored pstats dump.
+        :rtype: str
+        """
+        try:
+            self._profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            self._stop_tracing()
+            path = os.path.join(self._profiler.directory, self.profile_id)
+            self._profile.dump_stats(path + '.pstats')
+            with open(path + '.txt', 'w', encoding='utf-8') as file_:
+                file_.write(self._summary(description, snapshot))
+        finally:
+            self._profiler.release()
+        _logger.info('Stored profile of %s to %s', description, path)
+        return path + '.pstats'
+
+
+class RequestProfiler:
+    """Authorizes, rate limits and runs profiling of requests.
+
+    :param str token: Secret token that authorizes profiling.
+    :param str directory: Directory to store profiles in.
+    :param float min_interval: Minimum seconds between starts of
+                               profiled requests.
+    :param int top: Number of functions and allocations in the summary.
+    :param int traceback_frames: Frames stored per allocation.
+    :param float failure_lockout: Seconds to reject tokens after a
+                                  failed attempt. Doubled on each
+                                  consecutive failure.
+    :param float max_failure_lockout: Maximum seconds to reject
+                                      tokens after failed attempts.
+    """
+
+    def __init__(self, token, directory, min_interval=60, top=30, traceback_frames=1,
+                 failure_lockout=1, max_failure_lockout=300):
+        self._token = token.encode('utf-8')
+        self.directory = directory
+        self.min_interval = min_interval
+        self.top = top
+        self.traceback_frames = traceback_frames
+        self.failure_lockout = failure_lockout
+        self.max_failure_lockout = max_failure_lockout
+        self._active = False
+        self._last_start = None
+        self._failures = 0
+        self._locked_until = None
+        self._profiled = REGISTRY.counter('profiling.profiled', 'Profiled requests')
+        self._rejected = REGISTRY.counter('profiling.rejected', 'Rejected profiling requests')
+
+    def authorize(self, token):
+        """Check profiling token.
+
+        Tokens are rejected without checking while locked out after
+        a failed attempt.
+
+        :param str token: Token submitted with the request.
+        :rtype: bool
+        """
+        now = time.monotonic()
+        if self._locked_until is not None and now < self._locked_until:
+            self._rejected.inc()
+            return False
+        if hmac.compare_digest(token.encode('utf-8'), self._token):
+            self._failures = 0
+            self._locked_until = None
+            return True
+        self._rejected.inc()
+        self._failures += 1
+        lockout = min(self.failure_lockout * 2 ** (self._failures - 1), self.max_failure_lockout)
+        self._locked_until = now + lockout
+        _logger.warning('Rejected profiling token, locked out for %s seconds', lockout)
+        return False
+
+    def start(self):
+        """Start profiling unless rate limited.
+
+        :returns: Profile session or None if rate limited.
+        """
+        now = time.monotonic()
+        if self._active or (self._last_start is not None and now - self._last_start < self.min_interval):
+            self._rejected.inc()
+            return None
+        self._active = True
+        profile_id = '%s-%s' % (time.strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+        try:
+            session = _ProfileSession(self, profile_id)
+        except ValueError:
+            self._active = False
+            self._rejected.inc()
+            return None
+        self._last_start = now
+        self._profiled.inc()
+        return session
+
+    def release(self):
+        """Allow next profiled request."""
+        self._active = False
+
+
+class ProfilingMixin:
+    """Mixin for request handlers to profile requests on demand.
+
+    The profiler is looked up from application setting
+    `request_profiler`. Profiling is disabled if it is not set.
+    """
+
+    _profile_session = None
+
+    def _start_profile(self):
+        profiler = self.settings.get('request_profiler')
+        if profiler is None:
+            return
+        token = self.request.headers.get(PROFILE_HEADER)
+        if token is None:
+            return
+        if not profiler.authorize(token):
+            self.set_header(PROFILE_STATUS_HEADER, PROFILE_STATUS_UNAUTHORIZED)
+            return
+        self._profile_session = profiler.start()
+        if self._profile_session is None:
+            self.set_header(PROFILE_STATUS_HEADER, PROFILE_STATUS_RATE_LIMITED)
+            return
+        self.set_header(PROFILE_STATUS_HEADER, PROFILE_STATUS_STARTED)
+        self.set_header(PROFILE_ID_HEADER, self._profile_session.profile_id)
+
+    def _stop_profile(self):
+        if self._profile_session is not None:
+            session, self._profile_session = self._profile_session, None
+            try:
+                session.stop('%s %s %s' % (self.request.method, self.request.uri, self.get_status()))
+            except Exception:
+                _logger.exception('Failed to store profile %s', session.profile_id)
+
+    async def prepare(self):
+        """Start profiling if requested before preparing the request."""
+        self._start_profile()
+        rval = super().prepare()
+        if rval is not None:
+            await rval
+
+    def on_finish(self):
+        """Stop profiling when the request is finished."""
+        self._stop_profile()
+        super().on_finish()
+
+    def on_connection_close(self):
+        """Stop profiling if the client closes the connection."""
+        self._stop_profile()
+        super().on_connection_close()
+
+
+def profiler_from_settings(settings):
+    """Instantiate request profiler from loaded settings.
+
+    :param settings: Loaded settings.
+    :type settings: :obj:`argparse.Namespace`
+    :returns: Profiler or None if profiling is disabled.
+    :rtype: :obj:`RequestProfiler` or None
+    """
+    if not settings.profiling_token:
+        return None
+    return RequestProfiler(settings.profiling_token,
+                           settings.profiling_dir or tempfile.gettempdir(),
+                           min_interval=settings.profiling_min_interval)
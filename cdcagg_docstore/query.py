@@ -0,0 +1,409 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Query API request parsing.
+
+Parses and validates Query API request bodies into :obj:`Query`
+objects. Query filters may contain special operators `$oid` and
+`$isodate`, which are converted to ObjectIds and datetimes.
+"""
+import json
+from collections import namedtuple
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from .conversion import datestamp_to_datetime
+
+
+QUERY_TYPE_SELECT = 'select'
+QUERY_TYPE_COUNT = 'count'
+QUERY_TYPE_DISTINCT = 'distinct'
+QUERY_TYPE_AGGREGATE = 'aggregate'
+QUERY_TYPE_FACETS = 'facets'
+QUERY_TYPES = (QUERY_TYPE_SELECT, QUERY_TYPE_COUNT, QUERY_TYPE_DISTINCT, QUERY_TYPE_AGGREGATE,
+               QUERY_TYPE_FACETS)
+
+_FILTER_OPERATORS = frozenset((
+    '$exists', '$eq', '$ne', '$lt', '$lte', '$gt', '$gte', '$in', '$nin', '$all', '$size',
+    '$and', '$not', '$nor', '$or', '$elemMatch', '$regex', '$options'))
+_PIPELINE_STAGES = frozenset(('$match', '$group', '$project', '$sort', '$limit', '$facet', '$unwind'))
+#: Expression operators that execute code or access other collections.
+_DISALLOWED_EXPRESSION_OPERATORS = frozenset(('$function', '$accumulator', '$where', '$lookup',
+                                               '$graphLookup', '$unionWith', '$out', '$merge'))
+_OP_OID = '$oid'
+_TEXT_SEARCH_MAX_LENGTH = 512
+#: Field containing relevance score of text search results.
+TEXT_SCORE_FIELD = '_score'
+_OP_ISODATE = '$isodate'
+
+
+class QueryError(ValueError):
+    """Raised on invalid or disallowed queries."""
+
+
+Query = namedtuple('Query', 'query_type, query_filter, fields, skip, limit, sort_by, sort_order, fieldname, '
+                   'pipeline, text_search', defaults=(None, None))
+"""Parsed Query API request.
+
+:param str query_type: Query type.
+:param dict query_filter: MongoDB query filter.
+:param list fields: Fields to return or None for every field.
+:param int skip: Number of documents to skip.
+:param int limit: Maximum number of documents to return. 0 for no limit.
+:param str sort_by: Field to sort by or None.
+:param int sort_order: Sort order: 1 for ascending, -1 for descending.
+:param str fieldname: Field to query distinct values for.
+:param list pipeline: Aggregation pipeline of aggregate query.
+:param str text_search: Text to search for or None.
+"""
+
+
+def _convert_special(operator, value):
+    try:
+        if operator == _OP_OID:
+            return ObjectId(value)
+        return datestamp_to_datetime(value)
+    except (InvalidId, TypeError, ValueError) as exc:
+        raise QueryError('Invalid value for %s: %s' % (operator, value)) from exc
+
+
+def convert_filter(query_filter):
+    """Validate query filter and convert special operators.
+
+    :param query_filter: Query filter from request body.
+    :returns: Query filter ready to be submitted to MongoDB.
+    :raises: :exc:`QueryError` if filter contains operators not allowed.
+    """
+    if isinstance(query_filter, list):
+        return [convert_filter(item) for item in query_filter]
+    if not isinstance(query_filter, dict):
+        return query_filter
+    if len(query_filter) == 1:
+        operator, value = next(iter(query_filter.items()))
+        if operator in (_OP_OID, _OP_ISODATE):
+            return _convert_special(operator, value)
+    converted = {}
+    for key, value in query_filter.items():
+        if not isinstance(key, str):
+            raise QueryError('Invalid key in filter: %s' % (key,))
+        if key.startswith('$') and key not in _FILTER_OPERATORS:
+            raise QueryError('Unsupported filter operator: %s' % (key,))
+        converted[key] = convert_filter(value)
+    return converted
+
+
+def _check_expression(expression):
+    if isinstance(expression, list):
+        for item in expression:
+            _check_expression(item)
+    elif isinstance(expression, dict):
+        for key, value in expression.items():
+            if key in _DISALLOWED_EXPRESSION_OPERATORS:
+                raise QueryError('Unsupported expression operator: %s' % (key,))
+            _check_expression(value)
+
+
+def convert_pipeline(pipeline, nested=False):
+    """Validate aggregation pipeline and convert special operators.
+
+    Pipeline stages are limited to $match, $group, $project, $sort,
+    $limit, $facet and $unwind. $match stages are validated like
+    query filters. Sub-pipelines of $facet may not contain $facet.
+
+    :param pipeline: Aggregation pipeline from request body.
+    :param bool nested: True for sub-pipelines of $facet.
+    :returns: Pipeline ready to be submitted to MongoDB.
+    :raises: :exc:`QueryError` if pipeline contains stages or
+             operators not allowed.
+    """
+    if not isinstance(pipeline, list) or not pipeline:
+        raise QueryError("Key 'pipeline' must be a non-empty list of stages")
+    converted = []
+    for stage in pipeline:
+        if not isinstance(stage, dict) or len(stage) != 1:
+            raise QueryError('Pipeline stage must be an object with a single key')
+        name, spec = next(iter(stage.items()))
+        if name not in _PIPELINE_STAGES or (nested and name == '$facet'):
+            raise QueryError('Unsupported pipeline stage: %s' % (name,))
+        if name == '$match':
+            if not isinstance(spec, dict):
+                raise QueryError('Stage $match must be an object')
+            spec = convert_filter(spec)
+        elif name == '$facet':
+            if not isinstance(spec, dict) or not spec:
+                raise QueryError('Stage $facet must be a non-empty object')
+            spec = {key: convert_pipeline(sub_pipeline, nested=True) for key, sub_pipeline in spec.items()}
+        else:
+            _check_expression(spec)
+        converted.append({name: spec})
+    return converted
+
+
+def _get_int(body, key, default=0, minimum=0):
+    value = body.get(key, default)
+    if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+        raise QueryError("Key '%s' must be an integer greater than or equal to %s" % (key, minimum))
+    return value
+
+
+def _get_fieldname(body, key, required=False):
+    value = body.get(key)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or not value or value.startswith('$'):
+        raise QueryError("Key '%s' must be a field name" % (key,))
+    return value
+
+
+def parse_query(query_type, body):
+    """Parse Query API request body.
+
+    Text search is submitted in key `_text` and applies to every
+    query type except aggregate. Aggregate queries submit their
+    pipeline in key `pipeline`. Other keys are ignored for aggregate
+    queries. Facets queries count
+    values of `fields` in documents matching `_filter`, limiting the
+    number of values per field with `limit`.
+
+    :param str query_type: Query type.
+    :param dict body: Decoded request body.
+    :returns: Parsed query.
+    :rtype: :obj:`Query`
+    :raises: :exc:`QueryError` if the query is invalid.
+    """
+    if query_type not in QUERY_TYPES:
+        raise QueryError("Invalid query type '%s'. Endpoint supports %s" % (
+            query_type, ', '.join("'%s'" % (_type,) for _type in QUERY_TYPES)))
+    if not isinstance(body, dict):
+        raise QueryError('Request body must be a JSON object')
+    if query_type == QUERY_TYPE_AGGREGATE:
+        return Query(query_type=query_type, query_filter={}, fields=None, skip=0, limit=0,
+                     sort_by=None, sort_order=1, fieldname=None,
+                     pipeline=convert_pipeline(body.get('pipeline')))
+    query_filter = body.get('_filter') or {}
+    if not isinstance(query_filter, dict):
+        raise QueryError("Key '_filter' must be an object")
+    fields = body.get('fields')
+    if fields is not None and (not isinstance(fields, list) or
+                               not all(isinstance(field, str) and not field.startswith('$')
+                                       for field in fields)):
+        raise QueryError("Key 'fields' must be a list of field names")
+    if query_type == QUERY_TYPE_FACETS and not fields:
+        raise QueryError("Key 'fields' must list the fields to count values for")
+    query_filter = convert_filter(query_filter)
+    text_search = body.get('_text')
+    if text_search is not None:
+        if not isinstance(text_search, str) or not text_search.strip() or\
+           len(text_search) > _TEXT_SEARCH_MAX_LENGTH:
+            raise QueryError("Key '_text' must be a non-empty string of at most %s characters" % (
+                _TEXT_SEARCH_MAX_LENGTH,))
+        query_filter['$text'] = {'$search': text_search}
+    sort_order = body.get('sort_order', 1)
+    if sort_order not in (1, -1) or isinstance(sort_order, bool):
+        raise QueryError("Key 'sort_order' must be 1 or -1")
+    return Query(query_type=query_type,
+                 query_filter=query_filter,
+                 fields=fields or None,
+                 skip=_get_int(body, 'skip'),
+                 limit=_get_int(body, 'limit'),
+                 sort_by=_get_fieldname(body, 'sort_by'),
+                 sort_order=sort_order,
+                 fieldname=_get_fieldname(body, 'fieldname', required=query_type == QUERY_TYPE_DISTINCT),
+                 text_search=text_search)
+
+
+def is_full_dump(query):
+    """Is the query a plain select of the whole collection?
+
+    Unfiltered and unsorted select queries are full collection
+    dumps, which are expected to scan the collection.
+
+    :param query: Parsed query.
+    :type query: :obj:`Query`
+    :rtype: bool
+    """
+    return query.query_type == QUERY_TYPE_SELECT and not query.query_filter and query.sort_by is None
+
+
+def _shape(value, value_paths):
+    if isinstance(value, dict):
+        return {key: item if key in value_paths else _shape(item, value_paths) for key, item in value.items()}
+    if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+        return [_shape(item, value_paths) for item in value]
+    return None
+
+
+def query_shape(query, value_paths=()):
+    """Get shape of a query.
+
+    The shape consists of the query type, the structure of the filter
+    or pipeline and the sort. Values compared in the filter are left
+    out, so queries that differ only by the values share a shape, and
+    a query plan. Values of fields in `value_paths` are kept, since
+    they decide whether a partial index can serve the query.
+
+    :param query: Parsed query.
+    :type query: :obj:`Query`
+    :param value_paths: Paths of fields whose values are part of
+                        the shape.
+    :type value_paths: iterable of str
+    :returns: Shape of the query.
+    :rtype: str
+    """
+    value_paths = frozenset(value_paths)
+    return json.dumps([query.query_type, _shape(query.query_filter, value_paths),
+                       _shape(query.pipeline, value_paths), query.fieldname, query.sort_by, query.sort_order],
+                      sort_keys=True, default=str)
+
+
+def select_sort(query):
+    """Get sort specification of a select query.
+
+    Text search results are sorted by relevance score unless sorted
+    by another field.
+
+    :param query: Parsed select query.
+    :type query: :obj:`Query`
+    :returns: List of sort keys or None if not sorted.
+    :rtype: list or None
+    """
+    if query.text_search is not None and query.sort_by in (None, TEXT_SCORE_FIELD):
+        return [(TEXT_SCORE_FIELD, {'$meta': 'textScore'})]
+    if query.sort_by is None:
+        return None
+    return [(query.sort_by, query.sort_order)]
+
+
+def select_projection(query):
+    """Get projection of a select query.
+
+    Text search results contain relevance score in field
+    :data:`TEXT_SCORE_FIELD`.
+
+    :param query: Parsed select query.
+    :type query: :obj:`Query`
+    :returns: Projection or None to return every field.
+    :rtype: dict or None
+    """
+    projection = dict.fromkeys(query.fields, True) if query.fields else {}
+    if query.text_search is not None:
+        projection[TEXT_SCORE_FIELD] = {'$meta': 'textScore'}
+    return projection or None
+
+
+def select_pipeline(query):
+    """Build aggregation pipeline equivalent to a select query.
+
+    :param query: Parsed select query.
+    :type query: :obj:`Query`
+    :returns: Aggregation pipeline.
+    :rtype: list
+    """
+    pipeline = [{'$match': query.query_filter}]
+    if query.text_search is not None and not query.fields:
+        pipeline.append({'$addFields': {TEXT_SCORE_FIELD: {'$meta': 'textScore'}}})
+    sort = select_sort(query)
+    if sort is not None:
+        pipeline.append({'$sort': dict(sort)})
+    if query.skip:
+        pipeline.append({'$skip': query.skip})
+    if query.limit:
+        pipeline.append({'$limit': query.limit})
+    if query.fields:
+        pipeline.append({'$project': select_projection(query)})
+    return pipeline
+
+
+def facets_pipeline(query):
+    """Build aggregation pipeline of a facets query.
+
+    Counts the documents matching the filter and the documents per
+    value of each field in a single $facet stage. Values of array
+    fields are counted once per document. Values are sorted by count
+    in descending order.
+
+    :param query: Parsed facets query.
+    :type query: :obj:`Query`
+    :returns: Aggregation pipeline. Facets are keyed by the index of
+              the field in `query.fields`, since field paths may not
+              be used as keys of $facet.
+    :rtype: list
+    """
+    facets = {'count': [{'$count': 'count'}]}
+    for index, field in enumerate(query.fields):
+        facet = [{'$project': {'value': '$' + field}},
+                 {'$unwind': '$value'},
+                 {'$group': {'_id': {'doc': '$_id', 'value': '$value'}}},
+                 {'$group': {'_id': '$_id.value', 'count': {'$sum': 1}}},
+                 {'$sort': {'count': -1, '_id': 1}}]
+        if query.limit:
+            facet.append({'$limit': query.limit})
+        facets[str(index)] = facet
+    return [{'$match': query.query_filter}, {'$facet': facets}]
+
+
+def _matches_equality(condition, value):
+    if isinstance(condition, dict):
+        return condition == {'$eq': value}
+    return condition == value
+
+
+def partial_index_hint(query, partial_indexes):
+    """Find a partial index to route the query to.
+
+    A partial index is eligible if the query filter requires every
+    condition of the partial filter expression of the index and
+    the other filtered fields and the sort field are index keys.
+    Filters with top-level operators, such as $or and $and, are left
+    to the query planner, since conditions inside the operators may
+    be better served by other indexes.
+
+    :param query: Parsed query.
+    :type query: :obj:`Query`
+    :param partial_indexes: Partial indexes of the collection.
+    :type partial_indexes: iterable of :obj:`cdcagg_docstore.mdb.PartialIndex`
+    :returns: Name of the index or None if no index is eligible.
+    :rtype: str or None
+    """
+    query_filter = query.query_filter
+    if any(key.startswith('$') for key in query_filter):
+        # Includes $text. Text search must use the text index.
+        return None
+    fields = set(query_filter)
+    if query.sort_by is not None:
+        fields.add(query.sort_by)
+    for index in partial_indexes:
+        expression = index.partial_filter_expression
+        if not all(path in query_filter and _matches_equality(query_filter[path], value)
+                   for path, value in expression.items()):
+            continue
+        used = fields - set(expression)
+        if used and used <= {path for path, _ in index.keys}:
+            return index.name
+    return None
+
+
+def plan_has_collscan(explain_result):
+    """Does the winning plan of explain result contain a collection scan?
+
+    :param dict explain_result: Result of MongoDB explain command.
+    :rtype: bool
+    """
+    def _walk(node):
+        if isinstance(node, dict):
+            if node.get('stage') == 'COLLSCAN':
+                return True
+            return any(_walk(value) for value in node.values())
+        if isinstance(node, list):
+            return any(_walk(item) for item in node)
+        return False
+    return _walk(explain_result.get('queryPlanner', {}).get('winningPlan', {}))
@@ -0,0 +1,221 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Replication lag aware routing of reads.
+
+Reads may be routed to secondaries of the replica set with a read
+preference. A periodic job tracks the replication lag of each member
+and reads are routed only to secondaries whose lag is within a
+maximum staleness. If no secondary is fresh enough, reads fall back
+to the primary.
+
+Clients that need to read their own writes use causal consistency
+tokens in header `X-Causal-Token`. A request carrying the header is
+executed in a causally consistent session. A write request sends
+`new` or a previous token and the response carries the token of the
+write. A read request carrying the token waits until the member
+serving the read has replicated the write.
+"""
+import base64
+import binascii
+import logging
+import bson
+from bson.errors import BSONError
+from bson.timestamp import Timestamp
+from pymongo import ReadPreference
+from tornado.ioloop import (
+    IOLoop,
+    PeriodicCallback
+)
+
+from .metrics import REGISTRY
+
+
+_logger = logging.getLogger(__name__)
+
+#: Header carrying causal consistency tokens.
+CAUSAL_TOKEN_HEADER = 'X-Causal-Token'
+
+#: Value of the causal consistency token header that starts a new
+#: causally consistent session.
+CAUSAL_TOKEN_NEW = 'new'
+
+#: Read preferences by mode name.
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST
+}
+
+
+class CausalTokenError(Exception):
+    """Causal consistency token is invalid."""
+
+
+def encode_causal_token(session):
+    """Encode causal consistency token of a session.
+
+    The token carries the operation time and the signed cluster time
+    of the session.
+
+    :param session: Causally consistent session.
+    :type session: :obj:`motor.motor_tornado.MotorClientSession`
+    :returns: Token or None if the session has not run operations.
+    :rtype: str or None
+    """
+    if session.operation_time is None:
+        return None
+    return base64.urlsafe_b64encode(bson.encode({'operationTime': session.operation_time,
+                                                 'clusterTime': session.cluster_time})).decode('ascii')
+
+
+def decode_causal_token(token):
+    """Decode causal consistency token.
+
+    :param str token: Causal consistency token.
+    :returns: Operation time and cluster time of the token.
+    :rtype: tuple
+    :raises: :exc:`CausalTokenError` if the token is invalid.
+    """
+    try:
+        times = bson.decode(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (BSONError, binascii.Error, UnicodeError, ValueError) as exc:
+        raise CausalTokenError('Invalid causal consistency token') from exc
+    operation_time = times.get('operationTime')
+    cluster_time = times.get('clusterTime')
+    if not isinstance(operation_time, Timestamp) or not isinstance(cluster_time, dict):
+        raise CausalTokenError('Invalid causal consistency token')
+    return operation_time, cluster_time
+
+
+class ReplicationMonitor:
+    """Tracks replication lag of replica set members.
+
+    Used as a custom server selector of the reader client, which
+    leaves out secondaries lagging more than the maximum staleness
+    and applies the read preference to the remaining members.
+    Members with unknown lag are considered stale.
+
+    :param db: Database controller.
+    :type db: :obj:`cdcagg_docstore.controller.CDCAggDatabase`
+    :param float max_staleness: Maximum replication lag in seconds of
+                                secondaries that serve reads.
+    :param float interval: Seconds between updates.
+    :param read_preference: Read preference applied to the primary
+                            and the fresh secondaries.
+    :type read_preference: :obj:`pymongo.read_preferences.ServerMode`
+    """
+
+    def __init__(self, db, max_staleness, interval=5, read_preference=ReadPreference.NEAREST):
+        self._db = db
+        self.max_staleness = max_staleness
+        self.interval = interval
+        self.read_preference = read_preference
+        self.status = None
+        # Replaced as a whole, since servers are selected in
+        # threads of the driver.
+        self._fresh_secondaries = frozenset()
+        self._running = False
+        self._periodic = None
+        self._fresh_gauge = REGISTRY.gauge('replication.fresh_secondaries',
+                                           'Secondaries within maximum staleness')
+        self._errors = REGISTRY.counter('replication.errors', 'Failed updates of replication lag')
+
+    @property
+    def fresh_secondaries(self):
+        """Addresses of secondaries within maximum staleness.
+
+        :rtype: frozenset
+        """
+        return self._fresh_secondaries
+
+    def select_servers(self, server_descriptions):
+        """Select servers within maximum staleness.
+
+        Custom server selector for
+        :obj:`pymongo.mongo_client.MongoClient`. Selects among the
+        primary and the fresh secondaries by read preference. Modes
+        secondaryPreferred and nearest fall back to the primary if no
+        secondary is fresh. Mode secondary selects nothing then, and
+        the read waits for a fresh secondary until the server
+        selection timeout.
+
+        :param list server_descriptions: Candidate servers.
+        :returns: Selectable servers.
+        :rtype: list
+        """
+        fresh_secondaries = self._fresh_secondaries
+        primary = [server for server in server_descriptions if server.is_writable]
+        fresh = [server for server in server_descriptions
+                 if not server.is_writable and '%s:%s' % server.address in fresh_secondaries]
+        if self.read_preference == ReadPreference.PRIMARY:
+            return primary
+        if self.read_preference == ReadPreference.PRIMARY_PREFERRED:
+            return primary or fresh
+        if self.read_preference == ReadPreference.SECONDARY:
+            return fresh
+        if self.read_preference == ReadPreference.SECONDARY_PREFERRED:
+            return fresh or primary
+        return primary + fresh
+
+    async def update(self):
+        """Update replication lag of members.
+
+        Does nothing if a previous update is still in progress.
+        Keeps the previous state if the update fails.
+
+        :returns: Replica set status, see
+                  :meth:`cdcagg_docstore.controller.CDCAggDatabase.replica_set_status`
+        :rtype: dict
+        """
+        if self._running:
+            return self.status
+        self._running = True
+        try:
+            status = await self._db.replica_set_status()
+        except Exception:
+            self._errors.inc()
+            _logger.exception('Failed to update replication lag')
+            return self.status
+        finally:
+            self._running = False
+        fresh_secondaries = frozenset(
+            member['address'] for member in status['members']
+            if member['address'] != status['primary'] and member['lag_seconds'] is not None
+            and member['lag_seconds'] <= self.max_staleness)
+        if fresh_secondaries != self._fresh_secondaries:
+            _logger.info('Secondaries within maximum staleness changed: %s', sorted(fresh_secondaries))
+        for member in status['members']:
+            if member['lag_seconds'] is not None:
+                REGISTRY.gauge('replication.%s.lag_seconds' % (member['address'],),
+                               'Replication lag of replica set member in seconds').set(member['lag_seconds'])
+        self._fresh_gauge.set(len(fresh_secondaries))
+        self.status = status
+        self._fresh_secondaries = fresh_secondaries
+        return status
+
+    def start(self):
+        """Start updating periodically.
+
+        The first update starts immediately.
+        """
+        self._periodic = PeriodicCallback(self.update, self.interval * 1000)
+        self._periodic.start()
+        IOLoop.current().add_callback(self.update)
+
+    def stop(self):
+        """Stop updating periodically."""
+        if self._periodic is not None:
+            self._periodic.stop()
+            self._periodic = None
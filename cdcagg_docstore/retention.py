@@ -0,0 +1,175 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Retention of logically deleted records.
+
+Logically deleted records are kept in the database so that
+harvesters see the deletions. After a retention period the records
+are removed physically by a purge job, which runs periodically
+within the DocStore process. The purge removes records in small
+batches and pauses between batches to keep the load on the database
+low.
+"""
+import logging
+import datetime
+from tornado import gen
+from tornado.ioloop import (
+    IOLoop,
+    PeriodicCallback
+)
+
+from .metrics import REGISTRY
+
+
+_logger = logging.getLogger(__name__)
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class RetentionPurge:
+    """Periodic purge of logically deleted records.
+
+    :param db: Database controller.
+    :type db: :obj:`cdcagg_docstore.controller.CDCAggDatabase`
+    :param list collection_names: Collections to purge.
+    :param int retention_days: Remove records that were deleted more
+                               than this many days ago.
+    :param int batch_size: Maximum number of records removed at once.
+    :param float pause: Seconds to pause between batches.
+    :param float interval: Seconds between purge runs.
+    """
+
+    def __init__(self, db, collection_names, retention_days, batch_size=500, pause=1.0, interval=3600):
+        self._db = db
+        self.collection_names = list(collection_names)
+        self.retention = datetime.timedelta(days=retention_days)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._running = False
+        self._periodic = None
+        self._purged = {name: REGISTRY.counter('retention.%s.purged' % (name,),
+                                               'Logically deleted records removed by retention purge')
+                        for name in self.collection_names}
+        self._runs = REGISTRY.counter('retention.runs', 'Retention purge runs')
+        self._errors = REGISTRY.counter('retention.errors', 'Failed retention purge runs')
+
+    async def purge_collection(self, collection_name, deleted_before):
+        """Purge records of a collection in batches.
+
+        :param str collection_name: Name of the collection.
+        :param deleted_before: Remove records deleted before this.
+        :type deleted_before: :obj:`datetime.datetime`
+        :returns: Number of removed records.
+        :rtype: int
+        """
+        total = 0
+        while True:
+            purged = await self._db.purge_deleted(collection_name, deleted_before, self.batch_size)
+            total += purged
+            self._purged[collection_name].inc(purged)
+            if purged < self.batch_size:
+                return total
+            await gen.sleep(self.pause)
+
+    async def run(self, now=None):
+        """Run purge over every collection.
+
+        Does nothing if a previous run is still in progress.
+
+        :param now: Current time. Defaults to current UTC time.
+        :type now: :obj:`datetime.datetime`
+        :returns: Collection names mapped to number of removed
+                  records.
+        :rtype: dict
+        """
+        if self._running:
+            return {}
+        self._running = True
+        self._runs.inc()
+        deleted_before = (now or _utcnow()) - self.retention
+        result = {}
+        try:
+            for collection_name in self.collection_names:
+                result[collection_name] = await self.purge_collection(collection_name, deleted_before)
+        except Exception:
+            self._errors.inc()
+            _logger.exception('Retention purge failed')
+        finally:
+            self._running = False
+        _logger.info('Retention purge removed records deleted before %s: %s', deleted_before, result)
+        return result
+
+    def start(self):
+        """Start purging periodically.
+
+        The first run starts immediately.
+        """
+        self._periodic = PeriodicCallback(self.run, self.interval * 1000)
+        self._periodic.start()
+        IOLoop.current().add_callback(self.run)
+
+    def stop(self):
+        """Stop purging periodically."""
+        if self._periodic is not None:
+            self._periodic.stop()
+            self._periodic = None
+
+
+def purge_from_settings(db, collection_names, settings):
+    """Instantiate retention purge from loaded settings.
+
+    :param db: Database controller.
+    :type db: :obj:`cdcagg_docstore.controller.CDCAggDatabase`
+    :param list collection_names: Collections to purge.
+    :param settings: Loaded settings.
+    :type settings: :obj:`argparse.Namespace`
+    :returns: Retention purge or None if retention is disabled.
+    :rtype: :obj:`RetentionPurge` or None
+    """
+    if settings.retention_days <= 0:
+        return None
+    return RetentionPurge(db, collection_names, settings.retention_days,
+                          batch_size=settings.retention_purge_batch_size,
+                          pause=settings.retention_purge_pause,
+                          interval=settings.retention_purge_interval)
+
+
+def add_cli_args(parser):
+    """Adds retention CLI arguments to argument parser.
+
+    :param parser: Argument parser
+    :type parser: :obj:`configargparse.ArgumentParser`
+    """
+    parser.add('--retention-days',
+               help='Physically remove logically deleted records after this many days since '
+               'deletion. 0 keeps deleted records forever',
+               default=0,
+               env_var='DOCSTORE_RETENTION_DAYS',
+               type=int)
+    parser.add('--retention-purge-interval',
+               help='Seconds between runs of the retention purge',
+               default=3600,
+               env_var='DOCSTORE_RETENTION_PURGE_INTERVAL',
+               type=float)
+    parser.add('--retention-purge-batch-size',
+               help='Maximum number of records removed in a single batch by the retention purge',
+               default=500,
+               env_var='DOCSTORE_RETENTION_PURGE_BATCH_SIZE',
+               type=int)
+    parser.add('--retention-purge-pause',
+               help='Seconds to pause between batches of the retention purge',
+               default=1.0,
+               env_var='DOCSTORE_RETENTION_PURGE_PAUSE',
+               type=float)
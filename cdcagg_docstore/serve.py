@@ -16,6 +16,7 @@ Handle command line arguments, application setup, server startup and
 critical exception logging.
 """
 import logging
+from tornado.ioloop import IOLoop
 from py12flogging.log_formatter import (
     setup_app_logging,
     set_ctx_populator
@@ -24,9 +25,14 @@ from kuha_common import (
     conf,
     server
 )
-from cdcagg_common import list_collection_names
 from .http_api import get_app
-from . import controller
+from . import (
+    bulk_delete,
+    health,
+    http_api,
+    loop_monitor,
+    retention
+)
 
 
 _logger = logging.getLogger(__name__)
@@ -41,6 +47,9 @@ def configure():
     :returns: Loaded settings.
     :rtype: :obj:`argparse.Namespace`
     """
+    # Controller loads the MongoDB driver. It is imported here to
+    # keep importing this module fast.
+    from . import controller
     conf.load(prog='cdcagg_docstore', package='cdcagg_docstore', env_var_prefix='CDCAGG_')
     conf.add_print_arg()
     conf.add_config_arg()
@@ -52,7 +61,12 @@ def configure():
              help='HTTP API version gets prepended to URLs',
              default='v0', type=str, env_var='DOCSTORE_API_VERSION')
     server.add_cli_args()
+    http_api.add_cli_args(conf)
     controller.add_cli_args(conf)
+    retention.add_cli_args(conf)
+    bulk_delete.add_cli_args(conf)
+    loop_monitor.add_cli_args(conf)
+    health.add_cli_args(conf)
     settings = conf.get_conf()
     set_ctx_populator(server.serverlog_ctx_populator)
     setup_app_logging(conf.get_package(), loglevel=settings.loglevel, port=settings.port)
@@ -76,10 +90,29 @@ def main():
         conf.print_conf()
         return 0
     try:
+        from cdcagg_common import list_collection_names
+        from . import controller
         db = controller.db_from_settings(settings)
+        bulk_delete_jobs = bulk_delete.bulk_delete_from_settings(db, settings)
+        health_monitor = health.monitor_from_settings(db, settings)
         app = get_app(settings.api_version,
                       list_collection_names(),
-                      db=db)
+                      db=db,
+                      bulk_delete=bulk_delete_jobs,
+                      health_monitor=health_monitor,
+                      **http_api.app_settings(settings))
+        bulk_delete_jobs.start()
+        health_monitor.start()
+        if db.pool_warm_up_connections > 0:
+            IOLoop.current().add_callback(db.warm_up_pools)
+        if db.replication_monitor is not None:
+            db.replication_monitor.start()
+        purge = retention.purge_from_settings(db, list_collection_names(), settings)
+        if purge is not None:
+            purge.start()
+        monitor = loop_monitor.monitor_from_settings(settings)
+        if monitor is not None:
+            monitor.start()
     except Exception:
         _logger.exception('Exception in application setup')
         raise
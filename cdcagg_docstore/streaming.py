@@ -0,0 +1,140 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers for streaming query results to clients."""
+import time
+
+
+#: Default high-water mark of buffered output in bytes.
+DEFAULT_HIGH_WATER_MARK = 64 * 1024
+
+
+class AdaptiveBatchSize:
+    """Cursor batch size that adapts to the pace of the client.
+
+    Flush durations are summed over each cursor batch. When the batch
+    has been consumed, the batch size doubles if its flushes took less
+    than `fast_flush` seconds in total and halves if they took more
+    than `slow_flush` seconds. The batch size stays between `initial`
+    and `maximum`.
+
+    :param int initial: Initial and minimum batch size.
+    :param int maximum: Maximum batch size.
+    :param float fast_flush: Batches flushed faster than this grow.
+    :param float slow_flush: Batches flushed slower than this shrink.
+    """
+
+    def __init__(self, initial, maximum, fast_flush=0.005, slow_flush=0.05):
+        self.initial = initial
+        self.maximum = max(initial, maximum)
+        self.fast_flush = fast_flush
+        self.slow_flush = slow_flush
+        self.size = initial
+        self._flush_seconds = 0.0
+
+    def record_flush(self, seconds):
+        """Record duration of a flush to the client.
+
+        The duration counts towards the current batch.
+
+        :param float seconds: Duration of the flush.
+        """
+        self._flush_seconds += seconds
+
+    def end_batch(self):
+        """Adapt batch size after a batch has been consumed.
+
+        :returns: Batch size of the next batch.
+        :rtype: int
+        """
+        if self._flush_seconds < self.fast_flush:
+            self.size = min(self.size * 2, self.maximum)
+        elif self._flush_seconds > self.slow_flush:
+            self.size = max(self.size // 2, self.initial)
+        self._flush_seconds = 0.0
+        return self.size
+
+
+async def adaptive_batches(cursor, batch_sizer):
+    """Iterate cursor adapting its batch size once per batch.
+
+    The cursor must have been opened with the current size of
+    `batch_sizer`. The batch size of the following batch is set
+    after the consumer has handled the last document of a batch,
+    before the cursor fetches the next batch.
+
+    :param cursor: Aggregation cursor to iterate.
+    :type cursor: :obj:`motor.motor_tornado.MotorCommandCursor`
+    :param batch_sizer: Adaptive batch size.
+    :type batch_sizer: :obj:`AdaptiveBatchSize`
+    :returns: Asynchronous generator yielding documents.
+    """
+    batch_size = batch_sizer.size
+    documents = 0
+    async for document in cursor:
+        yield document
+        documents += 1
+        if documents == batch_size:
+            documents = 0
+            size = batch_sizer.end_batch()
+            if size != batch_size:
+                batch_size = size
+                cursor.delegate.batch_size(batch_size)
+
+
+class BackPressureWriter:
+    """Writes a stream of chunks to a request handler with back-pressure.
+
+    Chunks are buffered in the handler until the buffered output
+    reaches `high_water_mark` bytes. The buffer is then flushed and
+    :meth:`write` waits until the output has drained to the client.
+    A producer awaiting :meth:`write`, such as a loop over a database
+    cursor, thus pauses while the client is slow to read, and the
+    memory held for a response stays bounded regardless of the size
+    of the result.
+
+    :param handler: Request handler to write to.
+    :type handler: :obj:`tornado.web.RequestHandler`
+    :param int high_water_mark: Bytes to buffer before draining.
+                                0 drains after every chunk.
+    :param batch_sizer: Optional adaptive batch size to record drain
+                        durations into. The batch size adapts once
+                        per cursor batch, see :func:`adaptive_batches`.
+    :type batch_sizer: :obj:`AdaptiveBatchSize`
+    """
+
+    def __init__(self, handler, high_water_mark=DEFAULT_HIGH_WATER_MARK, batch_sizer=None):
+        self._handler = handler
+        self.high_water_mark = high_water_mark
+        self._batch_sizer = batch_sizer
+        self.buffered = 0
+
+    async def write(self, chunk):
+        """Write chunk and drain if the high-water mark is reached.
+
+        :param chunk: Chunk to write.
+        :type chunk: str or bytes
+        """
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        self._handler.write(chunk)
+        self.buffered += len(chunk)
+        if self.buffered >= self.high_water_mark:
+            await self.drain()
+
+    async def drain(self):
+        """Flush buffered output and wait until it is written."""
+        self.buffered = 0
+        start = time.monotonic()
+        await self._handler.flush()
+        if self._batch_sizer is not None:
+            self._batch_sizer.record_flush(time.monotonic() - start)
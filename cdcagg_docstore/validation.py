@@ -0,0 +1,243 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Validation of documents off the event loop.
+
+Validation of large documents is CPU-bound and blocks the event
+loop, which stalls concurrent streamed responses. Documents larger
+than a threshold may be validated in a thread or process pool.
+
+A process pool validates in parallel with the event loop. Each
+worker process builds the validation schemas it needs on first use.
+A thread pool avoids copying documents between processes but shares
+the interpreter lock with the event loop. Validation schemas hold the
+state of the validation in progress, so each worker thread builds its
+own schemas too.
+
+Kuha Document Store validates the documents of REST API writes on
+the event loop. The handlers validate large documents in the pool in
+advance and mark them with :func:`prevalidated`, so that the schemas
+of :class:`PrevalidatedSchema` skip validating them again.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor
+)
+from bson import json_util
+
+from .metrics import REGISTRY
+
+
+POOL_NONE = 'none'
+POOL_THREAD = 'thread'
+POOL_PROCESS = 'process'
+POOL_TYPES = (POOL_NONE, POOL_THREAD, POOL_PROCESS)
+
+
+class DocumentValidationError(Exception):
+    """Document failed validation.
+
+    Carries the arguments of
+    :exc:`kuha_document_store.validation.RecordValidationError`:
+    message and validation errors. Unlike the original, this can
+    be passed between processes.
+    """
+
+
+_prevalidated = contextvars.ContextVar('prevalidated', default=None)
+
+
+@contextlib.contextmanager
+def prevalidated(document, **kwargs):
+    """Mark a document as validated within the context.
+
+    :param dict document: Document validated in advance.
+    :param kwargs: Keyword arguments the document was validated with.
+    """
+    token = _prevalidated.set((document, kwargs))
+    try:
+        yield
+    finally:
+        _prevalidated.reset(token)
+
+
+class PrevalidatedSchema:
+    """Validation schema skipping documents validated in advance.
+
+    Wraps a validation schema. Validation of a document equal to the
+    one marked with :func:`prevalidated`, with the same arguments, is
+    skipped. Other documents are validated by the wrapped schema.
+
+    :param schema: Validation schema to wrap.
+    :type schema: :obj:`kuha_document_store.validation.RecordValidationSchema`
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+
+    def __getattr__(self, name):
+        return getattr(self.schema, name)
+
+    def validate(self, document, **kwargs):
+        """Validate document unless it has been validated in advance.
+
+        :param dict document: Document to validate.
+        :param kwargs: Keyword arguments of the wrapped schema.
+        """
+        if _prevalidated.get() == (document, kwargs):
+            return None
+        return self.schema.validate(document, **kwargs)
+
+
+def _validate(schema, document, **kwargs):
+    from kuha_document_store.validation import RecordValidationError
+    try:
+        schema.validate(document, **kwargs)
+    except RecordValidationError as exc:
+        raise DocumentValidationError(*exc.args) from exc
+
+
+def _build_schema(collection_name):
+    from cdcagg_common import record_by_collection_name
+    from .controller import CDCAggDatabase
+    return asyncio.run(CDCAggDatabase._prepare_validation_schema(record_by_collection_name(collection_name)))
+
+
+@functools.lru_cache(maxsize=None)
+def _worker_schema(collection_name):
+    return _build_schema(collection_name)
+
+
+def _worker_validate(collection_name, document, kwargs=None):
+    _validate(_worker_schema(collection_name), document, **(kwargs or {}))
+
+
+_thread_local = threading.local()
+
+
+def _thread_schema(collection_name):
+    schemas = _thread_local.__dict__.setdefault('schemas', {})
+    if collection_name not in schemas:
+        schemas[collection_name] = _build_schema(collection_name)
+    return schemas[collection_name]
+
+
+def _thread_validate(collection_name, document, kwargs=None):
+    _validate(_thread_schema(collection_name), document, **(kwargs or {}))
+
+
+class DocumentValidator:
+    """Validates documents inline or in a worker pool.
+
+    :param str pool_type: :const:`POOL_NONE` to validate on the event
+                          loop, :const:`POOL_THREAD` or
+                          :const:`POOL_PROCESS` to validate large
+                          documents in a pool.
+    :param int pool_size: Number of workers in the pool.
+    :param int size_threshold: Documents of at least this many bytes
+                               are validated in the pool.
+    """
+
+    def __init__(self, pool_type=POOL_NONE, pool_size=2, size_threshold=0):
+        if pool_type not in POOL_TYPES:
+            raise ValueError("Invalid validation pool type '%s'" % (pool_type,))
+        self.pool_type = pool_type
+        self.pool_size = pool_size
+        self.size_threshold = size_threshold
+        self._executor = None
+        self._seconds = REGISTRY.histogram('validation.seconds', 'Time to validate a document in seconds')
+        self._offloaded = REGISTRY.counter('validation.offloaded', 'Documents validated in the worker pool')
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.pool_type == POOL_THREAD:
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                    thread_name_prefix='validation')
+            else:
+                # Workers are spawned to not inherit the state of the event loop.
+                self._executor = ProcessPoolExecutor(max_workers=self.pool_size,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _offload(self, document, document_size):
+        if self.pool_type == POOL_NONE:
+            return False
+        if document_size is None:
+            document_size = len(json_util.dumps(document))
+        return document_size >= self.size_threshold
+
+    async def _pool_validate(self, collection_name, document, kwargs):
+        self._offloaded.inc()
+        worker_validate = _thread_validate if self.pool_type == POOL_THREAD else _worker_validate
+        await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), worker_validate, collection_name, document, kwargs)
+
+    async def validate(self, schema, collection_name, document, document_size=None):
+        """Validate document.
+
+        :param schema: Validation schema of the collection. Used
+                       when validating on the event loop. Workers
+                       use schemas of their own.
+        :type schema: :obj:`kuha_document_store.validation.RecordValidationSchema`
+        :param str collection_name: Name of the collection.
+        :param dict document: Document to validate.
+        :param int document_size: Size of the document in bytes if
+                                  known.
+        :raises: :exc:`DocumentValidationError` if the document is
+                 invalid.
+        """
+        start = time.perf_counter()
+        try:
+            if not self._offload(document, document_size):
+                _validate(schema, document)
+                return
+            await self._pool_validate(collection_name, document, {})
+        finally:
+            self._seconds.observe(time.perf_counter() - start)
+
+    async def prevalidate(self, collection_name, document, document_size=None, **kwargs):
+        """Validate document in the pool in advance.
+
+        Documents below the size threshold are left to be validated
+        when written.
+
+        :param str collection_name: Name of the collection.
+        :param dict document: Document to validate.
+        :param int document_size: Size of the document in bytes if
+                                  known.
+        :param kwargs: Keyword arguments of the validation schema.
+        :returns: True if the document was validated.
+        :rtype: bool
+        :raises: :exc:`DocumentValidationError` if the document is
+                 invalid.
+        """
+        if not self._offload(document, document_size):
+            return False
+        start = time.perf_counter()
+        try:
+            await self._pool_validate(collection_name, document, kwargs)
+        finally:
+            self._seconds.observe(time.perf_counter() - start)
+        return True
+
+    def close(self):
+        """Shut down the worker pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,138 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from argparse import Namespace
+from unittest import (
+    TestCase,
+    mock
+)
+from bson import ObjectId
+from pymongo.write_concern import WriteConcern
+from tornado import testing
+
+from cdcagg_docstore import bulk_delete
+from cdcagg_docstore.metrics import REGISTRY
+
+
+class TestBulkDelete(testing.AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.jobs = mock.Mock(update_one=mock.AsyncMock(return_value=mock.Mock(matched_count=1)),
+                              insert_one=mock.AsyncMock(), find_one_and_update=mock.AsyncMock())
+        self.db = mock.Mock(delete_batch=mock.AsyncMock())
+        self.db.editor_collection.return_value = self.jobs
+        self.job = {'_id': ObjectId('619f95dff13cfc3ed67ff0f6'), 'collection': 'studies',
+                    'filter': '{"_direct_base_url": "some.url", "_metadata.updated": '
+                              '{"$lt": {"$isodate": "2021-11-09T08:05:18Z"}}}',
+                    'delete_type': 'soft', 'state': 'running', 'deleted': 0, 'error': None}
+
+    @testing.gen_test
+    async def test_deletes_in_batches_until_exhausted(self):
+        self.db.delete_batch.side_effect = [2, 2, 1]
+        write_concern = WriteConcern(w='majority')
+        deleted_before = REGISTRY.counter('bulk_delete.deleted', '').value
+        total = await bulk_delete.BulkDelete(self.db, batch_size=2, write_concern=write_concern).run(self.job)
+        self.assertEqual(total, 5)
+        self.assertEqual(self.db.delete_batch.await_args_list, [mock.call(
+            'studies', {'_direct_base_url': 'some.url',
+                        '_metadata.updated': {'$lt': datetime.datetime(2021, 11, 9, 8, 5, 18)}},
+            'soft', 2, write_concern=write_concern)] * 3)
+        self.assertEqual(REGISTRY.counter('bulk_delete.deleted', '').value - deleted_before, 5)
+        progress = [call.args[1]['$inc']['deleted'] for call in self.jobs.update_one.await_args_list[:-1]]
+        self.assertEqual(progress, [2, 2, 1])
+        self.assertEqual(self.jobs.update_one.await_args.args[1]['$set']['state'], 'completed')
+
+    @testing.gen_test
+    async def test_renews_and_releases_lease(self):
+        self.db.delete_batch.side_effect = [2, 1]
+        deletes = bulk_delete.BulkDelete(self.db, batch_size=2, lease_seconds=30)
+        await deletes.run(self.job)
+        for call in self.jobs.update_one.await_args_list:
+            self.assertEqual(call.args[0], {'_id': self.job['_id'], 'owner': deletes.owner})
+        progress = self.jobs.update_one.await_args_list[0].args[1]['$set']
+        self.assertEqual(progress['lease_expires'] - progress['updated'], datetime.timedelta(seconds=30))
+        self.assertEqual(self.jobs.update_one.await_args.args[1]['$unset'], {'owner': True, 'lease_expires': True})
+
+    @testing.gen_test
+    async def test_stops_when_lease_is_lost(self):
+        self.db.delete_batch.side_effect = [2, 2]
+        self.jobs.update_one.return_value = mock.Mock(matched_count=0)
+        with self.assertLogs(bulk_delete._logger, level='WARNING'):
+            total = await bulk_delete.BulkDelete(self.db, batch_size=2).run(self.job)
+        self.assertEqual(total, 2)
+        self.jobs.update_one.assert_awaited_once()
+
+    @testing.gen_test
+    async def test_resume_claims_jobs_with_expired_lease(self):
+        self.jobs.find_one_and_update.side_effect = [self.job, None]
+        deletes = bulk_delete.BulkDelete(self.db, lease_seconds=30)
+        with mock.patch.object(deletes, '_start') as mock_start:
+            await deletes.resume()
+        mock_start.assert_called_once_with(self.job)
+        query_filter, update = self.jobs.find_one_and_update.await_args.args
+        now = update['$set']['lease_expires'] - datetime.timedelta(seconds=30)
+        self.assertEqual(query_filter, {'state': 'running',
+                                        '$or': [{'lease_expires': None}, {'lease_expires': {'$lt': now}}]})
+        self.assertEqual(update['$set']['owner'], deletes.owner)
+        self.assertTrue(self.jobs.find_one_and_update.await_args.kwargs['return_document'])
+
+    @testing.gen_test
+    async def test_throttles_batches_to_max_rate(self):
+        self.db.delete_batch.side_effect = [10, 0]
+        with mock.patch.object(bulk_delete.gen, 'sleep', new=mock.AsyncMock()) as mock_sleep:
+            await bulk_delete.BulkDelete(self.db, batch_size=10, max_rate=5).run(self.job)
+        mock_sleep.assert_awaited_once()
+        self.assertAlmostEqual(mock_sleep.await_args.args[0], 2, places=1)
+
+    @testing.gen_test
+    async def test_marks_job_failed(self):
+        self.db.delete_batch.side_effect = ValueError('boom')
+        errors_before = REGISTRY.counter('bulk_delete.errors', '').value
+        with self.assertLogs(bulk_delete._logger, level='ERROR'):
+            await bulk_delete.BulkDelete(self.db).run(self.job)
+        self.assertEqual(self.jobs.update_one.await_args.args[1]['$set']['state'], 'failed')
+        self.assertEqual(self.jobs.update_one.await_args.args[1]['$set']['error'], 'boom')
+        self.assertEqual(REGISTRY.counter('bulk_delete.errors', '').value - errors_before, 1)
+
+    @testing.gen_test
+    async def test_submit_stores_and_starts_job(self):
+        self.jobs.insert_one.return_value = mock.Mock(inserted_id=self.job['_id'])
+        self.db.delete_batch.return_value = 0
+        deletes = bulk_delete.BulkDelete(self.db)
+        job = await deletes.submit('studies', {'_direct_base_url': 'some.url'}, 'hard')
+        self.assertEqual(job['_id'], self.job['_id'])
+        self.assertEqual(job['filter'], '{"_direct_base_url": "some.url"}')
+        self.assertEqual(job['state'], 'running')
+        self.assertEqual(job['owner'], deletes.owner)
+        await deletes._tasks[job['_id']]
+        self.db.delete_batch.assert_awaited_once_with('studies', {'_direct_base_url': 'some.url'}, 'hard', 500,
+                                                      write_concern=None)
+
+
+class TestParseWriteConcern(TestCase):
+
+    def test_parses_values(self):
+        self.assertIsNone(bulk_delete.parse_write_concern(''))
+        self.assertEqual(bulk_delete.parse_write_concern('majority'), WriteConcern(w='majority'))
+        self.assertEqual(bulk_delete.parse_write_concern('2'), WriteConcern(w=2))
+
+    def test_from_settings(self):
+        deletes = bulk_delete.bulk_delete_from_settings(mock.Mock(), Namespace(
+            bulk_delete_batch_size=100, bulk_delete_max_rate=50, bulk_delete_write_concern='1',
+            bulk_delete_lease=30))
+        self.assertEqual(deletes.batch_size, 100)
+        self.assertEqual(deletes.max_rate, 50)
+        self.assertEqual(deletes.write_concern, WriteConcern(w=1))
+        self.assertEqual(deletes.lease_seconds, 30)
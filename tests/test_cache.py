@@ -0,0 +1,41 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import (
+    TestCase,
+    mock
+)
+
+from cdcagg_docstore import cache
+
+
+class TestTTLCache(TestCase):
+
+    @mock.patch.object(cache.time, 'monotonic')
+    def test_entries_expire(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        ttl_cache = cache.TTLCache(10)
+        ttl_cache.set('key', 'value')
+        mock_monotonic.return_value = 109
+        self.assertEqual(ttl_cache.get('key'), 'value')
+        mock_monotonic.return_value = 110
+        self.assertIsNone(ttl_cache.get('key'))
+        self.assertEqual(len(ttl_cache), 0)
+
+    def test_evicts_oldest_when_full(self):
+        ttl_cache = cache.TTLCache(10, max_entries=2)
+        for key in ('first', 'second', 'third'):
+            ttl_cache.set(key, key)
+        self.assertIsNone(ttl_cache.get('first'))
+        self.assertEqual(ttl_cache.get('second'), 'second')
+        self.assertEqual(ttl_cache.get('third'), 'third')
@@ -0,0 +1,104 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from unittest import TestCase
+from bson import ObjectId
+
+from cdcagg_docstore import conversion
+from cdcagg_docstore.mdb import studies_collection
+
+
+class TestPathConverter(TestCase):
+
+    def test_converts_nested_and_top_level_paths(self):
+        converter = conversion.PathConverter([('a.b.c', str.upper), ('a.d', str.upper), ('e', str.upper)])
+        document = {'a': {'b': {'c': 'x'}, 'd': 'y'}, 'e': 'z', 'f': 'w'}
+        self.assertIs(converter.convert(document), document)
+        self.assertEqual(document, {'a': {'b': {'c': 'X'}, 'd': 'Y'}, 'e': 'Z', 'f': 'w'})
+
+    def test_skips_missing_none_and_non_dict_parents(self):
+        converter = conversion.PathConverter([('a.b', str.upper), ('c', str.upper)])
+        documents = [{}, {'a': None, 'c': None}, {'a': 'not a dict'}, {'a': {'b': 'x'}}]
+        self.assertEqual([converter.convert(document) for document in documents],
+                         [{}, {'a': None, 'c': None}, {'a': 'not a dict'}, {'a': {'b': 'X'}}])
+
+    def test_overlapping_paths_raise_value_error(self):
+        for path_funcs in ([('a', str), ('a.b', str)], [('a.b', str), ('a', str)]):
+            with self.subTest(path_funcs=path_funcs):
+                with self.assertRaises(ValueError):
+                    conversion.PathConverter(path_funcs)
+
+
+class TestCollectionConverters(TestCase):
+
+    def setUp(self):
+        self.coll = studies_collection()
+
+    def test_encoders_are_cached(self):
+        self.assertIs(conversion.document_encoder(self.coll), conversion.document_encoder(studies_collection()))
+
+    def test_encode_document_converts_isodate_fields(self):
+        updated = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        oid = ObjectId()
+        encoded = conversion.encode_document(self.coll, {'_id': oid, '_metadata': {'updated': updated,
+                                                                                   'deleted': None}})
+        self.assertEqual(encoded, '{"_id": {"$oid": "%s"}, "_metadata": {"updated": "2024-01-02T03:04:05Z", '
+                                  '"deleted": null}}' % (oid,))
+
+
+class TestDecodeFilter(TestCase):
+
+    def setUp(self):
+        self.coll = studies_collection()
+
+    def _decode(self, query_filter):
+        return conversion.decode_filter(query_filter, frozenset(self.coll.isodate_fields),
+                                        frozenset(self.coll.object_id_fields))
+
+    def test_converts_equality_matches(self):
+        oid = ObjectId()
+        self.assertEqual(self._decode({'_id': str(oid), '_metadata.updated': '2024-01-02T03:04:05Z',
+                                       'study_number': '2024-01-02T03:04:05Z'}),
+                         {'_id': oid, '_metadata.updated': datetime.datetime(2024, 1, 2, 3, 4, 5),
+                          'study_number': '2024-01-02T03:04:05Z'})
+
+    def test_converts_operators(self):
+        oid = ObjectId()
+        query_filter = {'$or': [{'_id': {'$in': [str(oid), 'invalid']}},
+                                {'_metadata.deleted': {'$not': {'$lt': '2024-01-02T03:04:05Z'}, '$ne': None}}],
+                        '$text': {'$search': '2024-01-02T03:04:05Z'}}
+        self.assertEqual(self._decode(query_filter),
+                         {'$or': [{'_id': {'$in': [oid, 'invalid']}},
+                                  {'_metadata.deleted': {'$not': {'$lt': datetime.datetime(2024, 1, 2, 3, 4, 5)},
+                                                         '$ne': None}}],
+                          '$text': {'$search': '2024-01-02T03:04:05Z'}})
+        self.assertEqual(query_filter['$or'][0], {'_id': {'$in': [str(oid), 'invalid']}})
+
+    def test_leaves_invalid_values_and_converted_values(self):
+        oid = ObjectId()
+        query_filter = {'_id': oid, '_metadata.updated': {'$exists': True, '$gt': 'invalid'},
+                        '_metadata.created': {'nested': '2024-01-02T03:04:05Z'}}
+        self.assertEqual(self._decode(query_filter), query_filter)
+
+
+class TestContentHash(TestCase):
+
+    def test_equal_content_in_any_key_order_has_equal_hash(self):
+        self.assertEqual(conversion.content_hash({'a': 1, 'b': {'c': ['x', 'y'], 'd': None}}),
+                         conversion.content_hash({'b': {'d': None, 'c': ['x', 'y']}, 'a': 1}))
+
+    def test_changed_content_has_different_hash(self):
+        for other in ({'a': 2}, {'a': 1, 'b': None}, {'a': [1]}, {'A': 1}):
+            with self.subTest(other=other):
+                self.assertNotEqual(conversion.content_hash({'a': 1}), conversion.content_hash(other))
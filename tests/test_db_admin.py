@@ -49,13 +49,13 @@ class TestConfigure(KuhaUnitTestCase):
         db_admin.configure()
         mock_conf.add_config_arg.assert_called_once_with()
 
-    @mock.patch.object(db_admin, 'add_cli_args')
+    @mock.patch('cdcagg_docstore.controller.add_cli_args')
     def test_calls_add_cli_args_on_server_controller(self, mock_add_cli_args, mock_conf):
         mock_add_cli_args.assert_not_called()
         db_admin.configure()
         mock_add_cli_args.assert_called_once_with(mock_conf)
 
-    @mock.patch.object(db_admin, 'add_cli_args')
+    @mock.patch('cdcagg_docstore.controller.add_cli_args')
     def test_calls_add_on_conf(self, mock_add_cli_args, mock_conf):
         mock_conf.add.assert_not_called()
         db_admin.configure()
@@ -134,7 +134,7 @@ class DBOperationsTestBase(KuhaUnitTestCase):
         self.maxDiff = None
         self.mock_input = self.init_patcher(mock.patch.object(db_admin, 'input'))
         self.mock_getpass = self.init_patcher(mock.patch.object(db_admin, 'getpass'))
-        self.mock_MotorClient = self.init_patcher(mock.patch.object(db_admin, 'MotorClient'))
+        self.mock_MotorClient = self.init_patcher(mock.patch('motor.motor_tornado.MotorClient'))
         self.mock_client = mock.MagicMock()
         self.mock_app_db = mock.MagicMock()
         self.mock_admin_db = mock.Mock()
@@ -351,9 +351,25 @@ class TestSetupCollections(DBOperationsTestBase):
         for coll in (self.studies_coll,):
             calls.extend([mock.call(index, unique=True) for index in coll.indexes_unique])
             calls.extend([mock.call(index) for index in coll.indexes])
+            calls.extend([mock.call(index.keys, name=index.name,
+                                    partialFilterExpression=index.partial_filter_expression)
+                          for index in coll.partial_indexes])
+            calls.append(mock.call(coll.text_index.keys, name=coll.text_index.name,
+                                   weights=coll.text_index.weights,
+                                   default_language=coll.text_index.default_language,
+                                   language_override=coll.text_index.language_override))
         self.assertEqual(self.mock_create_index.call_count, len(calls))
         self.mock_create_index.assert_has_calls(calls, any_order=True)
 
+    def test_creates_partial_indexes_by_record_status(self):
+        db_admin.main()
+        self.assertEqual(
+            [(call.kwargs['name'], call.kwargs['partialFilterExpression'])
+             for call in self.mock_create_index.call_args_list if 'partialFilterExpression' in call.kwargs],
+            [('created__metadata.status_1__metadata.updated_-1', {'_metadata.status': 'created'}),
+             ('deleted__metadata.status_1__metadata.deleted_1', {'_metadata.status': 'deleted'}),
+             ('created__metadata.status_1__direct_base_url_1', {'_metadata.status': 'created'})])
+
     @mock.patch('sys.stdout', new_callable=StringIO)
     def test_prints_output(self, mock_stdout):
         async def _side_eff(collname, *args, **kwargs):
@@ -365,7 +381,13 @@ class TestSetupCollections(DBOperationsTestBase):
                     "setup_collections result:\n"
                     "{'studies': [[('study_number', 1)],\n"
                     "             [('_aggregator_identifier', 1)],\n"
-                    "             [('_metadata.updated', -1)]]}\n")
+                    "             [('_metadata.updated', -1)],\n"
+                    "             [('_metadata.status', 1), ('_metadata.updated', -1)],\n"
+                    "             [('_metadata.status', 1), ('_metadata.deleted', 1)],\n"
+                    "             [('_metadata.status', 1), ('_direct_base_url', 1)],\n"
+                    "             [('study_titles.study_title', 'text'),\n"
+                    "              ('keywords.keyword', 'text'),\n"
+                    "              ('abstract.abstract', 'text')]]}\n")
         self.mock_create_index.side_effect = MockCoro(func=_side_eff)
         db_admin.main()
         self.assertEqual(mock_stdout.getvalue(), expected)
@@ -495,7 +517,8 @@ class TestSetupUsers(DBOperationsTestBase):
         db_admin.main()
         self.assertEqual(self.mock_app_db.command.call_count, 2)
         self.mock_app_db.command.assert_has_calls([
-            mock.call('createUser', 'reader', pwd='reader_pass', roles=['read']),
+            mock.call('createUser', 'reader', pwd='reader_pass',
+                      roles=['read', {'role': 'clusterMonitor', 'db': 'admin'}]),
             mock.call('createUser', 'editor', pwd='editor_pass', roles=['readWrite'])
         ])
 
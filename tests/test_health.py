@@ -0,0 +1,168 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from argparse import Namespace
+from unittest import mock
+from pymongo import ReadPreference
+from tornado import testing
+
+from kuha_document_store import database
+
+from cdcagg_docstore import (
+    controller,
+    health
+)
+from cdcagg_docstore.metrics import REGISTRY
+
+
+def _status(primary='db1:27017', lags=(0.0, 1.5)):
+    return {'primary': primary,
+            'members': [{'address': 'db%s:27017' % (index,), 'type': 'RSSecondary', 'lag_seconds': lag}
+                        for index, lag in enumerate(lags)]}
+
+
+class TestHealthMonitor(testing.AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db = mock.Mock(replication_status=mock.AsyncMock(return_value=_status()))
+
+    def test_not_ready_before_first_check(self):
+        monitor = health.HealthMonitor(self.db)
+        self.assertFalse(monitor.ready)
+        self.assertIsNone(monitor.readiness['checked'])
+
+    @testing.gen_test
+    async def test_ready(self):
+        monitor = health.HealthMonitor(self.db, max_replication_lag=2)
+        readiness = await monitor.check()
+        self.assertTrue(monitor.ready)
+        self.assertEqual(readiness['checks'], {
+            'database': {'status': 'pass'},
+            'primary': {'status': 'pass', 'address': 'db1:27017'},
+            'replication_lag': {'status': 'pass', 'seconds': 1.5}})
+        self.assertEqual(REGISTRY.gauge('health.ready', '').value, 1)
+
+    @testing.gen_test
+    async def test_not_ready_without_primary(self):
+        self.db.replication_status.return_value = _status(primary=None, lags=(None, None))
+        monitor = health.HealthMonitor(self.db)
+        readiness = await monitor.check()
+        self.assertFalse(readiness['ready'])
+        self.assertEqual(readiness['checks']['primary'], {'status': 'fail', 'address': None})
+        self.assertEqual(REGISTRY.gauge('health.ready', '').value, 0)
+
+    @testing.gen_test
+    async def test_not_ready_when_replication_lags(self):
+        self.db.replication_status.return_value = _status(lags=(0.0, 31.0))
+        monitor = health.HealthMonitor(self.db, max_replication_lag=30)
+        readiness = await monitor.check()
+        self.assertFalse(readiness['ready'])
+        self.assertEqual(readiness['checks']['replication_lag'], {'status': 'fail', 'seconds': 31.0})
+
+    @testing.gen_test
+    async def test_zero_disables_check_of_replication_lag(self):
+        self.db.replication_status.return_value = _status(lags=(0.0, 3600.0))
+        monitor = health.HealthMonitor(self.db, max_replication_lag=0)
+        readiness = await monitor.check()
+        self.assertTrue(readiness['ready'])
+        self.assertNotIn('replication_lag', readiness['checks'])
+
+    @testing.gen_test
+    async def test_not_ready_until_pools_are_warm(self):
+        self.db.pools_warm.return_value = False
+        monitor = health.HealthMonitor(self.db, check_pools=True)
+        readiness = await monitor.check()
+        self.assertFalse(readiness['ready'])
+        self.assertEqual(readiness['checks']['connection_pools'], {'status': 'fail'})
+        self.db.pools_warm.return_value = True
+        self.assertTrue((await monitor.check())['ready'])
+
+    @testing.gen_test
+    async def test_not_ready_when_database_is_unreachable(self):
+        self.db.replication_status.side_effect = ConnectionError('unreachable')
+        monitor = health.HealthMonitor(self.db)
+        errors_before = REGISTRY.counter('health.errors', '').value
+        with self.assertLogs(health._logger, level='WARNING'):
+            readiness = await monitor.check()
+        self.assertFalse(readiness['ready'])
+        self.assertEqual(readiness['checks'], {'database': {'status': 'fail', 'error': 'unreachable'}})
+        self.assertEqual(REGISTRY.counter('health.errors', '').value - errors_before, 1)
+
+    @testing.gen_test
+    async def test_times_out_waiting_for_database(self):
+        async def _hang():
+            await asyncio.sleep(10)
+        self.db.replication_status.side_effect = _hang
+        monitor = health.HealthMonitor(self.db, timeout=0.01)
+        with self.assertLogs(health._logger, level='WARNING'):
+            readiness = await monitor.check()
+        self.assertEqual(readiness['checks']['database']['status'], 'fail')
+
+
+class TestMonitorFromSettings(testing.AsyncTestCase):
+
+    def test_returns_monitor(self):
+        monitor = health.monitor_from_settings(mock.Mock(), Namespace(
+            ready_check_interval=2, ready_max_replication_lag=10, ready_check_timeout=1,
+            pool_warm_up_connections=0))
+        self.assertEqual(monitor.interval, 2)
+        self.assertEqual(monitor.max_replication_lag, 10)
+        self.assertEqual(monitor.timeout, 1)
+        self.assertFalse(monitor.check_pools)
+
+    def test_checks_pools_if_warm_up_is_enabled(self):
+        monitor = health.monitor_from_settings(mock.Mock(), Namespace(
+            ready_check_interval=2, ready_max_replication_lag=10, ready_check_timeout=1,
+            pool_warm_up_connections=2))
+        self.assertTrue(monitor.check_pools)
+
+
+class TestReplicationStatus(testing.AsyncTestCase):
+
+    def _server(self, host, writable, last_write_date):
+        return mock.Mock(address=(host, 27017), is_writable=writable, last_write_date=last_write_date,
+                         server_type_name='RSPrimary' if writable else 'RSSecondary')
+
+    def _db(self, servers):
+        client = mock.MagicMock()
+        client.admin.command = mock.AsyncMock(return_value={'ok': 1})
+        client.topology_description.server_descriptions.return_value = {
+            server.address: server for server in servers}
+        for patcher in (mock.patch.object(database, 'MotorClient'),
+                        mock.patch.object(controller, 'MotorClient', return_value=client)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return client, controller.CDCAggDatabase([], 'cdcagg', 'reader_uri', 'editor_uri')
+
+    @testing.gen_test
+    async def test_returns_primary_and_lag_of_members(self):
+        client, db = self._db([self._server('db1', True, 1000.0),
+                               self._server('db2', False, 995.5),
+                               self._server('db3', False, None)])
+        status = await db.replication_status()
+        client.admin.command.assert_awaited_once_with('ping', read_preference=ReadPreference.PRIMARY_PREFERRED)
+        self.assertEqual(status, {
+            'primary': 'db1:27017',
+            'members': [{'address': 'db1:27017', 'type': 'RSPrimary', 'lag_seconds': 0.0},
+                        {'address': 'db2:27017', 'type': 'RSSecondary', 'lag_seconds': 4.5},
+                        {'address': 'db3:27017', 'type': 'RSSecondary', 'lag_seconds': None}]})
+
+    @testing.gen_test
+    async def test_lag_is_unknown_without_primary(self):
+        _, db = self._db([self._server('db2', False, 995.5)])
+        status = await db.replication_status()
+        self.assertEqual(status, {
+            'primary': None,
+            'members': [{'address': 'db2:27017', 'type': 'RSSecondary', 'lag_seconds': None}]})
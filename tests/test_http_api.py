@@ -12,10 +12,15 @@
 # limitations under the License.
 
 import asyncio
+import contextlib
+import datetime
 from unittest import mock
 from argparse import Namespace
 
 from bson import ObjectId
+from bson.timestamp import Timestamp
+from pymongo import _csot as pymongo_csot
+from pymongo.errors import ExecutionTimeout
 from tornado import testing
 from tornado.escape import (
     json_encode,
@@ -25,16 +30,19 @@ from tornado.escape import (
 from kuha_common.testing import mock_coro
 from kuha_common.testing.testcases import KuhaUnitTestCase
 from kuha_document_store import database
-from kuha_document_store.handlers import (
-    RestApiHandler,
-    QueryHandler
-)
 
 from cdcagg_common.records import Study
 from cdcagg_docstore import (
+    bulk_delete,
     http_api,
     serve,
-    controller
+    controller,
+    conversion,
+    handlers,
+    health,
+    limits,
+    replication,
+    validation
 )
 
 
@@ -52,9 +60,21 @@ class TestGetApp(KuhaUnitTestCase):
         http_api.get_app('api_version', ('coll1', 'coll2', 'coll3'), keyword='argument')
         self._mock_WebApplication.assert_called_once_with(
             handlers=[
-                ('/api_version/(?P<collection>coll1|coll2|coll3)/?', RestApiHandler),
-                ('/api_version/(?P<collection>coll1|coll2|coll3)/(?P<resource_id>\\w+)', RestApiHandler),
-                ('/api_version/query/(?P<collection>coll1|coll2|coll3)/?', QueryHandler)],
+                ('/api_version/(?P<collection>coll1|coll2|coll3)/?', handlers.CDCAggRestApiHandler),
+                ('/api_version/(?P<collection>coll1|coll2|coll3)/(?P<resource_id>\\w+)',
+                 handlers.CDCAggRestApiHandler),
+                ('/api_version/upsert/(?P<collection>coll1|coll2|coll3)/?', handlers.UpsertHandler),
+                ('/api_version/harvest/(?P<collection>coll1|coll2|coll3)/?', handlers.HarvestSessionHandler),
+                ('/api_version/harvest/(?P<collection>coll1|coll2|coll3)/(?P<session_id>\\w+)/close/?',
+                 handlers.HarvestSessionHandler),
+                ('/api_version/delete/(?P<collection>coll1|coll2|coll3)/?', handlers.BulkDeleteHandler),
+                ('/api_version/delete/(?P<collection>coll1|coll2|coll3)/(?P<job_id>\\w+)',
+                 handlers.BulkDeleteHandler),
+                ('/api_version/query/(?P<collection>coll1|coll2|coll3)/?', handlers.CDCAggQueryHandler),
+                ('/api_version/query/(?P<collection>coll1|coll2|coll3)/multiget/?', handlers.MultiGetHandler),
+                ('/api_version/metrics/?', handlers.MetricsHandler),
+                ('/health/?', handlers.HealthHandler),
+                ('/ready/?', handlers.ReadyHandler)],
             keyword='argument')
 
 
@@ -76,7 +96,27 @@ def settings():
                      database_user_reader='reader',
                      database_user_editor='editor',
                      database_pass_reader='readerpass',
-                     database_pass_editor='editorpass')
+                     database_pass_editor='editorpass',
+                     query_max_time_ms=0,
+                     query_max_limit=0,
+                     query_collscan_threshold=0,
+                     select_batch_size=0,
+                     select_adaptive_batch_size=False,
+                     select_max_batch_size=5000,
+                     query_facets_cache_ttl=0,
+                     query_plan_cache_ttl=0,
+                     validation_pool='none',
+                     validation_pool_size=2,
+                     validation_offload_threshold=65536,
+                     read_preference='primary',
+                     max_staleness_seconds=0,
+                     replication_monitor_interval=5,
+                     pool_warm_up_connections=0)
+
+
+def causal_session():
+    return mock.Mock(operation_time=Timestamp(1700000000, 1),
+                     cluster_time={'clusterTime': Timestamp(1700000000, 1)})
 
 
 class TestCaseBase(testing.AsyncHTTPTestCase):
@@ -102,11 +142,22 @@ class TestCaseBase(testing.AsyncHTTPTestCase):
                                     return_value={DBNAME: {'studies': self.mock_studies}})
         self._patchers.append(patcher)
         self._mock_MotorClient = patcher.start()
+        self._mock_controller_MotorClient = self._init_patcher(
+            mock.patch.object(controller, 'MotorClient', return_value={DBNAME: {'studies': self.mock_studies}}))
 
     def get_app(self):
         db = controller.db_from_settings(self._settings)
         return serve.get_app('v0', ['studies'], db=db)
 
+    def _patch_causal_session(self, session):
+        self.causal_session_calls = []
+
+        @contextlib.asynccontextmanager
+        async def _causal_session(db, role, causal_times=None):
+            self.causal_session_calls.append((role, causal_times))
+            yield session
+        self._init_patcher(mock.patch.object(controller.CDCAggDatabase, 'causal_session', _causal_session))
+
     def _assert_response_equal(self, response, exp_code, exp_body=None):
         self.assertEqual(response.code, exp_code)
         if exp_body is not None:
@@ -131,6 +182,66 @@ class TestRESTApi(TestCaseBase):
                                     b'{"some": "record"}{"another": "record"}')
         self.mock_studies.find.assert_called_once_with({}, projection=None, skip=0, limit=0)
 
+    def test_shares_clients_with_lookups(self):
+        self.mock_studies.find.side_effect = lambda *args, **kwargs: async_generate_value([])
+        self._assert_response_equal(self.fetch('/v0/studies'), 200)
+        self._assert_response_equal(self.fetch('/v0/query/studies/multiget', method='POST',
+                                               body=json_encode({'ids': ['some_id']})), 200)
+        self._mock_MotorClient.assert_not_called()
+        self.assertEqual(self._mock_controller_MotorClient.call_count, 1)
+
+    def test_GET_single_returns_304_on_matching_etag(self):
+        updated = datetime.datetime(2021, 11, 9, 8, 5, 18, 123000)
+        self.mock_studies.find_one.side_effect = mock_coro({'_id': ObjectId('619f95dff13cfc3ed67ff0f6'),
+                                                            '_metadata': {'updated': updated}})
+        etag = handlers.resource_etag('619f95dff13cfc3ed67ff0f6', updated)
+        response = self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6', headers={'If-None-Match': etag})
+        self._assert_response_equal(response, 304, b'')
+        self.assertEqual(response.headers['Etag'], etag)
+        self.mock_studies.find_one.assert_called_once_with({'_id': ObjectId('619f95dff13cfc3ed67ff0f6')},
+                                                           projection={'_metadata.updated': True})
+
+    def test_GET_single_returns_304_if_not_modified_since(self):
+        updated = datetime.datetime(2021, 11, 9, 8, 5, 18, 123000)
+        self.mock_studies.find_one.side_effect = mock_coro({'_id': ObjectId('619f95dff13cfc3ed67ff0f6'),
+                                                            '_metadata': {'updated': updated}})
+        response = self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6',
+                              headers={'If-Modified-Since': 'Tue, 09 Nov 2021 08:05:18 GMT'})
+        self._assert_response_equal(response, 304, b'')
+        self.assertEqual(response.headers['Last-Modified'], 'Tue, 09 Nov 2021 08:05:18 GMT')
+
+    def _mock_find_one(self, updated):
+        async def find_one(*args, **kwargs):
+            return {'_id': ObjectId('619f95dff13cfc3ed67ff0f6'), '_metadata': {'updated': updated}}
+        self.mock_studies.find_one.side_effect = find_one
+
+    def test_GET_single_reads_once_without_conditional_headers(self):
+        updated = datetime.datetime(2021, 11, 9, 8, 5, 18, 123000)
+        self._mock_find_one(updated)
+        response = self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6')
+        self._assert_response_equal(
+            response, 200,
+            b'{"_id": {"$oid": "619f95dff13cfc3ed67ff0f6"}, "_metadata": {"updated": "2021-11-09T08:05:18Z"}}')
+        self.mock_studies.find_one.assert_called_once_with({'_id': ObjectId('619f95dff13cfc3ed67ff0f6')})
+        self.assertEqual(response.headers['Etag'], handlers.resource_etag('619f95dff13cfc3ed67ff0f6', updated))
+        self.assertEqual(response.headers['Last-Modified'], 'Tue, 09 Nov 2021 08:05:18 GMT')
+
+    def test_GET_single_validators_answer_conditional_GET(self):
+        self._mock_find_one(datetime.datetime(2021, 11, 9, 8, 5, 18, 123000))
+        response = self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6')
+        self._assert_response_equal(response, 200)
+        conditional = self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6',
+                                 headers={'If-None-Match': response.headers['Etag']})
+        self._assert_response_equal(conditional, 304, b'')
+        conditional = self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6',
+                                 headers={'If-Modified-Since': response.headers['Last-Modified']})
+        self._assert_response_equal(conditional, 304, b'')
+        self._mock_find_one(datetime.datetime(2021, 11, 9, 8, 5, 19))
+        modified = self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6',
+                              headers={'If-None-Match': response.headers['Etag']})
+        self._assert_response_equal(modified, 200)
+        self.assertNotEqual(modified.headers['Etag'], response.headers['Etag'])
+
     def test_POST_returns_400_on_validation_fail(self):
         resp_body = self._assert_response_equal(self.fetch('/v0/studies',
                                                            method='POST',
@@ -223,8 +334,47 @@ class TestRESTApi(TestCaseBase):
                                                   'error': None,
                                                   'result': 'delete_successful'})
 
+    def test_POST_drops_client_content_hash(self):
+        self.mock_studies.insert_one.side_effect = mock_coro(mock.Mock(inserted_id='new_id'))
+        study_dict = self._valid_study_dict()
+        study_dict.setdefault('_metadata', {})['content_hash'] = 'client_hash'
+        self._assert_response_equal(self.fetch('/v0/studies',
+                                               method='POST',
+                                               headers={'Content-Type': 'application/json'},
+                                               body=json_encode(study_dict)),
+                                    201)
+        (document,), _ = self.mock_studies.insert_one.call_args
+        self.assertNotIn('content_hash', document.get('_metadata') or {})
+
+    def test_POST_prevalidates_document(self):
+        self.mock_studies.insert_one.side_effect = mock_coro(mock.Mock(inserted_id='new_id'))
+        mock_prevalidate = self._init_patcher(mock.patch.object(controller.CDCAggDatabase, 'prevalidate',
+                                                                new=mock.Mock(side_effect=mock_coro(False))))
+        body = json_encode(self._valid_study_dict())
+        self._assert_response_equal(self.fetch('/v0/studies', method='POST',
+                                               headers={'Content-Type': 'application/json'}, body=body), 201)
+        mock_prevalidate.assert_called_once_with('studies', self._valid_study_dict(), document_size=len(body))
+
+    def test_PUT_prevalidates_document_as_update(self):
+        self.mock_studies.replace_one.side_effect = mock_coro(mock.Mock(upserted_id='619f95dff13cfc3ed67ff0f6'))
+        self.mock_studies.find_one.side_effect = mock_coro(Study().export_dict())
+
+        async def prevalidate(*args, **kwargs):
+            raise validation.DocumentValidationError('Validation of studies failed', {'key': ['unknown field']})
+        mock_prevalidate = self._init_patcher(mock.patch.object(controller.CDCAggDatabase, 'prevalidate',
+                                                                new=mock.Mock(side_effect=prevalidate)))
+        resp_body = self._assert_response_equal(self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6',
+                                                           method='PUT',
+                                                           headers={'Content-Type': 'application/json'},
+                                                           body=json_encode({'key': 'value'})),
+                                                400)
+        mock_prevalidate.assert_called_once_with('studies', {'key': 'value'}, document_size=16, update=True)
+        self.assertEqual(json_decode(resp_body)['message'],
+                         "HTTP 400: Bad Request (('Validation of studies failed', {'key': ['unknown field']}))")
+
     def test_PUT_returns_200_on_success(self):
         self.mock_studies.replace_one.side_effect = mock_coro(mock.Mock(upserted_id='619f95dff13cfc3ed67ff0f6'))
+        self.mock_studies.update_one.side_effect = mock_coro(mock.Mock(modified_count=1))
         self.mock_studies.find_one.side_effect = mock_coro(Study().export_dict())
         resp_body = self._assert_response_equal(self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6',
                                                            method='PUT',
@@ -235,6 +385,20 @@ class TestRESTApi(TestCaseBase):
                                                   'error': None,
                                                   'result': 'replace_successful'})
 
+    def test_PUT_clears_content_hash(self):
+        self.mock_studies.replace_one.side_effect = mock_coro(mock.Mock(upserted_id='619f95dff13cfc3ed67ff0f6'))
+        self.mock_studies.update_one.side_effect = mock_coro(mock.Mock(modified_count=1))
+        self.mock_studies.find_one.side_effect = mock_coro(Study().export_dict())
+        self._assert_response_equal(self.fetch('/v0/studies/619f95dff13cfc3ed67ff0f6',
+                                               method='PUT',
+                                               headers={'Content-Type': 'application/json'},
+                                               body=json_encode({'study_number': 'value',
+                                                                 '_metadata': {'content_hash': 'client_hash'}})),
+                                    200)
+        self.mock_studies.update_one.assert_called_once_with(
+            {'_id': ObjectId('619f95dff13cfc3ed67ff0f6')},
+            {'$unset': {'_metadata.content_hash': True}})
+
     def test_PUT_returns_400_on_validation_error(self):
         self.mock_studies.replace_one.side_effect = mock_coro(mock.Mock(upserted_id='619f95dff13cfc3ed67ff0f6'))
         self.mock_studies.find_one.side_effect = mock_coro(Study().export_dict())
@@ -247,3 +411,770 @@ class TestRESTApi(TestCaseBase):
             'code': 400,
             'message': "HTTP 400: Bad Request (('Validation of studies failed', {'key': "
             "['unknown field']}))"})
+
+
+def _evaluate(expression, document):
+    """Evaluate aggregation expressions of upserts against document."""
+    if isinstance(expression, str) and expression.startswith('$'):
+        if expression == '$$ROOT':
+            return document
+        value = document
+        for key in expression[1:].split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        return value
+    if isinstance(expression, list):
+        return [_evaluate(item, document) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) == 1 and next(iter(expression)).startswith('$'):
+        ((operator, args),) = expression.items()
+        if operator == '$literal':
+            return args
+        args = _evaluate(args, document)
+        return {'$mergeObjects': lambda: {key: value for arg in args if arg for key, value in arg.items()},
+                '$ifNull': lambda: args[1] if args[0] is None else args[0],
+                '$cond': lambda: args[1] if args[0] else args[2],
+                '$and': lambda: all(args),
+                '$eq': lambda: args[0] == args[1]}[operator]()
+    return {key: _evaluate(value, document) for key, value in expression.items()}
+
+
+class TestUpsert(TestCaseBase):
+
+    created = datetime.datetime(2021, 11, 9, 8, 5, 18)
+
+    def _fetch(self, body):
+        return self.fetch('/v0/upsert/studies', method='PUT',
+                          headers={'Content-Type': 'application/json'},
+                          body=json_encode(body))
+
+    def _mock_upsert(self, stored=None):
+        """Mock upsert of the resource currently stored.
+
+        The resulting document is stored in `self.written`.
+        """
+        async def find_one_and_update(upsert_filter, update, **kwargs):
+            (stage,) = update
+            self.written = _evaluate(stage['$replaceWith'], stored or {})
+            if self.written['_id'] is None:
+                self.written['_id'] = ObjectId('619f95dff13cfc3ed67ff0f6')
+            return self.written
+        self.mock_studies.find_one_and_update.side_effect = find_one_and_update
+
+    def _stored(self, study_dict, status='created', harvest_session=None):
+        content = {key: value for key, value in study_dict.items() if key not in ('_id', '_metadata')}
+        return {**content,
+                '_id': ObjectId('619f95dff13cfc3ed67ff0f6'),
+                '_metadata': {'created': self.created, 'updated': self.created,
+                              'deleted': self.created if status == 'deleted' else None,
+                              'status': status, 'schema_version': '1.0', 'cmm_type': 'study',
+                              'content_hash': conversion.content_hash(content),
+                              'harvest_session': harvest_session}}
+
+    def test_returns_201_on_insert(self):
+        self._mock_upsert()
+        study_dict = TestRESTApi._valid_study_dict()
+        resp_body = self._assert_response_equal(self._fetch(study_dict), 201)
+        self.assertEqual(json_decode(resp_body), {'affected_resource': '619f95dff13cfc3ed67ff0f6',
+                                                  'error': None,
+                                                  'result': 'insert_successful'})
+        self.mock_studies.find_one_and_update.assert_called_once()
+        (upsert_filter, _), kwargs = self.mock_studies.find_one_and_update.call_args
+        self.assertEqual(upsert_filter, {'_aggregator_identifier': study_dict['_aggregator_identifier']})
+        content = {key: value for key, value in study_dict.items() if key not in ('_id', '_metadata')}
+        metadata = self.written.pop('_metadata')
+        self.assertEqual(self.written, {**content, '_id': ObjectId('619f95dff13cfc3ed67ff0f6')})
+        self.assertEqual(metadata['status'], 'created')
+        self.assertEqual(metadata['updated'], metadata['created'])
+        self.assertEqual(metadata['content_hash'], conversion.content_hash(content))
+        self.assertTrue(kwargs['upsert'])
+
+    def test_returns_200_on_update(self):
+        study_dict = TestRESTApi._valid_study_dict()
+        stored = self._stored(study_dict)
+        self._mock_upsert(stored)
+        study_dict['study_number'] = 'another_study_number'
+        resp_body = self._assert_response_equal(self._fetch(study_dict), 200)
+        self.assertEqual(json_decode(resp_body), {'affected_resource': '619f95dff13cfc3ed67ff0f6',
+                                                  'error': None,
+                                                  'result': 'replace_successful'})
+        self.assertEqual(self.written['study_number'], 'another_study_number')
+        self.assertEqual(self.written['_metadata']['created'], self.created)
+        self.assertGreater(self.written['_metadata']['updated'], self.created)
+
+    def test_removes_fields_missing_from_document(self):
+        study_dict = TestRESTApi._valid_study_dict()
+        stored = self._stored(study_dict)
+        stored['abstract'] = [{'language': 'en', 'abstract': 'Dropped by the source'}]
+        stored['_metadata']['content_hash'] = 'hash of content with abstract'
+        self._mock_upsert(stored)
+        resp_body = self._assert_response_equal(self._fetch(study_dict), 200)
+        self.assertEqual(json_decode(resp_body)['result'], 'replace_successful')
+        self.assertNotIn('abstract', self.written)
+        self.assertEqual(self.written['_id'], stored['_id'])
+        self.assertEqual(self.written['_metadata']['created'], self.created)
+
+    def test_does_not_evaluate_values_of_document(self):
+        study_dict = TestRESTApi._valid_study_dict()
+        study_dict['study_number'] = '$_id'
+        self._mock_upsert(self._stored(TestRESTApi._valid_study_dict()))
+        self._assert_response_equal(self._fetch(study_dict), 200)
+        self.assertEqual(self.written['study_number'], '$_id')
+
+    def test_returns_causal_token_of_write(self):
+        session = causal_session()
+        self._patch_causal_session(session)
+        self._mock_upsert()
+        response = self.fetch('/v0/upsert/studies', method='PUT',
+                              headers={'Content-Type': 'application/json', 'X-Causal-Token': 'new'},
+                              body=json_encode(TestRESTApi._valid_study_dict()))
+        self.assertEqual(response.code, 201)
+        self.assertEqual(replication.decode_causal_token(response.headers['X-Causal-Token']),
+                         (session.operation_time, session.cluster_time))
+        self.assertEqual(self.causal_session_calls, [('editor', None)])
+        self.assertIs(self.mock_studies.find_one_and_update.call_args[1]['session'], session)
+
+    def test_no_causal_token_without_request_header(self):
+        self._mock_upsert()
+        response = self._fetch(TestRESTApi._valid_study_dict())
+        self.assertEqual(response.code, 201)
+        self.assertNotIn('X-Causal-Token', response.headers)
+        self.assertNotIn('session', self.mock_studies.find_one_and_update.call_args[1])
+
+    def test_leaves_unchanged_content_as_is(self):
+        study_dict = TestRESTApi._valid_study_dict()
+        stored = self._stored(study_dict)
+        self._mock_upsert(stored)
+        study_dict['_metadata']['updated'] = '2021-11-09T08:05:18Z'
+        resp_body = self._assert_response_equal(self._fetch(study_dict), 200)
+        self.assertEqual(json_decode(resp_body), {'affected_resource': '619f95dff13cfc3ed67ff0f6',
+                                                  'error': None,
+                                                  'result': 'unchanged'})
+        self.assertEqual(self.written, stored)
+        # Content hash is checked by the write.
+        self.mock_studies.find_one.assert_not_called()
+        self.mock_studies.find_one_and_update.assert_called_once()
+
+    def test_writes_unchanged_content_of_deleted_resource(self):
+        study_dict = TestRESTApi._valid_study_dict()
+        self._mock_upsert(self._stored(study_dict, status='deleted'))
+        resp_body = self._assert_response_equal(self._fetch(study_dict), 200)
+        self.assertEqual(json_decode(resp_body)['result'], 'replace_successful')
+        self.assertEqual(self.written['_metadata']['status'], 'created')
+        self.assertIsNone(self.written['_metadata']['deleted'])
+
+    def test_stamps_harvest_session(self):
+        study_dict = TestRESTApi._valid_study_dict()
+        stored = self._stored(study_dict, harvest_session='619f95dff13cfc3ed67ff0f5')
+        self._mock_upsert(stored)
+        study_dict['study_number'] = 'another_study_number'
+        self._assert_response_equal(self.fetch('/v0/upsert/studies?harvest_session=619f95dff13cfc3ed67ff0f7',
+                                               method='PUT', headers={'Content-Type': 'application/json'},
+                                               body=json_encode(study_dict)), 200)
+        self.assertEqual(self.written['_metadata']['harvest_session'], '619f95dff13cfc3ed67ff0f7')
+
+    def test_keeps_harvest_session_if_not_given(self):
+        study_dict = TestRESTApi._valid_study_dict()
+        self._mock_upsert(self._stored(study_dict, harvest_session='619f95dff13cfc3ed67ff0f5'))
+        study_dict['study_number'] = 'another_study_number'
+        self._assert_response_equal(self._fetch(study_dict), 200)
+        self.assertEqual(self.written['_metadata']['harvest_session'], '619f95dff13cfc3ed67ff0f5')
+
+    def test_stamps_harvest_session_of_unchanged_content(self):
+        study_dict = TestRESTApi._valid_study_dict()
+        stored = self._stored(study_dict)
+        self._mock_upsert(stored)
+        resp_body = self._assert_response_equal(
+            self.fetch('/v0/upsert/studies?harvest_session=619f95dff13cfc3ed67ff0f7',
+                       method='PUT', headers={'Content-Type': 'application/json'},
+                       body=json_encode(study_dict)), 200)
+        self.assertEqual(json_decode(resp_body)['result'], 'unchanged')
+        self.assertEqual(self.written, {**stored, '_metadata': {**stored['_metadata'],
+                                                                'harvest_session': '619f95dff13cfc3ed67ff0f7'}})
+        self.mock_studies.update_one.assert_not_called()
+
+    def test_returns_400_on_invalid_harvest_session(self):
+        self._assert_response_equal(self.fetch('/v0/upsert/studies?harvest_session=invalid',
+                                               method='PUT', headers={'Content-Type': 'application/json'},
+                                               body=json_encode(TestRESTApi._valid_study_dict())), 400)
+        self.mock_studies.find_one_and_update.assert_not_called()
+
+    def test_returns_400_on_validation_fail(self):
+        resp_body = self._assert_response_equal(self._fetch({'study_number': 'value'}), 400)
+        self.assertEqual(json_decode(resp_body),
+                         {'code': 400,
+                          'message': "HTTP 400: Bad Request (('Validation of studies failed', "
+                          "{'_aggregator_identifier': ['required field'], "
+                          "'_direct_base_url': ['required field']}))"})
+        self.mock_studies.find_one_and_update.assert_not_called()
+
+
+class TestHarvestSessions(TestCaseBase):
+
+    def _patch_db(self):
+        super()._patch_db()
+        self.mock_sessions = mock.Mock()
+        self._mock_controller_MotorClient.return_value[DBNAME]['harvest_sessions'] = self.mock_sessions
+
+    def test_opens_session(self):
+        self.mock_sessions.insert_one.side_effect = mock_coro(
+            mock.Mock(inserted_id=ObjectId('619f95dff13cfc3ed67ff0f7')))
+        resp_body = self._assert_response_equal(self.fetch('/v0/harvest/studies', method='POST',
+                                                           headers={'Content-Type': 'application/json'},
+                                                           body=json_encode({'_direct_base_url': 'some.url'})),
+                                                201)
+        self.assertEqual(json_decode(resp_body), {'session_id': '619f95dff13cfc3ed67ff0f7',
+                                                  '_direct_base_url': 'some.url'})
+        (session,), _ = self.mock_sessions.insert_one.call_args
+        self.assertEqual(session['direct_base_url'], 'some.url')
+        self.assertEqual(session['collection'], 'studies')
+        self.assertIsNone(session['closed'])
+
+    def test_open_returns_400_without_direct_base_url(self):
+        for body in ({}, {'_direct_base_url': ''}, {'_direct_base_url': ['some.url']}):
+            with self.subTest(body=body):
+                self._assert_response_equal(self.fetch('/v0/harvest/studies', method='POST',
+                                                       headers={'Content-Type': 'application/json'},
+                                                       body=json_encode(body)), 400)
+        self.mock_sessions.insert_one.assert_not_called()
+
+    def test_close_deletes_unseen_records(self):
+        self.mock_sessions.find_one_and_update.side_effect = mock_coro(
+            {'_id': ObjectId('619f95dff13cfc3ed67ff0f7'), 'collection': 'studies',
+             'direct_base_url': 'some.url', 'closed': None})
+        self.mock_studies.update_many.side_effect = mock_coro(mock.Mock(modified_count=3))
+        resp_body = self._assert_response_equal(self.fetch('/v0/harvest/studies/619f95dff13cfc3ed67ff0f7/close',
+                                                           method='POST', headers={'Content-Type': 'application/json'},
+                                                           body='{}'), 200)
+        self.assertEqual(json_decode(resp_body), {'session_id': '619f95dff13cfc3ed67ff0f7', 'deleted': 3})
+        (session_filter, _), _ = self.mock_sessions.find_one_and_update.call_args
+        self.assertEqual(session_filter, {'_id': ObjectId('619f95dff13cfc3ed67ff0f7'),
+                                          'collection': 'studies', 'closed': None})
+        self.mock_studies.update_many.assert_called_once()
+        (sweep_filter, update), _ = self.mock_studies.update_many.call_args
+        self.assertEqual(sweep_filter, {'_metadata.status': 'created',
+                                        '_direct_base_url': 'some.url',
+                                        '_metadata.harvest_session': {'$ne': '619f95dff13cfc3ed67ff0f7'}})
+        self.assertEqual(update['$set']['_metadata.status'], 'deleted')
+        self.assertEqual(update['$set']['_metadata.deleted'], update['$set']['_metadata.updated'])
+
+    def test_close_returns_404_on_unknown_or_closed_session(self):
+        self.mock_sessions.find_one_and_update.side_effect = mock_coro(None)
+        self._assert_response_equal(self.fetch('/v0/harvest/studies/619f95dff13cfc3ed67ff0f7/close',
+                                               method='POST', headers={'Content-Type': 'application/json'},
+                                               body='{}'), 404)
+        self._assert_response_equal(self.fetch('/v0/harvest/studies/invalid/close',
+                                               method='POST', headers={'Content-Type': 'application/json'},
+                                               body='{}'), 404)
+        self.mock_studies.update_many.assert_not_called()
+
+
+class TestBulkDelete(TestCaseBase):
+
+    def _patch_db(self):
+        super()._patch_db()
+        self.mock_jobs = mock.Mock()
+        self._mock_controller_MotorClient.return_value[DBNAME]['bulk_delete_jobs'] = self.mock_jobs
+        self._mock_start = self._init_patcher(mock.patch.object(bulk_delete.BulkDelete, '_start'))
+
+    def _job(self, **kwargs):
+        job = {'_id': ObjectId('619f95dff13cfc3ed67ff0f7'), 'collection': 'studies',
+               'filter': '{"_direct_base_url": "some.url"}', 'delete_type': 'soft', 'state': 'running',
+               'deleted': 0, 'error': None, 'created': datetime.datetime(2021, 11, 9, 8, 5, 18),
+               'updated': datetime.datetime(2021, 11, 9, 8, 5, 18)}
+        job.update(kwargs)
+        return job
+
+    def _post(self, body, delete_type=None):
+        url = '/v0/delete/studies' if delete_type is None else '/v0/delete/studies?delete_type=' + delete_type
+        return self.fetch(url, method='POST', headers={'Content-Type': 'application/json'},
+                          body=json_encode(body))
+
+    def test_submits_job(self):
+        self.mock_jobs.insert_one.side_effect = mock_coro(mock.Mock(inserted_id=ObjectId('619f95dff13cfc3ed67ff0f7')))
+        response = self._post({'_filter': {'_direct_base_url': 'some.url'}}, delete_type='hard')
+        resp_body = self._assert_response_equal(response, 202)
+        self.assertEqual(response.headers['Location'], '/v0/delete/studies/619f95dff13cfc3ed67ff0f7')
+        body = json_decode(resp_body)
+        self.assertEqual(body['job_id'], '619f95dff13cfc3ed67ff0f7')
+        self.assertEqual(body['_filter'], {'_direct_base_url': 'some.url'})
+        self.assertEqual(body['delete_type'], 'hard')
+        self.assertEqual(body['state'], 'running')
+        self._mock_start.assert_called_once()
+
+    def test_returns_400_on_invalid_request(self):
+        for body, delete_type in (({'_filter': {'_direct_base_url': 'some.url'}}, 'invalid'),
+                                  ({}, None), ({'_filter': {}}, None),
+                                  ({'_filter': {'study_number': {'$where': 'true'}}}, None)):
+            with self.subTest(body=body, delete_type=delete_type):
+                self._assert_response_equal(self._post(body, delete_type=delete_type), 400)
+        self.mock_jobs.insert_one.assert_not_called()
+        self._mock_start.assert_not_called()
+
+    def test_returns_job(self):
+        self.mock_jobs.find_one.side_effect = mock_coro(self._job(state='completed', deleted=12))
+        resp_body = self._assert_response_equal(self.fetch('/v0/delete/studies/619f95dff13cfc3ed67ff0f7'), 200)
+        self.assertEqual(json_decode(resp_body), {'job_id': '619f95dff13cfc3ed67ff0f7', 'collection': 'studies',
+                                                  '_filter': {'_direct_base_url': 'some.url'},
+                                                  'delete_type': 'soft', 'state': 'completed', 'deleted': 12,
+                                                  'error': None, 'created': '2021-11-09T08:05:18Z',
+                                                  'updated': '2021-11-09T08:05:18Z'})
+        self.mock_jobs.find_one.assert_called_once_with({'_id': ObjectId('619f95dff13cfc3ed67ff0f7')})
+
+    def test_returns_404_on_unknown_job(self):
+        self.mock_jobs.find_one.side_effect = mock_coro(None)
+        self._assert_response_equal(self.fetch('/v0/delete/studies/619f95dff13cfc3ed67ff0f7'), 404)
+        self._assert_response_equal(self.fetch('/v0/delete/studies/invalid'), 404)
+
+    def test_delete_batch_soft(self):
+        self.mock_studies.find.return_value = async_generate_value([{'_id': ObjectId('619f95dff13cfc3ed67ff0f6')}])
+        self.mock_studies.update_many.side_effect = mock_coro(mock.Mock(modified_count=1))
+        deleted = self.io_loop.run_sync(lambda: self._app.settings['db'].delete_batch(
+            'studies', {'_direct_base_url': 'some.url'}, 'soft', 10))
+        self.assertEqual(deleted, 1)
+        active_filter = {'$and': [{'_direct_base_url': 'some.url'}, {'_metadata.status': 'created'}]}
+        self.mock_studies.find.assert_called_once_with(active_filter, projection={'_id': True}, limit=10)
+        (batch_filter, update), _ = self.mock_studies.update_many.call_args
+        self.assertEqual(batch_filter, {'$and': [{'_id': {'$in': [ObjectId('619f95dff13cfc3ed67ff0f6')]}},
+                                                 active_filter]})
+        self.assertEqual(update['$set']['_metadata.status'], 'deleted')
+
+    def test_delete_batch_hard_with_write_concern(self):
+        mock_with_options = self.mock_studies.with_options.return_value
+        mock_with_options.find.return_value = async_generate_value([{'_id': ObjectId('619f95dff13cfc3ed67ff0f6')}])
+        mock_with_options.delete_many.side_effect = mock_coro(mock.Mock(deleted_count=1))
+        deleted = self.io_loop.run_sync(lambda: self._app.settings['db'].delete_batch(
+            'studies', {'_direct_base_url': 'some.url'}, 'hard', 10, write_concern='wc'))
+        self.assertEqual(deleted, 1)
+        self.mock_studies.with_options.assert_called_once_with(write_concern='wc')
+        mock_with_options.delete_many.assert_called_once_with(
+            {'$and': [{'_id': {'$in': [ObjectId('619f95dff13cfc3ed67ff0f6')]}}, {'_direct_base_url': 'some.url'}]})
+
+
+class TestMultiGet(TestCaseBase):
+
+    def _fetch(self, body):
+        return self.fetch('/v0/query/studies/multiget', method='POST',
+                          headers={'Content-Type': 'application/json'},
+                          body=json_encode(body))
+
+    def test_returns_documents_in_requested_order(self):
+        self.mock_studies.find.return_value = async_generate_value([
+            {'_id': ObjectId('619f95dff13cfc3ed67ff0f6'), '_aggregator_identifier': 'agg_1',
+             '_metadata': {'updated': datetime.datetime(2021, 11, 9, 8, 5, 18)}},
+            {'_id': ObjectId('619f95dff13cfc3ed67ff0f7'), '_aggregator_identifier': 'agg_2',
+             '_metadata': {'updated': datetime.datetime(2021, 11, 10, 8, 5, 18)}}])
+        self._assert_response_equal(
+            self._fetch({'ids': ['agg_2', 'missing', '619f95dff13cfc3ed67ff0f6']}), 200,
+            b'{"_id": {"$oid": "619f95dff13cfc3ed67ff0f7"}, "_aggregator_identifier": "agg_2", '
+            b'"_metadata": {"updated": "2021-11-10T08:05:18Z"}}'
+            b'{"_id": {"$oid": "619f95dff13cfc3ed67ff0f6"}, "_aggregator_identifier": "agg_1", '
+            b'"_metadata": {"updated": "2021-11-09T08:05:18Z"}}')
+        self.mock_studies.find.assert_called_once_with(
+            {'$or': [{'_aggregator_identifier': {'$in': ['agg_2', 'missing', '619f95dff13cfc3ed67ff0f6']}},
+                     {'_id': {'$in': [ObjectId('619f95dff13cfc3ed67ff0f6')]}}]},
+            projection=None, batch_size=3)
+
+    def test_returns_400_on_too_many_ids(self):
+        resp_body = self._assert_response_equal(
+            self._fetch({'ids': ['id_%s' % (index,) for index in range(1001)]}), 400)
+        self.assertEqual(json_decode(resp_body)['code'], 400)
+        self.mock_studies.find.assert_not_called()
+
+    def test_returns_400_on_invalid_ids(self):
+        self._assert_response_equal(self._fetch({'ids': 'agg_1'}), 400)
+        self.mock_studies.find.assert_not_called()
+
+
+class TestConcurrencyLimits(TestCaseBase):
+
+    def get_app(self):
+        self._limiter = limits.ConcurrencyLimiter('reads', 1, 0, retry_after=5)
+        db = controller.db_from_settings(self._settings)
+        return serve.get_app('v0', ['studies'], db=db, concurrency_limiters={'reads': self._limiter})
+
+    def test_returns_503_when_saturated(self):
+        self.io_loop.run_sync(self._limiter.acquire)
+        response = self.fetch('/v0/studies')
+        resp_body = self._assert_response_equal(response, 503)
+        self.assertEqual(response.headers['Retry-After'], '5')
+        self.assertEqual(json_decode(resp_body)['code'], 503)
+        self.mock_studies.find.assert_not_called()
+
+    def test_releases_slot_after_request(self):
+        self.mock_studies.find.return_value = async_generate_value([{'some': 'record'}])
+        self._assert_response_equal(self.fetch('/v0/studies'), 200)
+        self.assertEqual(self._limiter.active, 0)
+
+
+class TestHealth(TestCaseBase):
+
+    def get_app(self):
+        db = controller.db_from_settings(self._settings)
+        self._db = mock.Mock(replication_status=mock.AsyncMock(return_value={
+            'primary': 'localhost:27017',
+            'members': [{'address': 'localhost:27017', 'type': 'RSPrimary', 'lag_seconds': 0.0}]}))
+        self._health_monitor = health.HealthMonitor(self._db)
+        return serve.get_app('v0', ['studies'], db=db, health_monitor=self._health_monitor)
+
+    def test_health(self):
+        self._assert_response_equal(self.fetch('/health'), 200, b'{"status": "ok"}')
+
+    def test_not_ready_before_first_check(self):
+        response = self.fetch('/ready')
+        self.assertEqual(response.code, 503)
+        self.assertFalse(json_decode(response.body)['ready'])
+
+    def test_ready_is_served_from_memory(self):
+        self.io_loop.run_sync(self._health_monitor.check)
+        response = self.fetch('/ready')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json_decode(response.body)['checks']['primary'],
+                         {'status': 'pass', 'address': 'localhost:27017'})
+        self.fetch('/ready')
+        self._db.replication_status.assert_awaited_once_with()
+        self.assertEqual(self.mock_studies.mock_calls, [])
+
+
+def _patch_kuha_query_post(testcase, post=None):
+    """Patch POST handler of Kuha Document Store Query API.
+
+    :param post: Coroutine function called with the handler and the
+                 collection. Writes a result by default.
+    :returns: Mock recording the collections of calls.
+    """
+    mock_post = mock.Mock()
+
+    async def _post(handler, collection):
+        mock_post(collection)
+        if post is None:
+            handler.write({'from': 'kuha'})
+        else:
+            await post(handler, collection)
+    testcase._init_patcher(mock.patch.object(handlers.QueryHandler, 'post', _post))
+    return mock_post
+
+
+class TestQueryApi(TestCaseBase):
+
+    def _fetch(self, body, query_type=None):
+        url = '/v0/query/studies'
+        if query_type is not None:
+            url += '?query_type=%s' % (query_type,)
+        return self.fetch(url, method='POST', headers={'Content-Type': 'application/json'},
+                          body=json_encode(body))
+
+    def test_delegates_standard_queries_to_kuha(self):
+        for query_type in ('select', 'count', 'distinct'):
+            with self.subTest(query_type=query_type):
+                mock_post = _patch_kuha_query_post(self)
+                self._assert_response_equal(
+                    self._fetch({'_filter': {'_id': {'$oid': '619f95dff13cfc3ed67ff0f6'}},
+                                 'fieldname': 'study_number'}, query_type=query_type),
+                    200, b'{"from": "kuha"}')
+                mock_post.assert_called_once_with('studies')
+                self.mock_studies.find.assert_not_called()
+
+    def test_converts_strings_compared_to_typed_fields(self):
+        mock_post = _patch_kuha_query_post(self)
+        self.mock_studies.count_documents.side_effect = mock_coro(1)
+        self._assert_response_equal(
+            self._fetch({'_filter': {'_id': '619f95dff13cfc3ed67ff0f6',
+                                     '_metadata.updated': {'$gt': '2021-11-09T08:05:18Z'}}},
+                        query_type='count'),
+            200, b'{"count": 1}')
+        mock_post.assert_not_called()
+        self.mock_studies.count_documents.assert_called_once_with(
+            {'_id': ObjectId('619f95dff13cfc3ed67ff0f6'),
+             '_metadata.updated': {'$gt': datetime.datetime(2021, 11, 9, 8, 5, 18)}})
+
+    def test_count_in_causal_session(self):
+        session = causal_session()
+        self._patch_causal_session(session)
+        token = replication.encode_causal_token(session)
+        self.mock_studies.count_documents.side_effect = mock_coro(15)
+        response = self.fetch('/v0/query/studies?query_type=count', method='POST',
+                              headers={'Content-Type': 'application/json', 'X-Causal-Token': token},
+                              body=json_encode({'_filter': {'study_number': 'x'}}))
+        self._assert_response_equal(response, 200, b'{"count": 15}')
+        self.assertEqual(self.causal_session_calls,
+                         [('reader', (session.operation_time, session.cluster_time))])
+        self.mock_studies.count_documents.assert_called_once_with({'study_number': 'x'}, session=session)
+
+    def test_rejects_invalid_causal_token(self):
+        response = self.fetch('/v0/query/studies', method='POST',
+                              headers={'Content-Type': 'application/json', 'X-Causal-Token': 'invalid'},
+                              body=json_encode({'_filter': {'study_number': 'x'}}))
+        self._assert_response_equal(response, 400)
+        self.mock_studies.find.assert_not_called()
+
+    def _fetch_in_session(self, body, query_type='select'):
+        session = causal_session()
+        self._patch_causal_session(session)
+        response = self.fetch('/v0/query/studies?query_type=%s' % (query_type,), method='POST',
+                              headers={'Content-Type': 'application/json', 'X-Causal-Token': 'new'},
+                              body=json_encode(body))
+        return response, session
+
+    def test_select_in_causal_session_converts_special_operators(self):
+        self.mock_studies.find.return_value = async_generate_value([{'some': 'record'}, {'another': 'record'}])
+        response, session = self._fetch_in_session(
+            {'_filter': {'_id': {'$oid': '619f95dff13cfc3ed67ff0f6'},
+                         '_metadata.updated': {'$gt': {'$isodate': '2021-11-09T08:05:18Z'}}},
+             'fields': ['study_number'], 'sort_by': 'study_number', 'limit': 5})
+        self._assert_response_equal(response, 200, b'{"some": "record"}{"another": "record"}')
+        self.mock_studies.find.assert_called_once_with(
+            {'_id': ObjectId('619f95dff13cfc3ed67ff0f6'),
+             '_metadata.updated': {'$gt': datetime.datetime(2021, 11, 9, 8, 5, 18)}},
+            projection={'study_number': True}, skip=0, limit=5,
+            sort=[('study_number', 1)], max_time_ms=None, session=session)
+
+    def _mock_indexes(self, *names):
+        self.mock_studies.list_indexes.return_value = async_generate_value([{'name': name} for name in names])
+
+    def test_select_routes_active_records_to_partial_index(self):
+        self._mock_indexes('_id_', 'created__metadata.status_1__metadata.updated_-1')
+        self.mock_studies.find.return_value = async_generate_value([{'some': 'record'}])
+        response, session = self._fetch_in_session(
+            {'_filter': {'_metadata.status': 'created'}, 'sort_by': '_metadata.updated',
+             'sort_order': -1, 'limit': 5})
+        self._assert_response_equal(response, 200, b'{"some": "record"}')
+        self.mock_studies.find.assert_called_once_with(
+            {'_metadata.status': 'created'}, projection=None, skip=0, limit=5,
+            sort=[('_metadata.updated', -1)], max_time_ms=None,
+            hint='created__metadata.status_1__metadata.updated_-1', session=session)
+
+    def test_count_routes_active_records_to_partial_index(self):
+        self._mock_indexes('_id_', 'created__metadata.status_1__metadata.updated_-1')
+        self.mock_studies.count_documents.side_effect = mock_coro(15)
+        query_filter = {'_metadata.status': 'created',
+                        '_metadata.updated': {'$gt': {'$isodate': '2021-11-09T08:05:18Z'}}}
+        response, session = self._fetch_in_session({'_filter': query_filter}, query_type='count')
+        self._assert_response_equal(response, 200, b'{"count": 15}')
+        self.mock_studies.count_documents.assert_called_once_with(
+            {'_metadata.status': 'created', '_metadata.updated': {'$gt': datetime.datetime(2021, 11, 9, 8, 5, 18)}},
+            hint='created__metadata.status_1__metadata.updated_-1', session=session)
+
+    def test_routes_plain_queries_to_partial_index(self):
+        mock_post = _patch_kuha_query_post(self)
+        self._mock_indexes('_id_', 'created__metadata.status_1__metadata.updated_-1')
+        self.mock_studies.find.return_value = async_generate_value([{'some': 'record'}])
+        self._assert_response_equal(
+            self._fetch({'_filter': {'_metadata.status': 'created'}, 'sort_by': '_metadata.updated',
+                         'sort_order': -1, 'limit': 5}), 200, b'{"some": "record"}')
+        self.mock_studies.find.assert_called_once_with(
+            {'_metadata.status': 'created'}, projection=None, skip=0, limit=5,
+            sort=[('_metadata.updated', -1)], max_time_ms=None,
+            hint='created__metadata.status_1__metadata.updated_-1')
+        mock_post.assert_not_called()
+
+    def test_delegates_plain_queries_to_kuha_without_partial_index(self):
+        mock_post = _patch_kuha_query_post(self)
+        self._mock_indexes('_id_')
+        self._assert_response_equal(self._fetch({'_filter': {'_metadata.status': 'created'},
+                                                 'sort_by': '_metadata.updated'}, query_type='count'),
+                                    200, b'{"from": "kuha"}')
+        self.mock_studies.list_indexes.assert_called_once_with()
+        mock_post.assert_called_once_with('studies')
+
+    def test_does_not_route_to_missing_partial_index(self):
+        self._mock_indexes('_id_')
+        self.mock_studies.count_documents.side_effect = mock_coro(15)
+        response, session = self._fetch_in_session(
+            {'_filter': {'_metadata.status': 'created'}, 'sort_by': '_metadata.updated'}, query_type='count')
+        self._assert_response_equal(response, 200, b'{"count": 15}')
+        self.mock_studies.count_documents.assert_called_once_with({'_metadata.status': 'created'}, session=session)
+
+    def test_distinct_in_causal_session(self):
+        self.mock_studies.distinct.side_effect = mock_coro(['en', 'fi'])
+        response, session = self._fetch_in_session({'fieldname': 'study_titles.language'}, query_type='distinct')
+        self._assert_response_equal(response, 200, b'{"study_titles.language": ["en", "fi"]}')
+        self.mock_studies.distinct.assert_called_once_with('study_titles.language', {}, session=session)
+
+    def test_aggregate_streams_results(self):
+        self.mock_studies.aggregate.return_value = async_generate_value([
+            {'_id': 'en', 'count': 2, 'latest': datetime.datetime(2021, 11, 9, 8, 5, 18)},
+            {'_id': 'fi', 'count': 1, 'latest': datetime.datetime(2021, 11, 10, 8, 5, 18)}])
+        pipeline = [{'$match': {'_metadata.updated': {'$gt': {'$isodate': '2021-11-09T08:05:18Z'}}}},
+                    {'$unwind': '$study_titles'},
+                    {'$group': {'_id': '$study_titles.language', 'count': {'$sum': 1},
+                                'latest': {'$max': '$_metadata.updated'}}},
+                    {'$sort': {'count': -1}}]
+        self._assert_response_equal(
+            self._fetch({'pipeline': pipeline}, query_type='aggregate'), 200,
+            b'{"_id": "en", "count": 2, "latest": "2021-11-09T08:05:18Z"}'
+            b'{"_id": "fi", "count": 1, "latest": "2021-11-10T08:05:18Z"}')
+        pipeline[0] = {'$match': {'_metadata.updated': {'$gt': datetime.datetime(2021, 11, 9, 8, 5, 18)}}}
+        self.mock_studies.aggregate.assert_called_once_with(pipeline)
+
+    def test_aggregate_returns_400_on_unsupported_stage(self):
+        resp_body = self._assert_response_equal(
+            self._fetch({'pipeline': [{'$out': 'other'}]}, query_type='aggregate'), 400)
+        self.assertEqual(json_decode(resp_body)['message'],
+                         'HTTP 400: Bad Request (Unsupported pipeline stage: $out)')
+        self.mock_studies.aggregate.assert_not_called()
+
+    def test_facets(self):
+        self.mock_studies.aggregate.return_value.to_list.side_effect = mock_coro([{
+            'count': [{'count': 3}],
+            '0': [{'_id': 'en', 'count': 3}, {'_id': 'fi', 'count': 1}],
+            '1': [{'_id': '2020', 'count': 2}]}])
+        self._assert_response_equal(
+            self._fetch({'_filter': {'_metadata.status': 'created'},
+                         'fields': ['study_titles.language', 'publication_years.publication_year']},
+                        query_type='facets'), 200,
+            b'{"count": 3, "facets": {"study_titles.language": [{"value": "en", "count": 3}, '
+            b'{"value": "fi", "count": 1}], "publication_years.publication_year": [{"value": "2020", "count": 2}]}}')
+        pipeline = self.mock_studies.aggregate.call_args[0][0]
+        self.assertEqual(pipeline[0], {'$match': {'_metadata.status': 'created'}})
+        self.assertEqual(sorted(pipeline[1]['$facet']), ['0', '1', 'count'])
+
+    def test_facets_returns_400_without_fields(self):
+        self._assert_response_equal(self._fetch({'_filter': {}}, query_type='facets'), 400)
+        self.mock_studies.aggregate.assert_not_called()
+
+    def test_select_text_search(self):
+        self.mock_studies.find.return_value = async_generate_value([{'some': 'record', '_score': 1.5}])
+        self._assert_response_equal(self._fetch({'_text': 'election', 'limit': 5}),
+                                    200, b'{"some": "record", "_score": 1.5}')
+        self.mock_studies.find.assert_called_once_with(
+            {'$text': {'$search': 'election'}}, projection={'_score': {'$meta': 'textScore'}},
+            skip=0, limit=5, sort=[('_score', {'$meta': 'textScore'})], max_time_ms=None)
+
+    def test_returns_400_on_unsupported_operator(self):
+        mock_post = _patch_kuha_query_post(self)
+        resp_body = self._assert_response_equal(self._fetch({'_filter': {'$where': 'sleep(1000)'}}), 400)
+        self.assertEqual(json_decode(resp_body)['message'],
+                         'HTTP 400: Bad Request (Unsupported filter operator: $where)')
+        mock_post.assert_not_called()
+
+    def test_returns_400_on_invalid_query_type(self):
+        self._assert_response_equal(self._fetch({}, query_type='invalid'), 400)
+
+
+class TestFacetsCache(TestCaseBase):
+
+    def get_app(self):
+        self._settings.query_facets_cache_ttl = 30
+        return super().get_app()
+
+    def _fetch(self, body):
+        return self.fetch('/v0/query/studies?query_type=facets', method='POST',
+                          headers={'Content-Type': 'application/json'}, body=json_encode(body))
+
+    def test_caches_results(self):
+        self.mock_studies.aggregate.return_value.to_list.side_effect = mock_coro(
+            [{'count': [{'count': 1}], '0': [{'_id': 'en', 'count': 1}]}])
+        body = {'_filter': {'study_number': 'x'}, 'fields': ['study_titles.language']}
+        expected = b'{"count": 1, "facets": {"study_titles.language": [{"value": "en", "count": 1}]}}'
+        self._assert_response_equal(self._fetch(body), 200, expected)
+        self._assert_response_equal(self._fetch(body), 200, expected)
+        self.assertEqual(self.mock_studies.aggregate.call_count, 1)
+        body['fields'] = ['publishers.publisher']
+        self._assert_response_equal(self._fetch(body), 200)
+        self.assertEqual(self.mock_studies.aggregate.call_count, 2)
+
+
+class TestQueryApiCostCaps(TestCaseBase):
+
+    def setUp(self):
+        super().setUp()
+        self.mock_command = mock.Mock()
+        self.mock_database = mock.MagicMock()
+        self.mock_database.__getitem__.side_effect = {'studies': self.mock_studies}.__getitem__
+        self.mock_database.command = self.mock_command
+        self._mock_controller_MotorClient.return_value = {DBNAME: self.mock_database}
+
+    def get_app(self):
+        self._settings.query_max_time_ms = 1000
+        self._settings.query_max_limit = 100
+        self._settings.query_collscan_threshold = 10
+        self._settings.query_plan_cache_ttl = 60
+        return super().get_app()
+
+    def _fetch(self, body, query_type='select'):
+        return self.fetch('/v0/query/studies?query_type=%s' % (query_type,), method='POST',
+                          headers={'Content-Type': 'application/json'}, body=json_encode(body))
+
+    def test_returns_400_on_limit_over_max(self):
+        resp_body = self._assert_response_equal(self._fetch({'_filter': {'study_number': 'x'}, 'limit': 101}), 400)
+        self.assertEqual(json_decode(resp_body)['message'],
+                         "HTTP 400: Bad Request (Key 'limit' must be between 1 and 100)")
+
+    def _plan(self, stage):
+        self.mock_studies.estimated_document_count.side_effect = mock_coro(11)
+        self.mock_command.side_effect = mock_coro({'queryPlanner': {'winningPlan': {'stage': stage}}})
+
+    def test_returns_400_on_collscan(self):
+        mock_post = _patch_kuha_query_post(self)
+        self.mock_studies.estimated_document_count.side_effect = mock_coro(11)
+        self.mock_command.side_effect = mock_coro(
+            {'queryPlanner': {'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}})
+        self._assert_response_equal(self._fetch({'fieldname': 'study_number'}, query_type='distinct'), 400)
+        self.mock_command.assert_called_once_with(
+            'explain', {'distinct': 'studies', 'key': 'study_number', 'query': {}}, verbosity='queryPlanner')
+        mock_post.assert_not_called()
+
+    def test_caps_aggregate_results(self):
+        self._plan('IXSCAN')
+        self.mock_studies.aggregate.return_value = async_generate_value([{'_id': 'en', 'count': 2}])
+        pipeline = [{'$match': {'study_number': 'x'}}, {'$group': {'_id': '$study_number', 'count': {'$sum': 1}}}]
+        self._assert_response_equal(self._fetch({'pipeline': pipeline}, query_type='aggregate'),
+                                    200, b'{"_id": "en", "count": 2}')
+        self.mock_studies.aggregate.assert_called_once_with(pipeline + [{'$limit': 100}], maxTimeMS=1000)
+
+    def test_applies_time_limit_to_kuha_queries(self):
+        timeouts = []
+
+        async def post(handler, collection):
+            timeouts.append(pymongo_csot.get_timeout())
+            handler.write({'count': 3})
+        mock_post = _patch_kuha_query_post(self, post)
+        self._plan('COUNT_SCAN')
+        self._assert_response_equal(self._fetch({'_filter': {'study_number': 'x'}}, query_type='count'),
+                                    200, b'{"count": 3}')
+        mock_post.assert_called_once_with('studies')
+        self.assertEqual(timeouts, [1.0])
+
+    def test_caches_collscan_check_per_query_shape(self):
+        _patch_kuha_query_post(self)
+        self._plan('IXSCAN')
+        for study_number in ('x', 'y'):
+            self._assert_response_equal(
+                self._fetch({'_filter': {'study_number': study_number}}, query_type='count'), 200)
+        self.mock_command.assert_called_once()
+        self.mock_studies.estimated_document_count.assert_called_once()
+        self._assert_response_equal(self._fetch({'_filter': {'study_number': {'$in': ['x']}}},
+                                                query_type='count'), 200)
+        self.assertEqual(self.mock_command.call_count, 2)
+
+    def test_caches_collscan_check_per_partial_filter_value(self):
+        _patch_kuha_query_post(self)
+        self._plan('IXSCAN')
+        for status in ('created', 'deleted', 'created'):
+            self._assert_response_equal(
+                self._fetch({'_filter': {'_metadata.status': status, 'study_number': 'x'}}, query_type='count'), 200)
+        self.assertEqual(self.mock_command.call_count, 2)
+        self.assertEqual([call.args[1]['query']['_metadata.status'] for call in self.mock_command.call_args_list],
+                         ['created', 'deleted'])
+
+    def test_returns_504_on_timeout(self):
+        async def post(handler, collection):
+            handler.write({'some': 'record'})
+            raise ExecutionTimeout('operation exceeded time limit', 50)
+        _patch_kuha_query_post(self, post)
+        self._plan('IXSCAN')
+        resp_body = self._assert_response_equal(
+            self._fetch({'_filter': {'study_number': 'x'}, 'limit': 5}), 504)
+        self.assertEqual(json_decode(resp_body)['code'], 504)
+
+    def test_terminates_stream_on_timeout(self):
+        async def post(handler, collection):
+            handler.write({'some': 'record'})
+            await handler.flush()
+            raise ExecutionTimeout('operation exceeded time limit', 50)
+        _patch_kuha_query_post(self, post)
+        self._plan('IXSCAN')
+        self._assert_response_equal(
+            self._fetch({'_filter': {'study_number': 'x'}, 'limit': 5}), 200,
+            b'{"some": "record"}{"_error": {"code": 504, "message": "Query exceeded time limit"}}')
@@ -0,0 +1,105 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from argparse import Namespace
+from unittest import mock
+from tornado import (
+    httputil,
+    testing,
+    web
+)
+
+from cdcagg_docstore import limits
+
+
+class TestConcurrencyLimiter(testing.AsyncTestCase):
+
+    @testing.gen_test
+    async def test_acquire_and_release(self):
+        limiter = limits.ConcurrencyLimiter('test', 2, 0)
+        await limiter.acquire()
+        await limiter.acquire()
+        self.assertEqual(limiter.active, 2)
+        limiter.release()
+        self.assertEqual(limiter.active, 1)
+
+    @testing.gen_test
+    async def test_rejects_when_queue_is_full(self):
+        limiter = limits.ConcurrencyLimiter('test', 1, 0)
+        await limiter.acquire()
+        with self.assertRaises(limits.LimiterSaturated):
+            await limiter.acquire()
+
+    @testing.gen_test
+    async def test_rejects_on_queue_timeout(self):
+        limiter = limits.ConcurrencyLimiter('test', 1, 1, queue_timeout=0.01)
+        await limiter.acquire()
+        with self.assertRaises(limits.LimiterSaturated):
+            await limiter.acquire()
+        self.assertEqual(limiter.waiting, 0)
+
+    @testing.gen_test
+    async def test_queued_request_gets_slot_on_release(self):
+        limiter = limits.ConcurrencyLimiter('test', 1, 1, queue_timeout=1)
+        await limiter.acquire()
+        waiter = limiter.acquire()
+        self.io_loop.add_callback(limiter.release)
+        await waiter
+        self.assertEqual(limiter.active, 1)
+        self.assertEqual(limiter.waiting, 0)
+
+
+class TestLimitersFromSettings(testing.AsyncTestCase):
+
+    def test_zero_disables_limit(self):
+        limiters = limits.limiters_from_settings(Namespace(
+            max_concurrent_reads=10, max_concurrent_writes=0, max_concurrent_queries=2,
+            max_queued_requests=5, queue_timeout=1, retry_after=3))
+        self.assertEqual(sorted(limiters), ['queries', 'reads'])
+        self.assertEqual(limiters['reads'].max_concurrent, 10)
+        self.assertEqual(limiters['queries'].retry_after, 3)
+
+
+class _LimitedHandler(limits.ConcurrencyLimitMixin, web.RequestHandler):
+    pass
+
+
+class TestConcurrencyLimitMixin(testing.AsyncTestCase):
+
+    def _handler(self, limiter):
+        app = web.Application(concurrency_limiters={limits.ROUTE_CLASS_READS: limiter})
+        request = httputil.HTTPServerRequest(method='GET', uri='/', connection=mock.Mock())
+        return _LimitedHandler(app, request)
+
+    @testing.gen_test
+    async def test_releases_slot_once_on_finish(self):
+        limiter = limits.ConcurrencyLimiter('test', 2, 0)
+        handler = self._handler(limiter)
+        await handler.prepare()
+        self.assertEqual(limiter.active, 1)
+        handler.on_finish()
+        handler.on_finish()
+        self.assertEqual(limiter.active, 0)
+
+    @testing.gen_test
+    async def test_keeps_slot_when_client_closes_connection(self):
+        limiter = limits.ConcurrencyLimiter('test', 1, 0)
+        handler = self._handler(limiter)
+        await handler.prepare()
+        handler.on_connection_close()
+        # The handler is still working on the request.
+        self.assertEqual(limiter.active, 1)
+        with self.assertRaises(limits.LimiterSaturated):
+            await limiter.acquire()
+        handler.on_finish()
+        self.assertEqual(limiter.active, 0)
@@ -0,0 +1,75 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from argparse import Namespace
+from unittest import TestCase
+from tornado import (
+    gen,
+    testing
+)
+
+from cdcagg_docstore import loop_monitor
+from cdcagg_docstore.metrics import REGISTRY
+
+
+def _block_event_loop(seconds):
+    time.sleep(seconds)
+
+
+class TestLoopLagMonitor(testing.AsyncTestCase):
+
+    def _monitor(self, **kwargs):
+        monitor = loop_monitor.LoopLagMonitor(**kwargs)
+        monitor.start()
+        self.addCleanup(monitor.stop)
+        return monitor
+
+    @testing.gen_test
+    async def test_samples_lag(self):
+        count_before = REGISTRY.histogram('ioloop.lag_seconds', '').count
+        self._monitor(interval=0.01, block_threshold=0)
+        await gen.sleep(0.1)
+        self.assertGreater(REGISTRY.histogram('ioloop.lag_seconds', '').count - count_before, 1)
+
+    @testing.gen_test
+    async def test_logs_stack_of_blocking_code(self):
+        blocked_before = REGISTRY.counter('ioloop.blocked', '').value
+        self._monitor(interval=0.01, block_threshold=0.05)
+        await gen.sleep(0.02)
+        with self.assertLogs(loop_monitor._logger, level='WARNING') as cm:
+            _block_event_loop(0.3)
+            await gen.sleep(0.02)
+        self.assertEqual(len(cm.output), 1)
+        self.assertIn('_block_event_loop', cm.output[0])
+        self.assertEqual(REGISTRY.counter('ioloop.blocked', '').value - blocked_before, 1)
+
+    @testing.gen_test
+    async def test_stop_ends_sampling(self):
+        monitor = self._monitor(interval=0.01, block_threshold=0.05)
+        monitor.stop()
+        count_before = REGISTRY.histogram('ioloop.lag_seconds', '').count
+        await gen.sleep(0.05)
+        self.assertEqual(REGISTRY.histogram('ioloop.lag_seconds', '').count, count_before)
+
+
+class TestMonitorFromSettings(TestCase):
+
+    def test_zero_interval_disables_monitor(self):
+        self.assertIsNone(loop_monitor.monitor_from_settings(Namespace(loop_lag_interval=0,
+                                                                       loop_block_threshold=0.5)))
+
+    def test_returns_monitor(self):
+        monitor = loop_monitor.monitor_from_settings(Namespace(loop_lag_interval=1, loop_block_threshold=0.2))
+        self.assertEqual(monitor.interval, 1)
+        self.assertEqual(monitor.block_threshold, 0.2)
@@ -12,7 +12,10 @@
 # limitations under the License.
 
 from unittest import TestCase
-from cdcagg_docstore import iter_collections
+from cdcagg_docstore import (
+    iter_collections,
+    collection_registry
+)
 from cdcagg_docstore.mdb import studies_collection
 
 
@@ -21,3 +24,44 @@ class TestPackage(TestCase):
     def test_iter_collections_returns_collections(self):
         collections = list(iter_collections())
         self.assertEqual(collections, [studies_collection()])
+
+    def test_iter_collections_yields_same_definitions(self):
+        first = list(iter_collections())
+        second = list(iter_collections())
+        self.assertEqual(len(first), len(second))
+        for coll_first, coll_second in zip(first, second):
+            self.assertIs(coll_first, coll_second)
+
+
+class TestCollectionRegistry(TestCase):
+
+    def setUp(self):
+        self.studies_coll = studies_collection()
+        self.registry = collection_registry()
+
+    def test_is_memoised(self):
+        self.assertIs(collection_registry(), self.registry)
+
+    def test_get_by_name(self):
+        self.assertEqual(self.registry.get(self.studies_coll.name), self.studies_coll)
+        self.assertIn(self.studies_coll.name, self.registry)
+        self.assertEqual(self.registry.names(), (self.studies_coll.name,))
+        self.assertEqual(len(self.registry), 1)
+
+    def test_get_raises_key_error_for_unknown_collection(self):
+        with self.assertRaises(KeyError):
+            self.registry.get('nonexistent')
+
+    def test_field_lookups(self):
+        name = self.studies_coll.name
+        self.assertEqual(self.registry.isodate_fields(name), frozenset(self.studies_coll.isodate_fields))
+        self.assertEqual(self.registry.object_id_fields(name), frozenset(self.studies_coll.object_id_fields))
+        self.assertIn('_metadata.updated', self.registry.isodate_fields(name))
+        self.assertNotIn('study_number', self.registry.isodate_fields(name))
+        self.assertIn('_id', self.registry.object_id_fields(name))
+
+    def test_is_read_only(self):
+        with self.assertRaises(TypeError):
+            self.registry._by_name['other'] = self.studies_coll
+        self.assertIsInstance(self.studies_coll.isodate_fields, tuple)
+        self.assertIsInstance(self.studies_coll.indexes_unique, tuple)
@@ -0,0 +1,140 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import (
+    mock,
+    TestCase
+)
+from pymongo import ReadPreference
+from tornado import testing
+
+from kuha_document_store import database
+
+from cdcagg_docstore import (
+    controller,
+    pools
+)
+
+
+ADDRESSES = (('db1', 27017), ('db2', 27017))
+
+
+def _event(address, connection_id):
+    return mock.Mock(address=address, connection_id=connection_id)
+
+
+class TestConnectionCounter(TestCase):
+
+    def test_counts_ready_connections(self):
+        counter = pools.ConnectionCounter()
+        counter.connection_created(_event(ADDRESSES[0], 1))
+        self.assertEqual(counter.ready(ADDRESSES[0]), 0)
+        counter.connection_ready(_event(ADDRESSES[0], 1))
+        counter.connection_ready(_event(ADDRESSES[0], 2))
+        counter.connection_ready(_event(ADDRESSES[1], 1))
+        self.assertEqual(counter.ready(ADDRESSES[0]), 2)
+        counter.connection_closed(_event(ADDRESSES[0], 1))
+        counter.connection_closed(_event(ADDRESSES[0], 3))
+        self.assertEqual(counter.ready(ADDRESSES[0]), 1)
+        counter.pool_closed(mock.Mock(address=ADDRESSES[1]))
+        self.assertEqual(counter.ready(ADDRESSES[1]), 0)
+
+
+class TestPoolWarmUp(testing.AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clients = {}
+        self.mock_MotorClient = mock.Mock(side_effect=self._client)
+        for patcher in (mock.patch.object(database, 'MotorClient'),
+                        mock.patch.object(controller, 'MotorClient', new=self.mock_MotorClient)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _client(self, uri, **kwargs):
+        client = self.clients[uri] = mock.MagicMock()
+        client.admin.command = mock.AsyncMock(return_value={'ok': 1})
+        client.topology_description.server_descriptions.return_value = {
+            address: mock.Mock(address=address, is_readable=True) for address in ADDRESSES}
+        return client
+
+    def _db(self, connections=2):
+        return controller.CDCAggDatabase([], 'cdcagg', 'reader_uri', 'editor_uri',
+                                         pool_warm_up_connections=connections)
+
+    def _open_connections(self, db, role, address, count):
+        for connection_id in range(count):
+            db._connection_counters[role].connection_ready(_event(address, connection_id))
+
+    def test_configures_min_pool_size(self):
+        db = self._db()
+        db.reader_collection('studies')
+        db.editor_collection('studies')
+        self.assertEqual(self.mock_MotorClient.call_args_list, [
+            mock.call('reader_uri', minPoolSize=2, event_listeners=[db._connection_counters['reader']]),
+            mock.call('editor_uri', minPoolSize=2, event_listeners=[db._connection_counters['editor']])])
+
+    def test_warms_clients_of_parent_class(self):
+        db = self._db()
+        self.assertIs(db._get_reader_client(), self.clients['reader_uri'])
+        self.assertIs(db._get_editor_client(), self.clients['editor_uri'])
+        db.reader_collection('studies')
+        self.assertEqual(self.mock_MotorClient.call_count, 2)
+        for call in self.mock_MotorClient.call_args_list:
+            self.assertEqual(call.kwargs['minPoolSize'], 2)
+
+    def test_pools_are_warm_without_warm_up(self):
+        db = self._db(connections=0)
+        self.assertTrue(db.pools_warm())
+        self.mock_MotorClient.assert_not_called()
+
+    def test_pools_are_warm_with_connections_to_every_member(self):
+        db = self._db()
+        for address in ADDRESSES:
+            self._open_connections(db, 'reader', address, 2)
+        self._open_connections(db, 'editor', ADDRESSES[0], 2)
+        self._open_connections(db, 'editor', ADDRESSES[1], 1)
+        self.assertFalse(db.pools_warm())
+        self._open_connections(db, 'editor', ADDRESSES[1], 2)
+        self.assertTrue(db.pools_warm())
+        # Pools stay warm once warm.
+        db._connection_counters['editor'].pool_closed(mock.Mock(address=ADDRESSES[1]))
+        self.assertTrue(db.pools_warm())
+
+    def test_pools_are_cold_before_members_are_discovered(self):
+        db = self._db()
+        db.reader_collection('studies')
+        self.clients['reader_uri'].topology_description.server_descriptions.return_value = {}
+        self.assertFalse(db.pools_warm())
+
+    @testing.gen_test
+    async def test_warm_up_waits_for_pools(self):
+        db = self._db()
+
+        def open_connections(*args, **kwargs):
+            for role in ('reader', 'editor'):
+                for address in ADDRESSES:
+                    self._open_connections(db, role, address, 2)
+        db.reader_collection('studies')
+        self.clients['reader_uri'].admin.command.side_effect = open_connections
+        self.assertTrue(await db.warm_up_pools(timeout=1, poll_interval=0.01))
+        for uri in ('reader_uri', 'editor_uri'):
+            self.clients[uri].admin.command.assert_awaited_once_with(
+                'ping', read_preference=ReadPreference.PRIMARY_PREFERRED)
+
+    @testing.gen_test
+    async def test_warm_up_times_out(self):
+        db = self._db()
+        with self.assertLogs(controller._logger, level='WARNING'):
+            self.assertFalse(await db.warm_up_pools(timeout=0.05, poll_interval=0.01))
+        self.assertFalse(db.pools_warm())
@@ -0,0 +1,135 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pstats
+import tempfile
+import tracemalloc
+from argparse import Namespace
+from unittest import (
+    TestCase,
+    mock
+)
+from tornado import (
+    testing,
+    web
+)
+
+from cdcagg_docstore import profiling
+
+
+class _Handler(profiling.ProfilingMixin, web.RequestHandler):
+
+    def get(self):
+        self.finish({'values': [str(value) for value in range(1000)]})
+
+
+class TestProfilingMixin(testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.profiler = profiling.RequestProfiler('secret', self._directory.name, min_interval=3600)
+        super().setUp()
+
+    def get_app(self):
+        return web.Application([('/', _Handler)], request_profiler=self.profiler)
+
+    def test_stores_profile_of_authorized_request(self):
+        response = self.fetch('/', headers={'X-Profile': 'secret'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['X-Profile-Status'], 'profiling')
+        path = os.path.join(self._directory.name, response.headers['X-Profile-Id'])
+        self.assertGreater(pstats.Stats(path + '.pstats').total_calls, 0)
+        with open(path + '.txt', encoding='utf-8') as file_:
+            summary = file_.read()
+        self.assertTrue(summary.startswith('GET / 200'))
+        self.assertIn('allocations by line', summary)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_ignores_token_in_query_argument(self):
+        response = self.fetch('/?_profile=secret')
+        self.assertNotIn('X-Profile-Status', response.headers)
+        self.assertEqual(os.listdir(self._directory.name), [])
+
+    def test_locks_out_after_invalid_token(self):
+        self.assertEqual(self.fetch('/', headers={'X-Profile': 'invalid'}).headers['X-Profile-Status'],
+                         'unauthorized')
+        response = self.fetch('/', headers={'X-Profile': 'secret'})
+        self.assertEqual(response.headers['X-Profile-Status'], 'unauthorized')
+        self.assertEqual(os.listdir(self._directory.name), [])
+
+    def test_rejects_invalid_token(self):
+        response = self.fetch('/', headers={'X-Profile': 'invalid'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['X-Profile-Status'], 'unauthorized')
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(os.listdir(self._directory.name), [])
+
+    def test_rate_limits_profiling(self):
+        self.assertEqual(self.fetch('/', headers={'X-Profile': 'secret'}).headers['X-Profile-Status'],
+                         'profiling')
+        response = self.fetch('/', headers={'X-Profile': 'secret'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['X-Profile-Status'], 'rate-limited')
+        self.assertEqual(len(os.listdir(self._directory.name)), 2)
+
+    def test_does_not_profile_without_token(self):
+        response = self.fetch('/')
+        self.assertNotIn('X-Profile-Status', response.headers)
+        self.assertEqual(os.listdir(self._directory.name), [])
+
+
+class TestRequestProfiler(TestCase):
+
+    def test_allows_single_profile_at_a_time(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = profiling.RequestProfiler('secret', directory, min_interval=0)
+            session = profiler.start()
+            self.assertIsNotNone(session)
+            self.assertIsNone(profiler.start())
+            path = session.stop('test')
+            self.assertTrue(os.path.exists(path))
+            session = profiler.start()
+            self.assertIsNotNone(session)
+            session.stop('test')
+
+    def test_doubles_lockout_on_consecutive_failures(self):
+        profiler = profiling.RequestProfiler('secret', tempfile.gettempdir(), failure_lockout=10,
+                                             max_failure_lockout=25)
+        with mock.patch.object(profiling.time, 'monotonic', return_value=100):
+            self.assertFalse(profiler.authorize('invalid'))
+            self.assertFalse(profiler.authorize('secret'))
+        with mock.patch.object(profiling.time, 'monotonic', return_value=110):
+            self.assertFalse(profiler.authorize('invalid'))
+        with mock.patch.object(profiling.time, 'monotonic', return_value=129):
+            self.assertFalse(profiler.authorize('secret'))
+        with mock.patch.object(profiling.time, 'monotonic', return_value=130):
+            self.assertFalse(profiler.authorize('invalid'))
+        with mock.patch.object(profiling.time, 'monotonic', return_value=155):
+            self.assertTrue(profiler.authorize('secret'))
+            self.assertFalse(profiler.authorize('invalid'))
+        with mock.patch.object(profiling.time, 'monotonic', return_value=165):
+            self.assertTrue(profiler.authorize('secret'))
+
+    def test_empty_token_disables_profiling(self):
+        self.assertIsNone(profiling.profiler_from_settings(Namespace(
+            profiling_token='', profiling_dir='', profiling_min_interval=60)))
+
+    def test_from_settings(self):
+        profiler = profiling.profiler_from_settings(Namespace(
+            profiling_token='secret', profiling_dir='', profiling_min_interval=10))
+        self.assertEqual(profiler.directory, tempfile.gettempdir())
+        self.assertEqual(profiler.min_interval, 10)
+        self.assertTrue(profiler.authorize('secret'))
+        self.assertFalse(profiler.authorize('secre'))
@@ -0,0 +1,256 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from argparse import Namespace
+from unittest import TestCase
+from bson import ObjectId
+
+from cdcagg_docstore import query
+
+
+class TestConvertFilter(TestCase):
+
+    def test_converts_special_operators(self):
+        self.assertEqual(
+            query.convert_filter({'$or': [{'_id': {'$oid': '619f95dff13cfc3ed67ff0f6'}},
+                                          {'_metadata.updated': {'$lt': {'$isodate': '2021-11-09T08:05:18Z'}}}]}),
+            {'$or': [{'_id': ObjectId('619f95dff13cfc3ed67ff0f6')},
+                     {'_metadata.updated': {'$lt': datetime.datetime(2021, 11, 9, 8, 5, 18)}}]})
+
+    def test_raises_on_unsupported_operator(self):
+        with self.assertRaises(query.QueryError):
+            query.convert_filter({'study_number': {'$where': 'true'}})
+
+    def test_raises_on_invalid_oid(self):
+        with self.assertRaises(query.QueryError):
+            query.convert_filter({'_id': {'$oid': 'invalid'}})
+
+
+class TestParseQuery(TestCase):
+
+    def test_defaults(self):
+        self.assertEqual(query.parse_query('select', {}),
+                         query.Query(query_type='select', query_filter={}, fields=None, skip=0, limit=0,
+                                     sort_by=None, sort_order=1, fieldname=None))
+
+    def test_distinct_requires_fieldname(self):
+        with self.assertRaises(query.QueryError):
+            query.parse_query('distinct', {'_filter': {}})
+
+    def test_raises_on_negative_limit(self):
+        with self.assertRaises(query.QueryError):
+            query.parse_query('select', {'limit': -1})
+
+
+class TestConvertPipeline(TestCase):
+
+    def test_converts_match_and_facet_stages(self):
+        pipeline = query.convert_pipeline([
+            {'$match': {'_id': {'$oid': '619f95dff13cfc3ed67ff0f6'}}},
+            {'$facet': {'years': [{'$unwind': '$publication_years'},
+                                  {'$group': {'_id': '$publication_years.publication_year',
+                                              'count': {'$sum': 1}}}],
+                        'latest': [{'$match': {'_metadata.updated': {'$gt': {'$isodate': '2021-11-09T08:05:18Z'}}}},
+                                   {'$limit': 1}]}}])
+        self.assertEqual(pipeline, [
+            {'$match': {'_id': ObjectId('619f95dff13cfc3ed67ff0f6')}},
+            {'$facet': {'years': [{'$unwind': '$publication_years'},
+                                  {'$group': {'_id': '$publication_years.publication_year',
+                                              'count': {'$sum': 1}}}],
+                        'latest': [{'$match': {'_metadata.updated': {'$gt': datetime.datetime(2021, 11, 9, 8, 5, 18)}}},
+                                   {'$limit': 1}]}}])
+
+    def test_raises_on_unsupported_stages(self):
+        for pipeline in ([{'$lookup': {'from': 'other'}}], [{'$out': 'other'}],
+                         [{'$facet': {'nested': [{'$facet': {'x': [{'$limit': 1}]}}]}}],
+                         [{'$facet': {'merge': [{'$merge': 'other'}]}}]):
+            with self.subTest(pipeline=pipeline):
+                with self.assertRaises(query.QueryError):
+                    query.convert_pipeline(pipeline)
+
+    def test_raises_on_disallowed_operators(self):
+        for pipeline in ([{'$match': {'$where': 'sleep(100)'}}],
+                         [{'$project': {'x': {'$function': {'body': 'function() {}', 'args': [],
+                                                            'lang': 'js'}}}}],
+                         [{'$group': {'_id': None, 'x': {'$accumulator': {}}}}]):
+            with self.subTest(pipeline=pipeline):
+                with self.assertRaises(query.QueryError):
+                    query.convert_pipeline(pipeline)
+
+    def test_raises_on_invalid_pipeline(self):
+        for pipeline in (None, [], {'$match': {}}, [{'$match': {}, '$limit': 1}], ['$match']):
+            with self.subTest(pipeline=pipeline):
+                with self.assertRaises(query.QueryError):
+                    query.convert_pipeline(pipeline)
+
+    def test_parse_aggregate_query(self):
+        parsed = query.parse_query('aggregate', {'pipeline': [{'$limit': 1}], '_filter': {'x': 1}})
+        self.assertEqual(parsed.pipeline, [{'$limit': 1}])
+        self.assertEqual(parsed.query_filter, {})
+
+
+class TestFacetsPipeline(TestCase):
+
+    def test_facets_pipeline(self):
+        parsed = query.parse_query('facets', {'_filter': {'study_number': 'x'},
+                                              'fields': ['study_titles.language'], 'limit': 10})
+        self.assertEqual(query.facets_pipeline(parsed), [
+            {'$match': {'study_number': 'x'}},
+            {'$facet': {'count': [{'$count': 'count'}],
+                        '0': [{'$project': {'value': '$study_titles.language'}},
+                              {'$unwind': '$value'},
+                              {'$group': {'_id': {'doc': '$_id', 'value': '$value'}}},
+                              {'$group': {'_id': '$_id.value', 'count': {'$sum': 1}}},
+                              {'$sort': {'count': -1, '_id': 1}},
+                              {'$limit': 10}]}}])
+
+    def test_facets_requires_fields(self):
+        for body in ({}, {'fields': []}):
+            with self.subTest(body=body):
+                with self.assertRaises(query.QueryError):
+                    query.parse_query('facets', body)
+
+
+class TestTextSearch(TestCase):
+
+    def test_adds_text_filter(self):
+        parsed = query.parse_query('count', {'_filter': {'_id': {'$oid': '619f95dff13cfc3ed67ff0f6'}},
+                                             '_text': 'election survey'})
+        self.assertEqual(parsed.query_filter, {'_id': ObjectId('619f95dff13cfc3ed67ff0f6'),
+                                               '$text': {'$search': 'election survey'}})
+        self.assertEqual(parsed.text_search, 'election survey')
+
+    def test_raises_on_invalid_text(self):
+        for text in ('', '  ', 5, 'x' * 513):
+            with self.subTest(text=text):
+                with self.assertRaises(query.QueryError):
+                    query.parse_query('select', {'_text': text})
+
+    def test_text_filter_is_not_allowed_in_filter(self):
+        with self.assertRaises(query.QueryError):
+            query.parse_query('select', {'_filter': {'$text': {'$search': 'x'}}})
+
+    def test_sorts_by_score_and_projects_score(self):
+        parsed = query.parse_query('select', {'_text': 'x', 'fields': ['study_number']})
+        self.assertEqual(query.select_sort(parsed), [('_score', {'$meta': 'textScore'})])
+        self.assertEqual(query.select_projection(parsed), {'study_number': True,
+                                                           '_score': {'$meta': 'textScore'}})
+
+    def test_sorts_by_other_field(self):
+        parsed = query.parse_query('select', {'_text': 'x', 'sort_by': 'study_number', 'sort_order': -1})
+        self.assertEqual(query.select_sort(parsed), [('study_number', -1)])
+        self.assertEqual(query.select_projection(parsed), {'_score': {'$meta': 'textScore'}})
+
+    def test_select_pipeline_adds_score(self):
+        parsed = query.parse_query('select', {'_text': 'x', 'limit': 5})
+        self.assertEqual(query.select_pipeline(parsed), [
+            {'$match': {'$text': {'$search': 'x'}}},
+            {'$addFields': {'_score': {'$meta': 'textScore'}}},
+            {'$sort': {'_score': {'$meta': 'textScore'}}},
+            {'$limit': 5}])
+
+    def test_partial_index_hint_is_not_used(self):
+        index = Namespace(name='active_updated', keys=[('_metadata.status', 1), ('_metadata.updated', -1)],
+                          partial_filter_expression={'_metadata.status': 'created'})
+        parsed = query.parse_query('select', {'_filter': {'_metadata.status': 'created'}, '_text': 'x',
+                                              'sort_by': '_metadata.updated'})
+        self.assertIsNone(query.partial_index_hint(parsed, [index]))
+
+
+class TestSelectPipeline(TestCase):
+
+    def test_builds_pipeline(self):
+        self.assertEqual(query.select_pipeline(query.parse_query('select', {
+            '_filter': {'study_number': 'x'}, 'fields': ['study_titles'], 'skip': 1, 'limit': 2,
+            'sort_by': 'study_number', 'sort_order': -1})),
+            [{'$match': {'study_number': 'x'}}, {'$sort': {'study_number': -1}}, {'$skip': 1},
+             {'$limit': 2}, {'$project': {'study_titles': True}}])
+
+
+class TestQueryShape(TestCase):
+
+    def _shape(self, query_type, body):
+        return query.query_shape(query.parse_query(query_type, body))
+
+    def test_leaves_out_compared_values(self):
+        body = {'_filter': {'$or': [{'study_number': 'x'}, {'_id': {'$in': [{'$oid': '619f95dff13cfc3ed67ff0f6'}]}}]},
+                'sort_by': 'study_number', 'limit': 5}
+        other_values = {'_filter': {'$or': [{'study_number': 'y'}, {'_id': {'$in': []}}]},
+                        'sort_by': 'study_number', 'limit': 10}
+        self.assertEqual(self._shape('select', body), self._shape('select', other_values))
+
+    def test_differs_by_structure(self):
+        shape = self._shape('select', {'_filter': {'study_number': 'x'}})
+        self.assertNotEqual(shape, self._shape('count', {'_filter': {'study_number': 'x'}}))
+        self.assertNotEqual(shape, self._shape('select', {'_filter': {'study_number': {'$gt': 'x'}}}))
+        self.assertNotEqual(shape, self._shape('select', {'_filter': {'study_number': 'x'}, 'sort_by': 'x'}))
+
+    def test_keeps_values_of_value_paths(self):
+        def _shape(status):
+            return query.query_shape(query.parse_query('count', {'_filter': {'_metadata.status': status,
+                                                                             'study_number': status}}),
+                                     value_paths=['_metadata.status'])
+        self.assertNotEqual(_shape('created'), _shape('deleted'))
+        self.assertEqual(_shape('created'), query.query_shape(query.parse_query('count', {
+            '_filter': {'_metadata.status': 'created', 'study_number': 'other'}}), ['_metadata.status']))
+
+
+class TestPlanHasCollscan(TestCase):
+
+    def test_finds_nested_collscan(self):
+        self.assertTrue(query.plan_has_collscan(
+            {'queryPlanner': {'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}}))
+
+    def test_index_scan(self):
+        self.assertFalse(query.plan_has_collscan(
+            {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}},
+             'rejectedPlans': [{'stage': 'COLLSCAN'}]}))
+
+
+class TestPartialIndexHint(TestCase):
+
+    index = Namespace(name='active_updated', keys=[('_metadata.status', 1), ('_metadata.updated', -1)],
+                      partial_filter_expression={'_metadata.status': 'created'})
+
+    def _hint(self, body):
+        return query.partial_index_hint(query.parse_query(query.QUERY_TYPE_SELECT, body), [self.index])
+
+    def test_returns_index_for_status_filter_and_sort_by_index_key(self):
+        self.assertEqual(self._hint({'_filter': {'_metadata.status': 'created'}, 'sort_by': '_metadata.updated'}),
+                         'active_updated')
+
+    def test_returns_index_for_status_eq_operator_and_filter_by_index_key(self):
+        self.assertEqual(self._hint({'_filter': {'_metadata.status': {'$eq': 'created'},
+                                                 '_metadata.updated': {'$gt': {'$isodate': '2021-11-09T08:05:18Z'}}}}),
+                         'active_updated')
+
+    def test_returns_none_without_status_filter(self):
+        self.assertIsNone(self._hint({'sort_by': '_metadata.updated'}))
+
+    def test_returns_none_for_other_status(self):
+        self.assertIsNone(self._hint({'_filter': {'_metadata.status': 'deleted'}, 'sort_by': '_metadata.updated'}))
+
+    def test_returns_none_for_fields_not_in_index(self):
+        self.assertIsNone(self._hint({'_filter': {'_metadata.status': 'created', 'study_number': 'x'},
+                                      'sort_by': '_metadata.updated'}))
+
+    def test_returns_none_for_top_level_operators(self):
+        self.assertIsNone(self._hint({'_filter': {'_metadata.status': 'created',
+                                                  '$or': [{'study_number': 'x'}, {'study_number': 'y'}]},
+                                      'sort_by': '_metadata.updated'}))
+        self.assertIsNone(self._hint({'_filter': {'$and': [{'_metadata.status': 'created'}]},
+                                      'sort_by': '_metadata.updated'}))
+
+    def test_returns_none_for_status_filter_only(self):
+        self.assertIsNone(self._hint({'_filter': {'_metadata.status': 'created'}}))
@@ -0,0 +1,189 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from unittest import (
+    mock,
+    TestCase
+)
+from bson.timestamp import Timestamp
+from pymongo import ReadPreference
+from pymongo.errors import OperationFailure
+from tornado import testing
+
+from kuha_document_store import database
+
+from cdcagg_docstore import (
+    controller,
+    replication
+)
+from cdcagg_docstore.metrics import REGISTRY
+
+
+def _status(primary='db1:27017', lags=None):
+    lags = {'db1:27017': 0.0, 'db2:27017': 5.0, 'db3:27017': 60.0} if lags is None else lags
+    return {'primary': primary,
+            'members': [{'address': address, 'type': None, 'lag_seconds': lag} for address, lag in lags.items()]}
+
+
+def _server(host, writable=False):
+    return mock.Mock(address=(host, 27017), is_writable=writable)
+
+
+class TestCausalToken(TestCase):
+
+    def test_encodes_and_decodes_token(self):
+        cluster_time = {'clusterTime': Timestamp(1700000000, 2), 'signature': {'keyId': 1}}
+        session = mock.Mock(operation_time=Timestamp(1700000000, 1), cluster_time=cluster_time)
+        token = replication.encode_causal_token(session)
+        self.assertEqual(replication.decode_causal_token(token), (Timestamp(1700000000, 1), cluster_time))
+
+    def test_no_token_without_operations(self):
+        self.assertIsNone(replication.encode_causal_token(mock.Mock(operation_time=None)))
+
+    def test_raises_on_invalid_token(self):
+        for token in ('invalid', 'ä', 'e30=', ''):
+            with self.subTest(token=token), self.assertRaises(replication.CausalTokenError):
+                replication.decode_causal_token(token)
+
+
+class TestReplicationMonitor(testing.AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db = mock.Mock(replica_set_status=mock.AsyncMock(return_value=_status()))
+
+    @testing.gen_test
+    async def test_tracks_secondaries_within_max_staleness(self):
+        monitor = replication.ReplicationMonitor(self.db, 10)
+        self.assertEqual(monitor.fresh_secondaries, frozenset())
+        await monitor.update()
+        self.assertEqual(monitor.fresh_secondaries, frozenset(['db2:27017']))
+        self.assertEqual(REGISTRY.gauge('replication.db3:27017.lag_seconds', '').value, 60.0)
+        self.assertEqual(REGISTRY.gauge('replication.fresh_secondaries', '').value, 1)
+
+    @testing.gen_test
+    async def test_members_with_unknown_lag_are_stale(self):
+        self.db.replica_set_status.return_value = _status(lags={'db1:27017': 0.0, 'db2:27017': None})
+        monitor = replication.ReplicationMonitor(self.db, 10)
+        await monitor.update()
+        self.assertEqual(monitor.fresh_secondaries, frozenset())
+
+    @testing.gen_test
+    async def test_selects_primary_and_fresh_secondaries(self):
+        monitor = replication.ReplicationMonitor(self.db, 10)
+        servers = [_server('db1', writable=True), _server('db2'), _server('db3')]
+        self.assertEqual(monitor.select_servers(servers), servers[:1])
+        await monitor.update()
+        self.assertEqual(monitor.select_servers(servers), servers[:2])
+        self.assertEqual(monitor.select_servers(servers[2:]), [])
+
+    @testing.gen_test
+    async def test_applies_read_preference_to_fresh_members(self):
+        servers = [_server('db1', writable=True), _server('db2'), _server('db3')]
+        expected = {ReadPreference.SECONDARY_PREFERRED: (servers[:1], servers[1:2]),
+                    ReadPreference.SECONDARY: ([], servers[1:2]),
+                    ReadPreference.PRIMARY_PREFERRED: (servers[:1], servers[:1])}
+        for read_preference, (stale, fresh) in expected.items():
+            with self.subTest(read_preference=read_preference):
+                monitor = replication.ReplicationMonitor(self.db, 10, read_preference=read_preference)
+                self.assertEqual(monitor.select_servers(servers), stale)
+                await monitor.update()
+                self.assertEqual(monitor.select_servers(servers), fresh)
+                self.assertEqual(monitor.select_servers(servers[1:]), servers[1:2])
+
+    @testing.gen_test
+    async def test_keeps_state_on_failure(self):
+        monitor = replication.ReplicationMonitor(self.db, 10)
+        await monitor.update()
+        self.db.replica_set_status.side_effect = ConnectionError('unreachable')
+        errors_before = REGISTRY.counter('replication.errors', '').value
+        with self.assertLogs(replication._logger, level='ERROR'):
+            await monitor.update()
+        self.assertEqual(monitor.fresh_secondaries, frozenset(['db2:27017']))
+        self.assertEqual(REGISTRY.counter('replication.errors', '').value - errors_before, 1)
+
+
+class TestReadRouting(testing.AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = mock.MagicMock()
+        for patcher in (mock.patch.object(database, 'MotorClient'),
+                        mock.patch.object(controller, 'MotorClient', return_value=self.client)):
+            self.mock_MotorClient = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _db(self, **kwargs):
+        return controller.CDCAggDatabase([], 'cdcagg', 'reader_uri', 'editor_uri', **kwargs)
+
+    def test_reads_from_primary_by_default(self):
+        db = self._db()
+        self.assertIsNone(db.replication_monitor)
+        self.assertEqual(db.reader_collection('studies'), self.client['cdcagg']['studies'])
+        self.mock_MotorClient.assert_called_once_with('reader_uri')
+
+    def test_uses_read_preference_without_tracking_lag(self):
+        db = self._db(read_preference='secondaryPreferred')
+        self.assertIsNone(db.replication_monitor)
+        self.assertEqual(db.reader_collection('studies'), self.client['cdcagg']['studies'])
+        self.mock_MotorClient.assert_called_once_with('reader_uri',
+                                                      read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    def test_selects_members_by_replication_lag(self):
+        db = self._db(read_preference='secondary', max_staleness_seconds=10)
+        self.assertEqual(db.reader_collection('studies'), self.client['cdcagg']['studies'])
+        self.mock_MotorClient.assert_called_once_with('reader_uri', read_preference=ReadPreference.NEAREST,
+                                                      server_selector=db.replication_monitor.select_servers)
+        self.assertEqual(db.replication_monitor.read_preference, ReadPreference.SECONDARY)
+
+    def test_shares_read_preference_with_kuha_reads(self):
+        db = self._db(read_preference='secondaryPreferred')
+        db.reader_collection('studies')
+        self.assertIs(db._get_reader_client(), self.client)
+        self.mock_MotorClient.assert_called_once_with('reader_uri',
+                                                      read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    @testing.gen_test
+    async def test_replica_set_status(self):
+        now = datetime.datetime(2024, 6, 1)
+        self.client.admin.command = mock.AsyncMock(return_value={'members': [
+            {'name': 'db1:27017', 'stateStr': 'PRIMARY', 'health': 1, 'optimeDate': now},
+            {'name': 'db2:27017', 'stateStr': 'SECONDARY', 'health': 1,
+             'optimeDate': now - datetime.timedelta(seconds=3)},
+            {'name': 'db3:27017', 'stateStr': '(not reachable/healthy)', 'health': 0}]})
+        status = await self._db().replica_set_status()
+        self.client.admin.command.assert_awaited_once_with('replSetGetStatus')
+        self.assertEqual(status, {'primary': 'db1:27017', 'members': [
+            {'address': 'db1:27017', 'type': 'PRIMARY', 'lag_seconds': 0.0},
+            {'address': 'db2:27017', 'type': 'SECONDARY', 'lag_seconds': 3.0},
+            {'address': 'db3:27017', 'type': '(not reachable/healthy)', 'lag_seconds': None}]})
+
+    @testing.gen_test
+    async def test_replica_set_status_falls_back_if_unauthorized(self):
+        self.client.admin.command = mock.AsyncMock(side_effect=OperationFailure('unauthorized', code=13))
+        db = self._db()
+        db.replication_status = mock.AsyncMock(return_value=_status())
+        self.assertEqual(await db.replica_set_status(), _status())
+
+    @testing.gen_test
+    async def test_causal_session_advances_to_token_times(self):
+        session = mock.MagicMock()
+        session.__aenter__.return_value = session
+        self.client.start_session = mock.AsyncMock(return_value=session)
+        cluster_time = {'clusterTime': Timestamp(1700000000, 2)}
+        async with self._db().causal_session('reader', (Timestamp(1700000000, 1), cluster_time)) as rval:
+            self.assertIs(rval, session)
+        self.client.start_session.assert_awaited_once_with(causal_consistency=True)
+        session.advance_cluster_time.assert_called_once_with(cluster_time)
+        session.advance_operation_time.assert_called_once_with(Timestamp(1700000000, 1))
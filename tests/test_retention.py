@@ -0,0 +1,86 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from argparse import Namespace
+from unittest import mock
+from tornado import testing
+
+from cdcagg_docstore import retention
+from cdcagg_docstore.metrics import REGISTRY
+
+
+class TestRetentionPurge(testing.AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db = mock.Mock(purge_deleted=mock.AsyncMock())
+        self.now = datetime.datetime(2024, 6, 1)
+
+    @testing.gen_test
+    async def test_purges_in_batches_until_exhausted(self):
+        self.db.purge_deleted.side_effect = [2, 2, 1]
+        purge = retention.RetentionPurge(self.db, ['studies'], 30, batch_size=2, pause=0)
+        purged_before = REGISTRY.counter('retention.studies.purged', '').value
+        result = await purge.run(now=self.now)
+        self.assertEqual(result, {'studies': 5})
+        self.assertEqual(self.db.purge_deleted.await_args_list,
+                         [mock.call('studies', datetime.datetime(2024, 5, 2), 2)] * 3)
+        self.assertEqual(REGISTRY.counter('retention.studies.purged', '').value - purged_before, 5)
+
+    @testing.gen_test
+    async def test_defaults_to_current_utc_time(self):
+        self.db.purge_deleted.return_value = 0
+        purge = retention.RetentionPurge(self.db, ['studies'], 30)
+        before = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        await purge.run()
+        (_, deleted_before, _), _ = self.db.purge_deleted.await_args
+        self.assertIsNone(deleted_before.tzinfo)
+        self.assertGreaterEqual(deleted_before, before - datetime.timedelta(days=30))
+
+    @testing.gen_test
+    async def test_pauses_between_batches(self):
+        self.db.purge_deleted.side_effect = [2, 0]
+        purge = retention.RetentionPurge(self.db, ['studies'], 30, batch_size=2, pause=0.5)
+        with mock.patch.object(retention.gen, 'sleep', new=mock.AsyncMock()) as mock_sleep:
+            await purge.run(now=self.now)
+        mock_sleep.assert_awaited_once_with(0.5)
+
+    @testing.gen_test
+    async def test_counts_errors(self):
+        self.db.purge_deleted.side_effect = ValueError('boom')
+        purge = retention.RetentionPurge(self.db, ['studies'], 30)
+        errors_before = REGISTRY.counter('retention.errors', '').value
+        with self.assertLogs(retention._logger, level='ERROR'):
+            self.assertEqual(await purge.run(now=self.now), {})
+        self.assertEqual(REGISTRY.counter('retention.errors', '').value - errors_before, 1)
+        self.assertFalse(purge._running)
+
+
+class TestPurgeFromSettings(testing.AsyncTestCase):
+
+    def _settings(self, **kwargs):
+        settings = dict(retention_days=30, retention_purge_batch_size=100,
+                        retention_purge_pause=0.1, retention_purge_interval=60)
+        settings.update(kwargs)
+        return Namespace(**settings)
+
+    def test_zero_disables_retention(self):
+        self.assertIsNone(retention.purge_from_settings(mock.Mock(), ['studies'], self._settings(retention_days=0)))
+
+    def test_returns_purge(self):
+        purge = retention.purge_from_settings(mock.Mock(), ['studies'], self._settings())
+        self.assertEqual(purge.retention, datetime.timedelta(days=30))
+        self.assertEqual(purge.batch_size, 100)
+        self.assertEqual(purge.pause, 0.1)
+        self.assertEqual(purge.interval, 60)
@@ -21,8 +21,15 @@ class TestConfigure(KuhaUnitTestCase):
     def setUp(self):
         super().setUp()
         self._mock_conf = self.init_patcher(mock.patch.object(serve, 'conf'))
-        self._mock_controller_add_cli_args = self.init_patcher(mock.patch.object(serve.controller, 'add_cli_args'))
+        self._mock_controller_add_cli_args = self.init_patcher(mock.patch('cdcagg_docstore.controller.add_cli_args'))
         self._mock_server_add_cli_args = self.init_patcher(mock.patch.object(serve.server, 'add_cli_args'))
+        self._mock_http_api_add_cli_args = self.init_patcher(mock.patch.object(serve.http_api, 'add_cli_args'))
+        self._mock_retention_add_cli_args = self.init_patcher(mock.patch.object(serve.retention, 'add_cli_args'))
+        self._mock_bulk_delete_add_cli_args = self.init_patcher(mock.patch.object(serve.bulk_delete,
+                                                                                  'add_cli_args'))
+        self._mock_loop_monitor_add_cli_args = self.init_patcher(mock.patch.object(serve.loop_monitor,
+                                                                                   'add_cli_args'))
+        self._mock_health_add_cli_args = self.init_patcher(mock.patch.object(serve.health, 'add_cli_args'))
         self._mock_setup_app_logging = self.init_patcher(mock.patch.object(serve, 'setup_app_logging'))
         self._mock_set_ctx_populator = self.init_patcher(mock.patch.object(serve, 'set_ctx_populator'))
 
@@ -34,7 +41,12 @@ class TestConfigure(KuhaUnitTestCase):
     def test_calls_add_cli_args(self):
         serve.configure()
         self._mock_server_add_cli_args.assert_called_once_with()
+        self._mock_http_api_add_cli_args.assert_called_once_with(self._mock_conf)
         self._mock_controller_add_cli_args.assert_called_once_with(self._mock_conf)
+        self._mock_retention_add_cli_args.assert_called_once_with(self._mock_conf)
+        self._mock_bulk_delete_add_cli_args.assert_called_once_with(self._mock_conf)
+        self._mock_loop_monitor_add_cli_args.assert_called_once_with(self._mock_conf)
+        self._mock_health_add_cli_args.assert_called_once_with(self._mock_conf)
 
     def test_calls_conf_add_correctly(self):
         serve.configure()
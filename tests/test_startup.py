@@ -0,0 +1,82 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Startup benchmark based on ``python -X importtime``.
+
+Imports entrypoint modules in a fresh interpreter and enforces a
+budget for their cumulative import time. The budget in milliseconds
+may be overridden with environment variable CDCAGG_STARTUP_BUDGET_MS.
+"""
+
+import os
+import sys
+import subprocess
+from unittest import TestCase
+
+
+STARTUP_BUDGET_MS = int(os.environ.get('CDCAGG_STARTUP_BUDGET_MS', 1500))
+
+
+def _importtime(module, *check_loaded):
+    """Import module in a fresh interpreter.
+
+    :returns: Tuple of cumulative import times in microseconds keyed
+              by module name, and names of `check_loaded` modules
+              that got imported.
+    """
+    code = 'import sys, %s; print(",".join(name for name in %r if name in sys.modules))' % (
+        module, check_loaded)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumul, name = line[len('import time:'):].split('|')
+        if cumul.strip().isdigit():
+            cumulative[name.strip()] = int(cumul)
+    loaded = [name for name in proc.stdout.strip().split(',') if name]
+    return cumulative, loaded
+
+
+class TestStartup(TestCase):
+
+    def test_serve_defers_request_handling_imports(self):
+        _, loaded = _importtime('cdcagg_docstore.serve',
+                                'cdcagg_docstore.handlers', 'cdcagg_docstore.mdb',
+                                'kuha_document_store.handlers', 'cdcagg_common')
+        self.assertEqual(loaded, [])
+
+    def test_serve_defers_database_driver_imports(self):
+        _, loaded = _importtime('cdcagg_docstore.serve',
+                                'cdcagg_docstore.controller', 'kuha_document_store.database',
+                                'motor', 'pymongo')
+        self.assertEqual(loaded, [])
+
+    def test_db_admin_defers_record_imports(self):
+        _, loaded = _importtime('cdcagg_docstore.db_admin',
+                                'cdcagg_docstore.handlers', 'cdcagg_docstore.mdb', 'cdcagg_common')
+        self.assertEqual(loaded, [])
+
+    def test_db_admin_defers_database_driver_imports(self):
+        _, loaded = _importtime('cdcagg_docstore.db_admin',
+                                'cdcagg_docstore.controller', 'kuha_document_store.database',
+                                'motor', 'pymongo')
+        self.assertEqual(loaded, [])
+
+    def test_serve_import_within_budget(self):
+        cumulative, _ = _importtime('cdcagg_docstore.serve')
+        self.assertLess(cumulative['cdcagg_docstore.serve'] / 1000, STARTUP_BUDGET_MS)
+
+    def test_db_admin_import_within_budget(self):
+        cumulative, _ = _importtime('cdcagg_docstore.db_admin')
+        self.assertLess(cumulative['cdcagg_docstore.db_admin'] / 1000, STARTUP_BUDGET_MS)
@@ -0,0 +1,186 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import (
+    TestCase,
+    mock
+)
+from tornado import testing
+from tornado.concurrent import Future
+
+from cdcagg_docstore import streaming
+
+
+class TestAdaptiveBatchSize(TestCase):
+
+    def test_grows_on_fast_flush_up_to_maximum(self):
+        sizer = streaming.AdaptiveBatchSize(100, 300)
+        sizer.record_flush(0)
+        self.assertEqual(sizer.end_batch(), 200)
+        self.assertEqual(sizer.end_batch(), 300)
+        self.assertEqual(sizer.end_batch(), 300)
+
+    def test_shrinks_on_slow_flush_down_to_initial(self):
+        sizer = streaming.AdaptiveBatchSize(100, 1000)
+        sizer.size = 400
+        for _ in range(3):
+            sizer.record_flush(1)
+        self.assertEqual(sizer.end_batch(), 200)
+        sizer.record_flush(1)
+        self.assertEqual(sizer.end_batch(), 100)
+        sizer.record_flush(1)
+        self.assertEqual(sizer.end_batch(), 100)
+
+    def test_keeps_size_between_thresholds(self):
+        sizer = streaming.AdaptiveBatchSize(100, 1000, fast_flush=0.01, slow_flush=0.1)
+        sizer.record_flush(0.05)
+        self.assertEqual(sizer.end_batch(), 100)
+
+    def test_sums_flushes_of_batch(self):
+        sizer = streaming.AdaptiveBatchSize(100, 1000, fast_flush=0.01, slow_flush=0.1)
+        for _ in range(3):
+            sizer.record_flush(0.04)
+        self.assertEqual(sizer.end_batch(), 100)
+        # Flush durations of the previous batch are not carried over.
+        sizer.record_flush(0.001)
+        self.assertEqual(sizer.end_batch(), 200)
+
+
+class _Cursor:
+    """Aggregation cursor stand-in."""
+
+    def __init__(self, documents):
+        self._documents = iter(documents)
+        self.delegate = mock.Mock()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class TestAdaptiveBatches(testing.AsyncTestCase):
+
+    @testing.gen_test
+    async def test_adapts_once_per_batch(self):
+        sizer = streaming.AdaptiveBatchSize(2, 100)
+        cursor = _Cursor(range(11))
+        sizes = []
+        async for _ in streaming.adaptive_batches(cursor, sizer):
+            # A fast flush of every document.
+            sizer.record_flush(0)
+            sizes.append(sizer.size)
+        self.assertEqual(sizes, [2, 2, 4, 4, 4, 4, 8, 8, 8, 8, 8])
+        self.assertEqual(cursor.delegate.batch_size.call_args_list, [mock.call(4), mock.call(8)])
+
+    @testing.gen_test
+    async def test_keeps_cursor_batch_size_while_size_is_unchanged(self):
+        sizer = streaming.AdaptiveBatchSize(2, 2)
+        cursor = _Cursor(range(6))
+        documents = [document async for document in streaming.adaptive_batches(cursor, sizer)]
+        self.assertEqual(documents, list(range(6)))
+        cursor.delegate.batch_size.assert_not_called()
+
+
+class _SlowClientHandler:
+    """Request handler stand-in for a client that reads only when told to."""
+
+    def __init__(self, reads_immediately=False):
+        self.reads_immediately = reads_immediately
+        self.pending = 0
+        self.max_pending = 0
+        self.written = 0
+        self.flushes = []
+
+    def write(self, chunk):
+        self.pending += len(chunk)
+        self.max_pending = max(self.max_pending, self.pending)
+
+    def flush(self):
+        future = Future()
+        self.flushes.append(future)
+        if self.reads_immediately:
+            self.client_reads()
+        return future
+
+    def client_reads(self):
+        self.written += self.pending
+        self.pending = 0
+        self.flushes.pop(0).set_result(None)
+
+
+class TestBackPressureWriter(testing.AsyncTestCase):
+
+    async def _produce(self, writer, chunks, produced):
+        for chunk in chunks:
+            await writer.write(chunk)
+            produced.append(chunk)
+
+    @testing.gen_test
+    async def test_pauses_producer_until_slow_client_reads(self):
+        handler = _SlowClientHandler()
+        writer = streaming.BackPressureWriter(handler, high_water_mark=4096)
+        produced = []
+        task = asyncio.ensure_future(self._produce(writer, [b'x' * 1024] * 100, produced))
+        for _ in range(25):
+            while not handler.flushes:
+                await asyncio.sleep(0)
+            # Producer is paused while the client has not read.
+            for _ in range(3):
+                await asyncio.sleep(0)
+            self.assertEqual(len(handler.flushes), 1)
+            self.assertEqual(handler.pending, 4096)
+            handler.client_reads()
+        await task
+        self.assertEqual(len(produced), 100)
+        self.assertEqual(handler.written, 100 * 1024)
+        self.assertEqual(handler.max_pending, 4096)
+
+    @testing.gen_test
+    async def test_buffered_output_stays_bounded_regardless_of_result_size(self):
+        handler = _SlowClientHandler(reads_immediately=True)
+        writer = streaming.BackPressureWriter(handler, high_water_mark=10000)
+        for chunk_size in (100, 3000, 9999, 20000):
+            await self._produce(writer, [b'x' * chunk_size] * 1000, [])
+        self.assertLess(handler.max_pending, 10000 + 20000)
+
+    @testing.gen_test
+    async def test_zero_high_water_mark_drains_every_chunk(self):
+        handler = mock.Mock(flush=mock.Mock(side_effect=_resolved))
+        sizer = streaming.AdaptiveBatchSize(100, 1000)
+        writer = streaming.BackPressureWriter(handler, high_water_mark=0, batch_sizer=sizer)
+        await self._produce(writer, ['a', 'b', 'c'], [])
+        self.assertEqual(handler.flush.call_count, 3)
+        # Batch size adapts per batch, not per flush.
+        self.assertEqual(sizer.size, 100)
+        self.assertEqual(sizer.end_batch(), 200)
+
+    @testing.gen_test
+    async def test_counts_bytes_of_str_chunks(self):
+        handler = mock.Mock(flush=mock.Mock(side_effect=_resolved))
+        writer = streaming.BackPressureWriter(handler, high_water_mark=8)
+        await writer.write('ääää')
+        handler.write.assert_called_once_with('ääää'.encode('utf-8'))
+        handler.flush.assert_called_once_with()
+        self.assertEqual(writer.buffered, 0)
+
+
+def _resolved():
+    future = Future()
+    future.set_result(None)
+    return future
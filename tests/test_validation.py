@@ -0,0 +1,133 @@
+# Copyright CESSDA ERIC 2021-2025
+#
+# Licensed under the EUPL, Version 1.2 (the "License"); you may not
+# use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import pickle
+import threading
+from unittest import TestCase
+from tornado import testing
+
+from kuha_document_store.validation import RecordValidationError
+from cdcagg_common.records import Study
+from cdcagg_docstore import validation
+from cdcagg_docstore.controller import CDCAggDatabase
+from cdcagg_docstore.metrics import REGISTRY
+
+
+def _valid_study_dict():
+    study = Study()
+    study.add_study_number('some_study_number')
+    study.set_direct_base_url('some.url')
+    study.set_aggregator_identifier('6eb05b9342cc92e9a09de18df0a34318b9913c69e3d78b0222fb2f7cdf0ba9a3')
+    return study.export_dict()
+
+
+class TestDocumentValidator(testing.AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.schema = self.io_loop.run_sync(lambda: CDCAggDatabase._prepare_validation_schema(Study))
+
+    def _counts(self):
+        return (REGISTRY.histogram('validation.seconds', '').count,
+                REGISTRY.counter('validation.offloaded', '').value)
+
+    @testing.gen_test
+    async def test_validates_inline(self):
+        validator = validation.DocumentValidator()
+        seconds_before, offloaded_before = self._counts()
+        await validator.validate(self.schema, 'studies', _valid_study_dict())
+        with self.assertRaises(validation.DocumentValidationError) as cm:
+            await validator.validate(self.schema, 'studies', {'key': 'value'})
+        self.assertEqual(cm.exception.args[0], 'Validation of studies failed')
+        self.assertEqual(cm.exception.args[1]['key'], ['unknown field'])
+        seconds_after, offloaded_after = self._counts()
+        self.assertEqual(seconds_after - seconds_before, 2)
+        self.assertEqual(offloaded_after, offloaded_before)
+
+    @testing.gen_test
+    async def test_offloads_large_documents_to_thread_pool(self):
+        validator = validation.DocumentValidator(validation.POOL_THREAD, pool_size=1, size_threshold=100)
+        self.addCleanup(validator.close)
+        _, offloaded_before = self._counts()
+        await validator.validate(self.schema, 'studies', _valid_study_dict(), document_size=99)
+        self.assertIsNone(validator._executor)
+        with self.assertRaises(validation.DocumentValidationError):
+            await validator.validate(self.schema, 'studies', {'key': 'value' * 100})
+        self.assertIsNotNone(validator._executor)
+        self.assertEqual(self._counts()[1] - offloaded_before, 1)
+
+    @testing.gen_test
+    async def test_prevalidates_large_documents_in_pool(self):
+        validator = validation.DocumentValidator(validation.POOL_THREAD, pool_size=1, size_threshold=100)
+        self.addCleanup(validator.close)
+        _, offloaded_before = self._counts()
+        self.assertFalse(await validator.prevalidate('studies', {'key': 'value'}, document_size=99))
+        self.assertIsNone(validator._executor)
+        self.assertTrue(await validator.prevalidate('studies', {'study_number': 'value'}, document_size=100,
+                                                    update=True))
+        with self.assertRaises(validation.DocumentValidationError):
+            await validator.prevalidate('studies', {'key': 'value'}, document_size=100, update=True)
+        self.assertEqual(self._counts()[1] - offloaded_before, 2)
+
+    def test_raises_on_invalid_pool_type(self):
+        with self.assertRaises(ValueError):
+            validation.DocumentValidator('invalid')
+
+
+class TestPrevalidatedSchema(TestCase):
+
+    def setUp(self):
+        self.schema = asyncio.run(CDCAggDatabase._prepare_validation_schema(Study))
+
+    def test_skips_prevalidated_documents(self):
+        with validation.prevalidated({'key': 'value'}):
+            self.schema.validate({'key': 'value'})
+        with self.assertRaises(RecordValidationError):
+            self.schema.validate({'key': 'value'})
+
+    def test_validates_other_documents(self):
+        with validation.prevalidated(_valid_study_dict()):
+            with self.assertRaises(RecordValidationError):
+                self.schema.validate({'key': 'value'})
+
+    def test_validates_documents_prevalidated_with_other_arguments(self):
+        with validation.prevalidated({'key': 'value'}, update=True):
+            with self.assertRaises(RecordValidationError):
+                self.schema.validate({'key': 'value'})
+
+
+class TestWorkerValidate(TestCase):
+
+    def test_validates_with_schema_of_collection(self):
+        validation._worker_validate('studies', _valid_study_dict())
+        with self.assertRaises(validation.DocumentValidationError):
+            validation._worker_validate('studies', {'key': 'value'})
+
+    def test_threads_validate_with_schemas_of_their_own(self):
+        schemas = []
+        threads = [threading.Thread(target=lambda: schemas.append(validation._thread_schema('studies')))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIsNot(schemas[0], schemas[1])
+        self.assertIs(validation._thread_schema('studies'), validation._thread_schema('studies'))
+        validation._thread_validate('studies', _valid_study_dict())
+        with self.assertRaises(validation.DocumentValidationError):
+            validation._thread_validate('studies', {'key': 'value'})
+
+    def test_error_can_be_passed_between_processes(self):
+        exc = validation.DocumentValidationError('Validation of studies failed', {'key': ['unknown field']})
+        self.assertEqual(pickle.loads(pickle.dumps(exc)).args, exc.args)